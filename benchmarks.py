@@ -0,0 +1,921 @@
+import argparse
+import array
+import asyncio
+import gc
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from collections import defaultdict
+
+# Бенчмарки запускаются без настоящего Telegram: токен-заглушка нужен только
+# для сборки Application.
+os.environ.setdefault("BOT_TOKEN", "123456:benchmark")
+
+import httpx
+from telegram import Update
+from telegram.ext import TypeHandler
+
+import callback_data as cb
+from config import Config
+from database import db
+from fake_telegram import FakeTelegramRequest, UpdateFactory
+
+# Исходящие лимиты снимаем: считаем запросы, а не ждём токены.
+Config.OUTBOUND_GLOBAL_RATE = 1_000_000
+Config.OUTBOUND_CHAT_RATE = 1_000_000
+Config.OUTBOUND_CHAT_BURST = 1_000_000
+Config.TURN_TIMEOUT = 0
+Config.OUTBOUND_STATS_INTERVAL = 0
+# Сценарии шлют сотни апдейтов от одного игрока подряд; ограничение входящих
+# включает только сценарий throttle.
+Config.THROTTLE_RATE = 0
+Config.METRICS_PORT = 0
+
+
+def percentile(values, q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+
+def use_temp_database():
+    tmp = tempfile.mkdtemp(prefix="tod-bench-")
+    db.open(os.path.join(tmp, "bench.db"))
+    return tmp
+
+
+class Harness:
+    # Настоящее Application с обработчиками start_bot.py поверх поддельного транспорта.
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0):
+        from start_bot import TruthOrDareBot, build_application
+
+        self.request = FakeTelegramRequest(latency=latency, jitter=jitter)
+        self.bot_logic = TruthOrDareBot()
+        self.app = build_application(self.bot_logic, request=self.request)
+        self.updates = UpdateFactory()
+
+    async def __aenter__(self):
+        await self.app.initialize()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.app.shutdown()
+
+    async def feed(self, payload):
+        await self.app.process_update(Update.de_json(payload, self.app.bot))
+
+    async def enqueue(self, payload):
+        # Через очередь приложения: апдейты обрабатываются так же, как при
+        # polling/webhook, с учётом CONCURRENT_UPDATES (нужен app.start()).
+        await self.app.update_queue.put(Update.de_json(payload, self.app.bot))
+
+    async def message(self, user_id: int, text: str):
+        await self.feed(self.updates.message(user_id, text))
+
+    async def callback(self, user_id: int, data: str, message_id=None):
+        await self.feed(self.updates.callback(user_id, data, message_id))
+
+    async def start_friend_game(self, players: list[int]):
+        host = players[0]
+        for uid in players:
+            await self.message(uid, "/start")
+        await self.callback(host, cb.encode(cb.GAME_FRIEND))
+        game_state = self.bot_logic.game_logic.get_game_for_user(host)
+        for uid in players[1:]:
+            await self.callback(uid, cb.encode(cb.JOIN, game_state.invite_code))
+        await self.callback(host, cb.encode(cb.START_FRIEND, game_state.id))
+        return game_state
+
+    async def play_turn(self, game_state, kind: str = "truth"):
+        player = game_state.current_player
+        action = cb.TRUTH if kind == "truth" else cb.DARE
+        await self.callback(player, cb.encode(action, game_state.id), game_state.panels.get(player))
+        await self.message(player, "Мой ответ")
+
+
+async def bench_coalescing(args):
+    results = {}
+    for enabled in (False, True):
+        Config.COALESCE_MESSAGES = enabled
+        async with Harness() as h:
+            players = list(range(1000, 1000 + args.players))
+            game_state = await h.start_friend_game(players)
+            h.request.reset()
+            started = time.perf_counter()
+            for _ in range(args.turns):
+                await h.play_turn(game_state)
+            elapsed = time.perf_counter() - started
+            new = h.request.calls["sendMessage"]
+            sends = new + h.request.calls["editMessageText"]
+            results[enabled] = sends / args.turns
+            print(
+                f"склейка {'вкл ' if enabled else 'выкл'}: "
+                f"{sends / args.turns:.1f} сообщений/ход (новых {new / args.turns:.1f}), "
+                f"{h.request.total_calls / args.turns:.1f} вызовов API/ход, "
+                f"{elapsed / args.turns * 1000:.2f} мс/ход"
+            )
+    print(f"сокращение: {(1 - results[True] / results[False]) * 100:.0f}%")
+
+
+async def bench_webhook(args):
+    # Поднимаем встроенный вебхук-сервер PTB на localhost, шлём ему синтетические
+    # апдейты по HTTP и меряем время от POST до завершения обработчиков.
+    secret = "benchmark-secret"
+    url = f"http://127.0.0.1:{args.port}/telegram"
+    async with Harness() as h:
+        posted = {}
+        done = {}
+        finished = asyncio.Event()
+
+        async def mark_done(update, context):
+            done[update.update_id] = time.perf_counter()
+            if len(done) >= args.updates:
+                finished.set()
+
+        h.app.add_handler(TypeHandler(Update, mark_done), group=99)
+        await h.app.start()
+        await h.app.updater.start_webhook(
+            listen="127.0.0.1",
+            port=args.port,
+            url_path="telegram",
+            webhook_url="https://bot.example/telegram",
+            secret_token=secret,
+        )
+        try:
+            async with httpx.AsyncClient() as client:
+                rejected = await client.post(url, json=h.updates.message(1, "/start"))
+                print(f"без секрета: HTTP {rejected.status_code}")
+                semaphore = asyncio.Semaphore(args.concurrency)
+
+                async def post(payload):
+                    async with semaphore:
+                        posted[payload["update_id"]] = time.perf_counter()
+                        response = await client.post(
+                            url,
+                            json=payload,
+                            headers={"X-Telegram-Bot-Api-Secret-Token": secret},
+                        )
+                        response.raise_for_status()
+
+                payloads = [h.updates.message(2000 + i % args.users, "/start") for i in range(args.updates)]
+                started = time.perf_counter()
+                await asyncio.gather(*(post(payload) for payload in payloads))
+                await asyncio.wait_for(finished.wait(), timeout=60)
+                elapsed = time.perf_counter() - started
+        finally:
+            await h.app.updater.stop()
+            await h.app.stop()
+    latencies = [(done[uid] - posted[uid]) * 1000 for uid in posted if uid in done]
+    print(
+        f"апдейтов {len(latencies)} за {elapsed:.2f} с ({len(latencies) / elapsed:.0f}/с), "
+        f"задержка p50 {percentile(latencies, 0.5):.1f} мс, "
+        f"p99 {percentile(latencies, 0.99):.1f} мс, макс {max(latencies):.1f} мс"
+    )
+
+
+async def bench_scaleout(args):
+    # Приёмник раздаёт синтетические апдейты процессам-воркерам с поддельным
+    # транспортом; замер — от первого апдейта до полной обработки всех, без
+    # времени запуска процессов. Сначала проверяется маршрутизация: кнопки
+    # игры и коды приглашений должны попадать к воркеру, создавшему игру.
+    from game_ids import GameIdGenerator
+    from invite_codes import InviteCodeAllocator
+    from scaleout import MATCHMAKING_WORKER, UpdateRouter, WorkerPool, home_worker
+
+    secret = "benchmark-secret"
+    router = UpdateRouter(args.workers, secret)
+    misrouted = 0
+    for worker in range(args.workers):
+        game_id = GameIdGenerator(worker).next_id()
+        code = InviteCodeAllocator(worker, secret=secret).allocate(game_id)
+        # Код текстом — к воркеру комнаты только сразу после «Ввести код»,
+        # и тот получает его командой /join.
+        router.route(UpdateFactory().callback(1, cb.encode(cb.FRIEND_ENTER_CODE)))
+        entered = UpdateFactory().message(1, code.lower())
+        checks = [
+            router.route(h) for h in (
+                entered,
+                UpdateFactory().callback(1, cb.encode(cb.TRUTH, game_id)),
+                UpdateFactory().callback(1, cb.encode(cb.JOIN, code)),
+                UpdateFactory().message(1, f"/join {code.lower()}"),
+            )
+        ]
+        misrouted += sum(1 for routed in checks if routed != worker)
+        misrouted += entered["message"]["text"] != f"/join {code.lower()}"
+        # Пункт меню завершает ожидание кода; тот же текст без нажатия
+        # кнопки — обычное сообщение игрока.
+        router.route(UpdateFactory().message(1, "📊 Статистика"))
+        misrouted += router.route(UpdateFactory().message(1, code.lower())) != home_worker(1, args.workers)
+        # Случайный поиск — в общую очередь, даже из неначатой комнаты.
+        router.bind(2, worker)
+        misrouted += router.route(UpdateFactory().callback(2, cb.encode(cb.GAME_RANDOM))) != MATCHMAKING_WORKER
+    print(f"маршрутизация по игре и коду: ошибок {misrouted}")
+
+    updates = UpdateFactory()
+    texts = ["/start", "📊 Статистика", "⚙️ Настройки", "🎮 Найти игру"]
+    buttons = [cb.encode(cb.GAME_CATEGORIES), cb.encode(cb.CATEGORY_TOGGLE, "flirt")]
+    payloads = []
+    for i in range(args.updates):
+        user_id = 3000 + i % args.users
+        step = i // args.users
+        if step % 3 == 2:
+            payloads.append(updates.callback(user_id, buttons[step % len(buttons)]))
+        else:
+            payloads.append(updates.message(user_id, texts[step % len(texts)]))
+
+    results = {}
+    for workers in sorted({1, args.workers}):
+        pool = WorkerPool(workers, secret, request_factory=FakeTelegramRequest)
+        pool.start()
+        if not pool.wait_ready(timeout=120):
+            print(f"воркеров {workers}: не запустились")
+            pool.stop()
+            continue
+        started = time.perf_counter()
+        for payload in payloads:
+            pool.dispatch(payload)
+        stopped = pool.stop(timeout=600)
+        elapsed = time.perf_counter() - started
+        results[workers] = elapsed
+        share = ", ".join(f"{count}" for _, count in sorted(pool.router.routed.items()))
+        print(
+            f"воркеров {workers}: {len(payloads)} апдейтов за {elapsed:.2f} с "
+            f"({len(payloads) / elapsed:.0f}/с), по воркерам [{share}]"
+            f"{'' if stopped else ', не все воркеры завершились'}"
+        )
+    if len(results) == 2:
+        print(f"ускорение: {results[1] / results[args.workers]:.2f}x на {os.cpu_count()} ядрах")
+
+
+async def bench_shutdown(args):
+    # Остановка посреди нагрузки и тёплый старт: в очереди остаются апдейты и
+    # исходящие сообщения, остановка проходит те же фазы, что и по SIGTERM
+    # (длительность каждой — в логе), затем новый экземпляр бота поднимает
+    # снимок и игры продолжаются с того же хода.
+    from lifecycle import stop_with_deadline, timed_phase
+
+    Config.WARM_START = True
+    h = Harness(latency=args.latency / 1000)
+    await h.app.initialize()
+    await h.app.post_init(h.app)
+    games = []
+    for index in range(args.games):
+        base = 20_000 + index * 100
+        game_state = await h.start_friend_game(list(range(base, base + args.players)))
+        await h.play_turn(game_state)
+        games.append(game_state)
+    before = {
+        game_state.id: (game_state.current_player, game_state.moves_done, game_state.invite_code)
+        for game_state in games
+    }
+    await h.app.start()
+    for i in range(args.updates):
+        await h.enqueue(h.updates.message(30_000 + i % args.users, "/start"))
+    started = time.perf_counter()
+    with timed_phase("Остановка", "обработчики и исходящая очередь"):
+        await stop_with_deadline(h.app, Config.SHUTDOWN_DRAIN_TIMEOUT)
+    await h.app.post_stop(h.app)
+    await h.app.shutdown()
+    stopped = time.perf_counter() - started
+    print(f"остановка с {args.updates} апдейтами в очереди: {stopped * 1000:.0f} мс")
+
+    async with Harness() as warm:
+        restart = time.perf_counter()
+        await warm.app.post_init(warm.app)
+        restored = warm.bot_logic.game_logic
+        print(f"тёплый старт: {(time.perf_counter() - restart) * 1000:.0f} мс, игр {len(restored.games)} из {len(games)}")
+        mismatched = 0
+        for game_id, (current, moves, code) in before.items():
+            game_state = restored.get_game_by_id(game_id)
+            if (
+                game_state is None
+                or game_state.current_player != current
+                or game_state.moves_done != moves
+                or restored.resolve_invite(code) != game_id
+            ):
+                mismatched += 1
+                continue
+            await warm.play_turn(game_state)
+            if game_state.moves_done != moves + 1:
+                mismatched += 1
+        print(f"игр, не продолживших с того же хода: {mismatched}")
+        await warm.app.post_stop(warm.app)
+
+
+YOUR_TURN_TEXT = "Теперь твой ход. Выбирай «Правда» или «Действие»."
+
+
+async def bench_concurrency(args):
+    # Стресс-тест очерёдности: args.games игр по args.players игроков ходят
+    # одновременно, ответы транспорта приходят со случайной задержкой. На
+    # каждом такте во все игры разом приходят нажатия «Правда» от всех игроков
+    # (принять должны только у текущего, у него — дважды) и его ответ.
+    # После прогона каждая игра должна продвинуться ровно на args.turns ходов,
+    # а последняя правка каждой панели — совпадать с тем, чей сейчас ход.
+    results = {}
+    for concurrent in (1, args.concurrent_updates):
+        Config.CONCURRENT_UPDATES = concurrent
+        async with Harness(latency=args.latency / 1000, jitter=args.latency / 1000) as h:
+            games = []
+            for index in range(args.games):
+                base = 10_000 + index * 100
+                game_state = await h.start_friend_game(list(range(base, base + args.players)))
+                game_state.max_rounds = args.turns + 1
+                games.append(game_state)
+
+            processed = 0
+            tick_done = asyncio.Event()
+            expected = 0
+
+            async def mark_done(update, context):
+                nonlocal processed
+                processed += 1
+                if processed >= expected:
+                    tick_done.set()
+
+            h.app.add_handler(TypeHandler(Update, mark_done), group=99)
+            await h.app.start()
+            started = time.perf_counter()
+            for _ in range(args.turns):
+                payloads = []
+                for game_state in games:
+                    current = game_state.current_player
+                    panel = game_state.panels.get(current)
+                    truth = cb.encode(cb.TRUTH, game_state.id)
+                    payloads.append(h.updates.callback(current, truth, panel))
+                    for uid in game_state.players:
+                        payloads.append(h.updates.callback(uid, truth, game_state.panels.get(uid)))
+                    payloads.append(h.updates.message(current, "Мой ответ"))
+                expected += len(payloads)
+                tick_done.clear()
+                for payload in payloads:
+                    await h.enqueue(payload)
+                await asyncio.wait_for(tick_done.wait(), timeout=120)
+            elapsed = time.perf_counter() - started
+            await h.app.stop()
+
+            errors = []
+            for game_state in games:
+                if game_state.moves_done != args.turns:
+                    errors.append(f"игра {game_state.id}: ходов {game_state.moves_done} вместо {args.turns}")
+                for uid in game_state.players:
+                    text = h.request.texts.get((uid, game_state.panels.get(uid)), "")
+                    if text.endswith(YOUR_TURN_TEXT) != (uid == game_state.current_player):
+                        errors.append(f"игра {game_state.id}: устаревшая панель у {uid}")
+            results[concurrent] = elapsed
+            locks = h.bot_logic.game_locks.stats()
+            print(
+                f"одновременно {concurrent:>3}: {expected} апдейтов за {elapsed:.2f} с "
+                f"({expected / elapsed:.0f}/с), ожиданий замка игры {locks['contended']}, "
+                f"нарушений порядка {len(errors)}"
+            )
+            for error in errors[:5]:
+                print(f"  {error}")
+    print(f"ускорение: {results[1] / results[args.concurrent_updates]:.1f}x")
+
+
+def legacy_callback_dispatch(data: str):
+    # Цепочка проверок из прежнего handle_callback — для сравнения с CallbackRouter.
+    if data == "game_random":
+        return "start_random_game"
+    if data == "game_friend":
+        return "create_friend_game_callback"
+    if data == "friend_enter_code":
+        return "prompt_join_code"
+    if data == "game_categories":
+        return "show_category_selection"
+    if data in {"game_search_gender", "game_gender_search"}:
+        return "gender_search_callback"
+    if data == "start_gender_search":
+        return "start_premium_search"
+    if data.startswith("pref_gender_"):
+        return "update_search_gender_preference"
+    if data.startswith("cat_"):
+        return "toggle_category"
+    if data == "categories_done":
+        return "save_categories"
+    if data in {"gender_male", "gender_female", "gender_other"}:
+        return "set_gender"
+    if data.startswith("join_"):
+        return "join_friend_game"
+    if data == "cancel_search":
+        return "cancel_random_search"
+    if data.startswith("friend_cats_"):
+        return "edit_friend_categories"
+    if data.startswith("friend_rounds_"):
+        return "prompt_friend_rounds"
+    if data.startswith("friend_round_set_"):
+        return "set_friend_rounds"
+    if data.startswith("friend_players_") and not data.startswith("friend_players_set_"):
+        return "prompt_friend_players"
+    if data.startswith("friend_players_set_"):
+        return "set_friend_players"
+    if data.startswith("friend_back_"):
+        return "show_friend_room_panel"
+    if data.startswith("start_friend_"):
+        return "start_friend_game"
+    if data.startswith("truth_"):
+        return "send_task"
+    if data.startswith("dare_"):
+        return "send_task"
+    if data == "set_age":
+        return "prompt_age_input"
+    if data == "pref_age_edit":
+        return "prompt_search_age_input"
+    if data.startswith("continue_"):
+        return "continue_turn"
+    if data.startswith("skip_"):
+        return "skip_turn"
+    if data.startswith("end_"):
+        return "end_game"
+    if data.startswith("premium_") or data == "premium_status":
+        return "handle_premium_callback"
+    if data == "friend_decline":
+        return "decline_friend_room"
+    if data == "cancel":
+        return "cancel_action"
+    if data == "back_to_menu":
+        return "back_to_menu"
+    return None
+
+
+async def bench_dispatch(args):
+    # Только поиск обработчика по callback_data, без вызова: прежняя цепочка if
+    # по строкам против таблицы маршрутов по сжатым данным. Аргументы в прежней
+    # схеме каждый обработчик разбирал сам, в новой их разбирает и проверяет
+    # декодер — это входит в замер. На типичной смеси нажатий обе схемы дают
+    # около 1 мкс в пределах шума (замер: ~953 нс у цепочки против ~961 нс у
+    # маршрутов); таблица выигрывает только на кнопках из хвоста цепочки и
+    # вдвое короче callback_data, а не по среднему времени.
+    from start_bot import TruthOrDareBot
+
+    router = TruthOrDareBot().callbacks
+    game_id = 59502565256069120
+    legacy = [
+        f"truth_{game_id}", f"dare_{game_id}", f"skip_{game_id}", f"end_{game_id}",
+        f"continue_{game_id}", f"friend_players_set_{game_id}_6", "back_to_menu",
+        "cancel", "game_random", "premium_status", "cat_flirt", "join_K7Q2XM",
+    ]
+    encoded = [
+        cb.encode(cb.TRUTH, game_id), cb.encode(cb.DARE, game_id), cb.encode(cb.SKIP, game_id),
+        cb.encode(cb.END, game_id), cb.encode(cb.CONTINUE, game_id),
+        cb.encode(cb.FRIEND_PLAYERS_SET, game_id, 6), cb.encode(cb.BACK_TO_MENU),
+        cb.encode(cb.CANCEL), cb.encode(cb.GAME_RANDOM), cb.encode(cb.PREMIUM_STATUS),
+        cb.encode(cb.CATEGORY_TOGGLE, "flirt"), cb.encode(cb.JOIN, "K7Q2XM"),
+    ]
+    rounds = args.iterations // len(legacy)
+    cases = (
+        ("цепочка if", legacy_callback_dispatch, legacy),
+        ("маршруты", router.resolve, encoded),
+    )
+    for name, dispatch, sample in cases:
+        started = time.perf_counter()
+        for _ in range(rounds):
+            for data in sample:
+                dispatch(data)
+        elapsed = time.perf_counter() - started
+        size = sum(len(data.encode()) for data in sample) / len(sample)
+        print(f"{name}: {elapsed / (rounds * len(sample)) * 1e9:.0f} нс на нажатие, callback_data в среднем {size:.1f} байт")
+    for name, dispatch, sample in cases:
+        worst = sample[6]
+        started = time.perf_counter()
+        for _ in range(rounds * len(sample)):
+            dispatch(worst)
+        elapsed = time.perf_counter() - started
+        print(f"{name}, {worst!r}: {elapsed / (rounds * len(sample)) * 1e9:.0f} нс")
+    print(f"маршрутов: {len(router)}")
+
+
+def keyboard_workload(game_id: int, players: int):
+    # Клавиатуры, которые строятся за один ход игры с друзьями и одно
+    # открытие меню: панели всех игроков, выбор категорий, премиум.
+    import keyboards
+
+    calls = [(keyboards.game_action_keyboard, (game_id, True))]
+    calls += [(keyboards.game_panel_keyboard, (game_id,))] * (players - 1)
+    calls += [
+        (keyboards.main_menu, ()),
+        (keyboards.game_type_keyboard, ()),
+        (keyboards.premium_keyboard, ()),
+        # categories_keyboard лишь приводит выбор к frozenset и зовёт кешируемую функцию
+        (keyboards._categories_keyboard, (frozenset(["flirt", "funny"]),)),
+        (keyboards.friend_players_keyboard, (game_id, 4)),
+    ]
+    return calls
+
+
+async def bench_keyboards(args):
+    # Построение клавиатур без отправки: каждый раз заново (__wrapped__ —
+    # исходная функция без кеша) против кешированных разметок. Память
+    # считается по объектам, которые остаются живыми, пока разметка
+    # привязана к сообщению.
+    import keyboards
+
+    keyboards.clear_keyboard_caches()
+    calls = keyboard_workload(59502565256069120, args.players)
+    rounds = max(1, args.iterations // 100)
+    for name, uncached in (("без кеша", True), ("с кешем", False)):
+        def build():
+            return [
+                (fn.__wrapped__ if uncached else fn)(*fn_args)
+                for fn, fn_args in calls
+            ]
+
+        build()
+        started = time.perf_counter()
+        for _ in range(rounds):
+            build()
+        elapsed = time.perf_counter() - started
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        kept = [build() for _ in range(100)]
+        allocated = tracemalloc.get_traced_memory()[0] - before
+        tracemalloc.stop()
+        del kept
+        print(
+            f"{name}: {elapsed / rounds * 1e6:.1f} мкс на ход, "
+            f"{allocated / 100 / 1024:.1f} КБ на ход ({len(calls)} клавиатур)"
+        )
+    stats = keyboards.keyboard_cache_stats()
+    print(
+        f"кеш: разметок {sum(entry['size'] for entry in stats.values())}, "
+        f"попаданий {sum(entry['hits'] for entry in stats.values())}, "
+        f"промахов {sum(entry['misses'] for entry in stats.values())}"
+    )
+
+
+async def bench_throttle(args):
+    # Один игрок без пауз жмёт «🎮 Найти игру» и дважды тапает одну и ту же
+    # кнопку в полученной панели. Сравниваем, сколько апдейтов дошло до обработчиков
+    # и сколько запросов к Telegram они породили.
+    spammer = 4242
+    for rate in (0, 1.0):
+        Config.THROTTLE_RATE = rate
+        async with Harness() as h:
+            await h.message(spammer, "/start")
+            h.request.reset()
+            started = time.perf_counter()
+            for i in range(args.updates):
+                if i % 3:
+                    await h.callback(spammer, cb.encode(cb.GAME_CATEGORIES), message_id=1)
+                else:
+                    await h.message(spammer, "🎮 Найти игру")
+            elapsed = time.perf_counter() - started
+            stats = h.bot_logic.throttle.stats()
+            answers = h.request.calls["answerCallbackQuery"]
+            notices = sum("Слишком часто" in text for text in h.request.texts.values())
+            print(
+                f"ограничение {'вкл ' if rate else 'выкл'}: {args.updates} апдейтов за "
+                f"{elapsed * 1000:.0f} мс, запросов к API {h.request.total_calls - answers} "
+                f"(+{answers} answerCallbackQuery), отброшено {stats['throttled']}, "
+                f"склеено {stats['coalesced']}, предупреждений о сбросе {notices}"
+            )
+            for route, count in sorted(stats["by_route"].items()):
+                print(f"  {route}: {count}")
+    Config.THROTTLE_RATE = 0
+
+
+async def bench_startup(args):
+    # Холодный импорт модулей бота в отдельном процессе (без базы и каталогов),
+    # миграции на новой и на уже созданной базе, первый и следующий апдейт.
+    import subprocess
+
+    data_existed = Config.DATA_DIR.exists()
+    probe = (
+        "from startup_profile import profile; profile.install(); import start_bot; "
+        "print(profile.format_startup())"
+    )
+    started = time.perf_counter()
+    out = subprocess.run(
+        [sys.executable, "-c", probe],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    print(f"импорт start_bot: {(time.perf_counter() - started) * 1000:.0f} мс на процесс")
+    print(f"  {out.stdout.strip()}")
+    if not data_existed:
+        print(f"  каталог data после импорта: {'создан' if Config.DATA_DIR.exists() else 'не создан'}")
+
+    tmp = tempfile.mkdtemp(prefix="tod-bench-")
+    fresh = db.open(os.path.join(tmp, "startup.db"))
+    again = db.open(os.path.join(tmp, "startup.db"))
+    db.open(os.path.join(tmp, "bench.db"))
+    print(f"миграции: новая база {fresh * 1000:.1f} мс, повторно {again * 1000:.1f} мс")
+
+    async with Harness() as h:
+        for label, uid in (("первый апдейт", 1), ("следующий", 2)):
+            started = time.perf_counter()
+            await h.message(uid, "/start")
+            print(f"{label}: {(time.perf_counter() - started) * 1000:.1f} мс")
+
+
+class SlowSink:
+    # Поток вывода с задержкой на каждую запись: так ведёт себя stdout,
+    # когда его читает нагруженный journald/syslog.
+
+    def __init__(self, stream, latency: float):
+        self.stream = stream
+        self.latency = latency
+
+    def write(self, data):
+        if self.latency:
+            time.sleep(self.latency)
+        return self.stream.write(data)
+
+    def flush(self):
+        self.stream.flush()
+
+
+async def bench_logging(args):
+    # Стоимость логов на апдейт: ход игры (кнопка + ответ) при разных
+    # настройках логов. «DEBUG, синхронно» — объём и способ записи как до
+    # перехода на фоновый поток: тексты сообщений и обновления базы писались
+    # каждым апдейтом прямо из обработчика. Каждый вариант — лучший из трёх.
+    import logging
+    import timeit
+
+    from logging_setup import setup_logging, stop_logging
+
+    tmp = tempfile.mkdtemp(prefix="tod-bench-")
+    variants = (
+        ("без логов", "CRITICAL", "text", False),
+        ("DEBUG, синхронно", "DEBUG", "text", False),
+        ("INFO, синхронно", "INFO", "text", False),
+        ("DEBUG, фоновый поток", "DEBUG", "text", True),
+        ("INFO, фоновый поток", "INFO", "text", True),
+        ("INFO, JSON, фоновый поток", "INFO", "json", True),
+    )
+    async with Harness() as h:
+        game_state = await h.start_friend_game(list(range(1000, 1000 + args.players)))
+        for _ in range(args.turns):
+            await h.play_turn(game_state)
+        results = {}
+        for attempt in range(3):
+            for index, (name, level, fmt, background) in enumerate(variants):
+                path = os.path.join(tmp, f"{index}.log")
+                with open(path, "w", encoding="utf-8") as out:
+                    setup_logging(
+                        level=level,
+                        fmt=fmt,
+                        background=background,
+                        stream=SlowSink(out, args.sink_latency / 1000),
+                    )
+                    started = time.perf_counter()
+                    for _ in range(args.turns):
+                        await h.play_turn(game_state)
+                    elapsed = (time.perf_counter() - started) / args.turns / 2
+                    stop_logging()
+                with open(path, encoding="utf-8") as written:
+                    lines = sum(1 for _ in written)
+                if name not in results or elapsed < results[name][0]:
+                    results[name] = (elapsed, lines)
+    logging.getLogger().handlers.clear()
+    baseline = results[variants[0][0]][0]
+    for name, *_ in variants:
+        elapsed, lines = results[name]
+        print(
+            f"{name}: {elapsed * 1e6:.0f} мкс на апдейт "
+            f"(логи +{(elapsed - baseline) * 1e6:.0f} мкс), строк на апдейт {lines / args.turns / 2:.1f}"
+        )
+
+    # Выключенная строка DEBUG: %-аргументы против готовой f-строки.
+    probe = logging.getLogger("bench")
+    probe.setLevel(logging.INFO)
+    user_id, text = 123456789, "Мой ответ на вопрос"
+    rounds = args.iterations
+    lazy = timeit.timeit(lambda: probe.debug("Сообщение от %s: %s", user_id, text), number=rounds)
+    eager = timeit.timeit(lambda: probe.debug(f"Сообщение от {user_id}: {text}"), number=rounds)
+    print(
+        f"выключенный DEBUG: {lazy / rounds * 1e9:.0f} нс с аргументами, "
+        f"{eager / rounds * 1e9:.0f} нс с f-строкой"
+    )
+
+
+async def bench_profiling(args):
+    # Цена /profile: время апдейта без сессии, с семплированием и с cProfile.
+    # Сессия запускается командой администратора, отчёт приходит файлом.
+    admin = 777
+    Config.ADMIN_IDS = [admin]
+    async with Harness() as h:
+        # Отчёт отправляется отдельной задачей приложения, а таймер сессии —
+        # через JobQueue: приложение должно быть запущено.
+        await h.app.start()
+        game_state = await h.start_friend_game(list(range(1000, 1000 + args.players)))
+        for _ in range(args.turns):
+            await h.play_turn(game_state)
+        for mode in (None, "sample", "trace"):
+            if mode:
+                await h.message(admin, f"/profile {mode} {args.turns * 2}")
+            started = time.perf_counter()
+            for _ in range(args.turns):
+                await h.play_turn(game_state)
+            elapsed = (time.perf_counter() - started) / args.turns / 2
+            report = ""
+            if mode:
+                await asyncio.sleep(0.1)
+                chat, filename, content = h.request.files[-1]
+                report = f", отчёт {filename} ({len(content) / 1024:.1f} КБ) в чат {chat}"
+            print(f"{mode or 'без профилирования'}: {elapsed * 1e6:.0f} мкс на апдейт{report}")
+        await h.app.stop()
+    print()
+    print(content.decode()[:2000])
+
+
+async def bench_watchdog(args):
+    # Сторож цикла событий: задержка при обычной игре и блокировка, когда
+    # другое соединение держит запись в базе, а /start ждёт её в sqlite3
+    # прямо в потоке цикла событий.
+    async with Harness() as h:
+        watchdog = h.bot_logic.watchdog
+        await watchdog.start()
+        game_state = await h.start_friend_game(list(range(1000, 1000 + args.players)))
+        started = time.perf_counter()
+        while time.perf_counter() - started < 2:
+            await h.play_turn(game_state)
+            await asyncio.sleep(0.01)
+        print("обычная игра:", ", ".join(f"p{q} {v * 1000:.1f} мс" for q, v in watchdog.percentiles()))
+
+        hold = 0.6
+        locked = threading.Event()
+
+        def hold_write_lock():
+            with db.get_connection() as conn:
+                conn.execute("BEGIN IMMEDIATE")
+                locked.set()
+                time.sleep(hold)
+                conn.rollback()
+
+        holder = threading.Thread(target=hold_write_lock)
+        holder.start()
+        await asyncio.to_thread(locked.wait)
+        started = time.perf_counter()
+        await h.message(5000, "/start")
+        blocked = time.perf_counter() - started
+        holder.join()
+        await asyncio.sleep(watchdog.interval * 2)
+        await watchdog.stop()
+
+    print(f"/start при занятой базе: {blocked * 1000:.0f} мс в потоке цикла событий")
+    print("после блокировки:", ", ".join(f"p{q} {v * 1000:.1f} мс" for q, v in watchdog.percentiles()))
+    print(f"блокировок: {watchdog.stall_count}")
+    for stall in watchdog.stalls:
+        duration = f"{stall.duration * 1000:.0f} мс" if stall.duration is not None else "не завершилась"
+        print(f"\nблокировка {duration}, стек (последние кадры):")
+        print("".join(stall.stack.splitlines(keepends=True)[-8:]))
+
+
+async def bench_load(args):
+    # Нагрузочный прогон через настоящие обработчики: args.users игроков жмут
+    # /start, ищут случайную игру и играют её до конца — отвечают, пропускают
+    # задания, иногда завершают игру досрочно или жмут кнопку не в свой ход.
+    # Так несколько волн подряд: после каждой игры должны освобождаться
+    # полностью, рост памяти между волнами — признак утечки.
+    Config.FREE_SEARCHES_PER_DAY = 1_000_000
+    rng = random.Random(1)
+    # array, а не list: замеры не должны сами расти в памяти объектами float.
+    latencies: dict[str, array.array] = defaultdict(lambda: array.array("d"))
+    semaphore = asyncio.Semaphore(args.concurrency)
+    users = list(range(100_000, 100_000 + args.users))
+    if args.trace_memory:
+        tracemalloc.start()
+
+    async with Harness(latency=args.latency / 1000, jitter=args.latency / 1000) as h:
+        game_logic = h.bot_logic.game_logic
+        # Как в post_init: без фоновой записи журнал копит события в памяти.
+        await h.bot_logic.journal.start()
+
+        async def send(kind: str, payload):
+            async with semaphore:
+                started = time.perf_counter()
+                await h.feed(payload)
+                latencies[kind].append(time.perf_counter() - started)
+
+        stuck = []
+
+        async def play(game_state):
+            # Ходов с запасом: игра, которая не закончилась за них, зависла.
+            for _ in range(game_state.max_rounds * len(game_state.players) * 2):
+                if game_logic.get_game_by_id(game_state.id) is not game_state:
+                    return
+                player = game_state.current_player
+                panel = game_state.panels.get(player)
+                roll = rng.random()
+                if roll < 0.03:
+                    await send("end", h.updates.callback(player, cb.encode(cb.END, game_state.id), panel))
+                    return
+                if roll < 0.13:
+                    other = rng.choice([uid for uid in game_state.players if uid != player])
+                    truth = cb.encode(cb.TRUTH, game_state.id)
+                    await send("not_your_turn", h.updates.callback(other, truth, game_state.panels.get(other)))
+                action = cb.TRUTH if rng.random() < 0.5 else cb.DARE
+                await send("choose", h.updates.callback(player, cb.encode(action, game_state.id), panel))
+                if rng.random() < 0.2:
+                    await send("skip", h.updates.callback(player, cb.encode(cb.SKIP, game_state.id), panel))
+                else:
+                    await send("answer", h.updates.message(player, "Мой ответ"))
+            stuck.append(game_state.id)
+
+        def process_memory() -> str:
+            # Тексты сообщений копит поддельный транспорт, а не бот.
+            h.request.texts.clear()
+            gc.collect()
+            if args.trace_memory:
+                return f"{tracemalloc.get_traced_memory()[0] / 1024 / 1024:.1f} МБ"
+            return f"{sys.getallocatedblocks():,} блоков".replace(",", " ")
+
+        started = time.perf_counter()
+        await asyncio.gather(*(send("start", h.updates.message(uid, "/start")) for uid in users))
+        print(f"регистрация: {args.users} игроков за {time.perf_counter() - started:.2f} с")
+        print(f"память до игр: {process_memory()}")
+
+        total_updates, total_elapsed = 0, 0.0
+        for wave in range(1, args.waves + 1):
+            h.request.reset()
+            before = sum(len(values) for values in latencies.values())
+            started = time.perf_counter()
+            rng.shuffle(users)
+            await asyncio.gather(
+                *(send("search", h.updates.callback(uid, cb.encode(cb.GAME_RANDOM))) for uid in users)
+            )
+            games = {id(state): state for uid in users if (state := game_logic.get_game_for_user(uid))}
+            waiting = [entry["user_id"] for entry in game_logic.waiting_random]
+            await asyncio.gather(
+                *(send("cancel", h.updates.callback(uid, cb.encode(cb.CANCEL_SEARCH))) for uid in waiting)
+            )
+            await asyncio.gather(*(play(state) for state in games.values()))
+            elapsed = time.perf_counter() - started
+            updates = sum(len(values) for values in latencies.values()) - before
+            total_updates += updates
+            total_elapsed += elapsed
+            leftover = {name: size for name, size in game_logic.sizes().items() if size}
+            print(
+                f"волна {wave}: игр {len(games)}, апдейтов {updates} за {elapsed:.2f} с "
+                f"({updates / elapsed:.0f}/с), вызовов API на игру {h.request.total_calls / max(len(games), 1):.1f}, "
+                f"память {process_memory()}, осталось в GameLogic: {leftover or 'ничего'}"
+            )
+            if stuck:
+                print(f"  не закончились игры: {stuck[:10]}")
+                stuck.clear()
+        await h.bot_logic.journal.stop()
+
+    if args.trace_memory:
+        tracemalloc.stop()
+    everything = [value for values in latencies.values() for value in values]
+    print(f"\nвсе волны: {total_updates} апдейтов за {total_elapsed:.2f} с ({total_updates / total_elapsed:.0f}/с)")
+    print(f"{'апдейт':<16}{'число':>8}{'p50, мс':>10}{'p99, мс':>10}{'макс, мс':>10}")
+    for kind, values in sorted(latencies.items(), key=lambda item: -len(item[1])) + [("все", everything)]:
+        print(
+            f"{kind:<16}{len(values):>8}{percentile(values, 0.5) * 1000:>10.2f}"
+            f"{percentile(values, 0.99) * 1000:>10.2f}{max(values) * 1000:>10.2f}"
+        )
+
+
+SCENARIOS = {
+    "coalescing": bench_coalescing,
+    "webhook": bench_webhook,
+    "dispatch": bench_dispatch,
+    "keyboards": bench_keyboards,
+    "load": bench_load,
+    "logging": bench_logging,
+    "profiling": bench_profiling,
+    "concurrency": bench_concurrency,
+    "scaleout": bench_scaleout,
+    "shutdown": bench_shutdown,
+    "startup": bench_startup,
+    "throttle": bench_throttle,
+    "watchdog": bench_watchdog,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарки бота без подключения к Telegram")
+    parser.add_argument("scenario", choices=sorted(SCENARIOS))
+    parser.add_argument("--players", type=int, default=4)
+    parser.add_argument("--turns", type=int, default=40)
+    parser.add_argument("--updates", type=int, default=500)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--iterations", type=int, default=200_000)
+    parser.add_argument("--games", type=int, default=10)
+    parser.add_argument("--latency", type=float, default=20.0, help="задержка транспорта, мс")
+    parser.add_argument("--concurrent-updates", type=int, default=64)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--sink-latency", type=float, default=0.2, help="задержка записи лога, мс")
+    parser.add_argument("--waves", type=int, default=3, help="сколько раз игроки заново ищут игру")
+    parser.add_argument("--trace-memory", action="store_true", help="считать память через tracemalloc (медленнее)")
+    args = parser.parse_args()
+    use_temp_database()
+    asyncio.run(SCENARIOS[args.scenario](args))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
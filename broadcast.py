@@ -0,0 +1,47 @@
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterable, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class BroadcastResult:
+    sent: Dict[int, Any] = field(default_factory=dict)
+    failed: Dict[int, Exception] = field(default_factory=dict)
+
+    @property
+    def ok(self) -> bool:
+        return not self.failed
+
+    def __str__(self) -> str:
+        return f"доставлено {len(self.sent)}, ошибок {len(self.failed)}"
+
+
+async def broadcast(
+    bot,
+    messages: Iterable[Tuple[int, Dict[str, Any]]],
+    concurrency: int = 8,
+    what: str = "сообщение",
+) -> BroadcastResult:
+    # messages — пары (chat_id, аргументы send_message; при наличии message_id —
+    # правка сообщения через edit_message_text). Отправки идут параллельно,
+    # не больше concurrency одновременно; ошибка одного получателя не мешает
+    # остальным и попадает в result.failed.
+    result = BroadcastResult()
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def send_one(chat_id: int, kwargs: Dict[str, Any]):
+        async with semaphore:
+            try:
+                if "message_id" in kwargs:
+                    result.sent[chat_id] = await bot.edit_message_text(chat_id=chat_id, **kwargs)
+                else:
+                    result.sent[chat_id] = await bot.send_message(chat_id=chat_id, **kwargs)
+            except Exception as e:
+                result.failed[chat_id] = e
+                logger.error("Не удалось отправить %s игроку %s: %s", what, chat_id, e)
+
+    await asyncio.gather(*(send_one(chat_id, kwargs) for chat_id, kwargs in messages))
+    return result
@@ -0,0 +1,147 @@
+import re
+from dataclasses import dataclass
+from typing import Dict, Tuple
+
+# Формат callback_data: символ версии, символ действия и аргументы через точку.
+# Целые числа пишутся в base36, строки — как есть (только [A-Za-z0-9_-]).
+# Пример: «1t» + base36(game_id) вместо «truth_59502778191446016».
+# Коды действий не переиспользуются; при несовместимом изменении формата
+# поднимается CODEC_VERSION, и кнопки старых сообщений распознаются как устаревшие.
+CODEC_VERSION = "1"
+ARG_SEPARATOR = "."
+MAX_CALLBACK_BYTES = 64  # ограничение Telegram
+
+_DIGITS = "0123456789abcdefghijklmnopqrstuvwxyz"
+_STR_ARG = re.compile(r"[A-Za-z0-9_-]+")
+_INT_ARG = re.compile(r"[0-9a-z]{1,13}")  # до 2**64
+_CODE = re.compile(r"[A-Za-z0-9]")
+
+
+class CallbackDataError(ValueError):
+    pass
+
+
+class StaleCallbackData(CallbackDataError):
+    # Кнопка из сообщения, отправленного другой версией бота.
+    pass
+
+
+@dataclass(frozen=True)
+class CallbackAction:
+    name: str
+    code: str
+    arg_types: Tuple[type, ...] = ()
+
+
+ACTIONS: Dict[str, CallbackAction] = {}
+
+
+def _action(name: str, code: str, *arg_types: type) -> CallbackAction:
+    if not _CODE.fullmatch(code) or code in ACTIONS:
+        raise ValueError(f"Некорректный или занятый код действия {code!r} ({name})")
+    for arg_type in arg_types:
+        if arg_type not in (int, str):
+            raise ValueError(f"Неподдерживаемый тип аргумента: {arg_type}")
+    action = CallbackAction(name, code, arg_types)
+    ACTIONS[code] = action
+    return action
+
+
+# Меню и настройки
+GAME_RANDOM = _action("game_random", "a")
+GAME_FRIEND = _action("game_friend", "b")
+FRIEND_ENTER_CODE = _action("friend_enter_code", "c")
+GAME_CATEGORIES = _action("game_categories", "d")
+GAME_GENDER_SEARCH = _action("game_gender_search", "e")
+START_GENDER_SEARCH = _action("start_gender_search", "f")
+CATEGORIES_DONE = _action("categories_done", "g")
+CATEGORY_TOGGLE = _action("category_toggle", "h", str)
+GENDER_MALE = _action("gender_male", "i")
+GENDER_FEMALE = _action("gender_female", "j")
+GENDER_OTHER = _action("gender_other", "k")
+SEARCH_GENDER = _action("search_gender", "l", int)
+SEARCH_AGE_EDIT = _action("search_age_edit", "m")
+SET_AGE = _action("set_age", "n")
+CANCEL_SEARCH = _action("cancel_search", "o")
+CANCEL = _action("cancel", "p")
+BACK_TO_MENU = _action("back_to_menu", "q")
+# Премиум
+PREMIUM_STATUS = _action("premium_status", "r")
+PREMIUM_BUY = _action("premium_buy", "s", int)
+PREMIUM_TRIAL = _action("premium_trial", "u")
+# Комнаты с друзьями
+JOIN = _action("join", "v", str)
+FRIEND_DECLINE = _action("friend_decline", "w")
+FRIEND_CATEGORIES = _action("friend_categories", "x", int)
+FRIEND_ROUNDS = _action("friend_rounds", "y", int)
+FRIEND_ROUNDS_SET = _action("friend_rounds_set", "z", int, int)
+FRIEND_PLAYERS = _action("friend_players", "A", int)
+FRIEND_PLAYERS_SET = _action("friend_players_set", "B", int, int)
+FRIEND_BACK = _action("friend_back", "C", int)
+START_FRIEND = _action("start_friend", "D", int)
+# Ход игры
+TRUTH = _action("truth", "t", int)
+DARE = _action("dare", "E", int)
+CONTINUE = _action("continue", "F", int)
+SKIP = _action("skip", "G", int)
+END = _action("end", "H", int)
+VERIFY = _action("verify", "I", int, int, int)
+RATE = _action("rate", "J", int, int, int)
+
+
+def _encode_int(value: int) -> str:
+    if value < 0:
+        raise CallbackDataError(f"Отрицательное число в callback_data: {value}")
+    if value == 0:
+        return "0"
+    digits = []
+    while value:
+        value, rem = divmod(value, 36)
+        digits.append(_DIGITS[rem])
+    return "".join(reversed(digits))
+
+
+def encode(action: CallbackAction, *args) -> str:
+    if len(args) != len(action.arg_types):
+        raise CallbackDataError(f"{action.name}: ожидалось аргументов {len(action.arg_types)}, получено {len(args)}")
+    parts = []
+    for arg_type, value in zip(action.arg_types, args):
+        if arg_type is int:
+            parts.append(_encode_int(int(value)))
+        else:
+            value = str(value)
+            if not _STR_ARG.fullmatch(value):
+                raise CallbackDataError(f"{action.name}: недопустимая строка {value!r}")
+            parts.append(value)
+    data = CODEC_VERSION + action.code + ARG_SEPARATOR.join(parts)
+    if len(data.encode()) > MAX_CALLBACK_BYTES:
+        raise CallbackDataError(f"{action.name}: callback_data длиннее {MAX_CALLBACK_BYTES} байт")
+    return data
+
+
+def decode(data: str) -> Tuple[CallbackAction, tuple]:
+    if len(data) < 2 or data[0] != CODEC_VERSION:
+        raise StaleCallbackData(data)
+    action = ACTIONS.get(data[1])
+    if action is None:
+        raise CallbackDataError(f"Неизвестный код действия: {data!r}")
+    arg_types = action.arg_types
+    if not arg_types:
+        if len(data) != 2:
+            raise CallbackDataError(f"{action.name}: лишние аргументы в {data!r}")
+        return action, ()
+    parts = data[2:].split(ARG_SEPARATOR)
+    if len(parts) != len(arg_types):
+        raise CallbackDataError(f"{action.name}: неверное число аргументов в {data!r}")
+    args = []
+    for arg_type, part in zip(arg_types, parts):
+        if arg_type is int:
+            # int() сам по себе принял бы знак, пробелы и «_» — проверяем заранее.
+            if not _INT_ARG.fullmatch(part):
+                raise CallbackDataError(f"{action.name}: не число {part!r}")
+            args.append(int(part, 36))
+        elif _STR_ARG.fullmatch(part):
+            args.append(part)
+        else:
+            raise CallbackDataError(f"{action.name}: недопустимая строка {part!r}")
+    return action, tuple(args)
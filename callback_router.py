@@ -0,0 +1,51 @@
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Tuple
+
+from callback_data import CallbackAction, decode
+
+
+@dataclass
+class CallbackRoute:
+    action: CallbackAction
+    handler: Callable
+    bound: Tuple[Any, ...] = ()  # аргументы, которые передаются обработчику всегда
+    shared: bool = False  # кнопку может нажать любой игрок, не только владелец панели
+
+    def describe(self) -> str:
+        args = ", ".join(arg_type.__name__ for arg_type in self.action.arg_types)
+        name = getattr(self.handler, "__name__", repr(self.handler))
+        return (
+            f"{self.action.name}({args}) [{self.action.code}] -> {name}"
+            f"{' (общая)' if self.shared else ''}"
+        )
+
+
+class CallbackRouter:
+    # Таблица маршрутов для нажатий кнопок: callback_data разбирается
+    # единым декодером (callback_data.decode) в действие и типизированные
+    # аргументы, обработчик находится по коду действия в словаре.
+
+    def __init__(self):
+        self._routes: Dict[str, CallbackRoute] = {}
+
+    def on(self, action: CallbackAction, handler: Callable, *bound, shared: bool = False) -> CallbackRoute:
+        if action.code in self._routes:
+            raise ValueError(f"Для действия {action.name} уже есть обработчик")
+        route = CallbackRoute(action, handler, bound, shared)
+        self._routes[action.code] = route
+        return route
+
+    def resolve(self, data: str) -> Tuple[CallbackRoute, tuple] | None:
+        # CallbackDataError (и StaleCallbackData для кнопок прежних версий)
+        # пробрасываются вызывающему; None — действие известно, но не обслуживается.
+        action, args = decode(data)
+        route = self._routes.get(action.code)
+        if route is None:
+            return None
+        return route, args
+
+    def routes(self) -> List[CallbackRoute]:
+        return list(self._routes.values())
+
+    def __len__(self) -> int:
+        return len(self._routes)
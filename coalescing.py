@@ -0,0 +1,139 @@
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+from telegram.error import BadRequest
+
+from broadcast import BroadcastResult, broadcast
+from outbound import PRIORITY_NORMAL, PRIORITY_URGENT
+
+MAX_MESSAGE_LENGTH = 4096
+SEPARATOR = "\n\n"
+
+
+@dataclass
+class _Chunk:
+    texts: List[str]
+    reply_markup: Any = None
+    parse_mode: Optional[str] = None
+    priority: Optional[int] = None
+    message_id: Optional[int] = None  # правка уже отправленного сообщения
+    length: int = 0
+    fallback: bool = False  # если правка не удалась — отправить новым сообщением
+
+    @property
+    def effective_priority(self) -> int:
+        if self.priority is not None:
+            return self.priority
+        return PRIORITY_URGENT if self.message_id is not None else PRIORITY_NORMAL
+
+    def as_kwargs(self) -> Dict[str, Any]:
+        kwargs: Dict[str, Any] = {"text": SEPARATOR.join(self.texts)}
+        if self.reply_markup is not None:
+            kwargs["reply_markup"] = self.reply_markup
+        if self.parse_mode is not None:
+            kwargs["parse_mode"] = self.parse_mode
+        if self.priority is not None:
+            kwargs["rate_limit_args"] = self.priority
+        if self.message_id is not None:
+            kwargs["message_id"] = self.message_id
+        return kwargs
+
+
+@dataclass
+class MessageCoalescer:
+    # Копит исходящие сообщения, порождённые одним апдейтом, и склеивает
+    # подряд идущие сообщения в один чат в одно: текст через пустую строку,
+    # клавиатура — от того сообщения, у которого она есть. Не склеиваются
+    # сообщения с разным parse_mode, две клавиатуры подряд, правки разных
+    # сообщений и слишком длинный текст.
+    enabled: bool = True
+    _chats: Dict[int, List[_Chunk]] = field(default_factory=dict)
+
+    def send(self, chat_id: int, text: str, reply_markup=None, parse_mode=None, rate_limit_args=None):
+        self._add(chat_id, _Chunk([text], reply_markup, parse_mode, rate_limit_args, None, len(text)))
+
+    def edit(self, chat_id: int, message_id: int, text: str, reply_markup=None, parse_mode=None):
+        self._add(chat_id, _Chunk([text], reply_markup, parse_mode, None, message_id, len(text)))
+
+    def panel(
+        self,
+        chat_id: int,
+        message_id: Optional[int],
+        text: str,
+        reply_markup=None,
+        parse_mode=None,
+        rate_limit_args=None,
+    ):
+        # Сообщение-панель: правим существующее, а если его нет или правка
+        # не удалась — отправляем новое.
+        chunk = _Chunk([text], reply_markup, parse_mode, rate_limit_args, message_id, len(text))
+        chunk.fallback = message_id is not None
+        self._add(chat_id, chunk)
+
+    def _add(self, chat_id: int, chunk: _Chunk):
+        chunks = self._chats.setdefault(chat_id, [])
+        if self.enabled and chunks and self._merge(chunks[-1], chunk):
+            return
+        chunks.append(chunk)
+
+    @staticmethod
+    def _merge(last: _Chunk, chunk: _Chunk) -> bool:
+        if last.length + len(SEPARATOR) + chunk.length > MAX_MESSAGE_LENGTH:
+            return False
+        if last.parse_mode != chunk.parse_mode:
+            return False
+        if chunk.message_id is not None:
+            # Вторая правка того же сообщения заменяет клавиатуру первой;
+            # правки разных сообщений не склеиваются.
+            if chunk.message_id != last.message_id:
+                return False
+            last.reply_markup = chunk.reply_markup
+        elif last.reply_markup is not None and chunk.reply_markup is not None:
+            return False
+        elif chunk.reply_markup is not None:
+            last.reply_markup = chunk.reply_markup
+        last.texts.extend(chunk.texts)
+        last.length += len(SEPARATOR) + chunk.length
+        # Склеенное сообщение идёт с наивысшим приоритетом из частей.
+        last.priority = min(last.effective_priority, chunk.effective_priority)
+        return True
+
+    def __len__(self) -> int:
+        return sum(len(chunks) for chunks in self._chats.values())
+
+    async def flush(self, bot, concurrency: int = 8, what: str = "сообщение") -> BroadcastResult:
+        # Чаты обрабатываются параллельно, сообщения внутри чата — по порядку:
+        # на шаге N уходит N-е сообщение каждого чата.
+        chats, self._chats = self._chats, {}
+        total = BroadcastResult()
+        step = 0
+        while True:
+            batch = [
+                (chat_id, chunks[step].as_kwargs())
+                for chat_id, chunks in chats.items()
+                if step < len(chunks)
+            ]
+            if not batch:
+                break
+            result = await broadcast(bot, batch, concurrency=concurrency, what=what)
+            retry = []
+            for chat_id, error in list(result.failed.items()):
+                chunk = chats[chat_id][step]
+                if not chunk.fallback:
+                    continue
+                if isinstance(error, BadRequest) and "not modified" in str(error).lower():
+                    # Панель уже показывает этот текст — считаем доставленным.
+                    result.failed.pop(chat_id, None)
+                    continue
+                chunk.message_id = None
+                retry.append((chat_id, chunk.as_kwargs()))
+            for chat_id, _ in retry:
+                result.failed.pop(chat_id, None)
+            if retry:
+                resent = await broadcast(bot, retry, concurrency=concurrency, what=what)
+                result.sent.update(resent.sent)
+                result.failed.update(resent.failed)
+            total.sent.update(result.sent)
+            total.failed.update(result.failed)
+            step += 1
+        return total
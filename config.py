@@ -10,12 +10,66 @@ load_dotenv(dotenv_path=env_path)
 class Config:
     # Telegram
     BOT_TOKEN = os.getenv('BOT_TOKEN')
-    if not BOT_TOKEN:
-        print("ОШИБКА: BOT_TOKEN не указан в .env файле!")
-        sys.exit(1)
+
+    # Приём обновлений: polling или webhook. Для вебхука: публичный адрес,
+    # на котором Telegram будет слать обновления (WEBHOOK_URL), адрес и порт
+    # встроенного сервера, путь, секрет для заголовка
+    # X-Telegram-Bot-Api-Secret-Token и число одновременных соединений.
+    UPDATE_MODE = os.getenv('UPDATE_MODE', 'polling')
+    WEBHOOK_URL = os.getenv('WEBHOOK_URL') or None
+    WEBHOOK_LISTEN = os.getenv('WEBHOOK_LISTEN', '0.0.0.0')
+    WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', 8443))
+    WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', 'telegram')
+    WEBHOOK_SECRET_TOKEN = os.getenv('WEBHOOK_SECRET_TOKEN') or None
+    WEBHOOK_MAX_CONNECTIONS = int(os.getenv('WEBHOOK_MAX_CONNECTIONS', 40))
+    # Сколько апдейтов обрабатывать одновременно (1 — строго по очереди).
+    # Апдейты одного пользователя и одной игры всё равно идут по порядку.
+    CONCURRENT_UPDATES = int(os.getenv('CONCURRENT_UPDATES', 64))
+    # Число процессов-воркеров. Больше одного — апдейты принимает отдельный
+    # процесс и раздаёт воркерам по пользователю и игре (см. scaleout.py).
+    # WORKER_ID воркерам назначается автоматически: 0..WORKERS-1.
+    # OUTBOUND_GLOBAL_RATE делится между воркерами, поэтому WORKERS не может
+    # быть больше него (каждому нужно хотя бы 1 сообщение в секунду).
+    WORKERS = int(os.getenv('WORKERS', 1))
+
+    # Остановка: сколько секунд даём обработчикам и исходящей очереди
+    # (меньше TimeoutStopSec в bot.service). Тёплый старт: при остановке
+    # состояние игр сохраняется в базу и поднимается при запуске, если снимок
+    # не старше SNAPSHOT_MAX_AGE секунд.
+    SHUTDOWN_DRAIN_TIMEOUT = float(os.getenv('SHUTDOWN_DRAIN_TIMEOUT', 20))
+    WARM_START = os.getenv('WARM_START', '1') in ('1', 'true', 'True')
+    SNAPSHOT_MAX_AGE = int(os.getenv('SNAPSHOT_MAX_AGE', 3600))
+
+    # Ограничение входящих апдейтов от одного пользователя: апдейтов в секунду
+    # (0 — без ограничения), запас на короткий всплеск и окно (сек), в котором
+    # повторное нажатие той же кнопки считается двойным тапом.
+    THROTTLE_RATE = float(os.getenv('THROTTLE_RATE', 1))
+    THROTTLE_BURST = float(os.getenv('THROTTLE_BURST', 5))
+    THROTTLE_REPEAT_WINDOW = float(os.getenv('THROTTLE_REPEAT_WINDOW', 1.0))
+
+    # Логи: уровень, формат (text или json) и запись в фоновом потоке
+    LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+    LOG_FORMAT = os.getenv('LOG_FORMAT', 'text')
+    LOG_ASYNC = os.getenv('LOG_ASYNC', '1') not in ('0', 'false', 'False')
+
+    # Метрики в формате Prometheus: адрес и порт HTTP-сервера (0 — выключен).
+    # Воркер с WORKER_ID=N слушает METRICS_PORT + N.
+    METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+    METRICS_PORT = int(os.getenv('METRICS_PORT', 9108))
+
+    # Сторож цикла событий: интервал замера задержки и порог (секунды),
+    # после которого в лог пишется стек блокирующего вызова (0 — выключен).
+    LOOP_LAG_INTERVAL = float(os.getenv('LOOP_LAG_INTERVAL', 0.1))
+    LOOP_LAG_THRESHOLD = float(os.getenv('LOOP_LAG_THRESHOLD', 0.25))
 
     ADMIN_IDS = list(map(int, os.getenv('ADMIN_IDS', '').split(','))) if os.getenv('ADMIN_IDS') else []
 
+    # Профилирование по команде /profile (только для ADMIN_IDS): интервал
+    # семплирования (мс) и верхние границы сессии.
+    PROFILE_SAMPLE_INTERVAL = float(os.getenv('PROFILE_SAMPLE_INTERVAL', 5))
+    PROFILE_MAX_UPDATES = int(os.getenv('PROFILE_MAX_UPDATES', 10000))
+    PROFILE_MAX_SECONDS = float(os.getenv('PROFILE_MAX_SECONDS', 600))
+
     # Database
     DB_PATH = Path(__file__).parent / 'data' / 'bot.db'
     DATABASE_URL = os.getenv('DATABASE_URL', f'sqlite:///{DB_PATH}')
@@ -28,13 +82,59 @@ class Config:
     LOGS_DIR = BASE_DIR / 'logs'
     DATA_DIR = BASE_DIR / 'data'
 
-    # Создаем директории если их нет
-    LOGS_DIR.mkdir(exist_ok=True)
-    DATA_DIR.mkdir(exist_ok=True)
+    # Реестр владельцев панелей с кнопками: сколько записей хранить
+    # и сколько секунд запись живёт без обращений
+    MESSAGE_OWNERS_MAX = int(os.getenv('MESSAGE_OWNERS_MAX', 50000))
+    MESSAGE_OWNERS_TTL = int(os.getenv('MESSAGE_OWNERS_TTL', 24 * 3600))
+
+    # Сколько вариантов каждой клавиатуры с параметрами (по игре, по выбору)
+    # держать в кеше готовых разметок
+    KEYBOARD_CACHE_SIZE = int(os.getenv('KEYBOARD_CACHE_SIZE', 1024))
+
+    # Номер процесса-воркера (0..255), входит в идентификаторы игр
+    WORKER_ID = int(os.getenv('WORKER_ID', 0))
+
+    # Коды приглашений в комнаты: срок жизни (сек) и ключ перестановки.
+    # Без ключа он генерируется случайно при каждом запуске — это допустимо
+    # только для одного процесса. При WORKERS > 1 ключ обязателен и должен
+    # оставаться тем же между перезапусками: по нему приёмник узнаёт воркера
+    # из кода, и только при общем ключе коды разных воркеров не совпадают
+    # (в том числе с кодами, восстановленными из снимка).
+    INVITE_CODE_TTL = int(os.getenv('INVITE_CODE_TTL', 6 * 3600))
+    INVITE_CODE_SECRET = os.getenv('INVITE_CODE_SECRET') or None
+
+    # Журнал событий игр: размер пачки и интервал фоновой записи в SQLite (сек)
+    JOURNAL_BATCH_SIZE = int(os.getenv('JOURNAL_BATCH_SIZE', 200))
+    JOURNAL_FLUSH_INTERVAL = float(os.getenv('JOURNAL_FLUSH_INTERVAL', 2.0))
+
+    # Сколько сообщений рассылки игрокам отправляется одновременно
+    BROADCAST_CONCURRENCY = int(os.getenv('BROADCAST_CONCURRENCY', 8))
+    # Склеивать сообщения, которые один апдейт отправляет в один чат
+    COALESCE_MESSAGES = os.getenv('COALESCE_MESSAGES', '1') not in ('0', 'false', 'False')
+
+    # Исходящая очередь: лимиты Telegram (сообщений/сек всего и в один чат),
+    # запас для коротких всплесков в чате, число повторов после RetryAfter
+    # и период записи статистики очереди в лог (сек, 0 — не писать).
+    OUTBOUND_GLOBAL_RATE = float(os.getenv('OUTBOUND_GLOBAL_RATE', 30))
+    OUTBOUND_CHAT_RATE = float(os.getenv('OUTBOUND_CHAT_RATE', 1))
+    OUTBOUND_CHAT_BURST = float(os.getenv('OUTBOUND_CHAT_BURST', 3))
+    OUTBOUND_MAX_RETRIES = int(os.getenv('OUTBOUND_MAX_RETRIES', 3))
+    OUTBOUND_STATS_INTERVAL = int(os.getenv('OUTBOUND_STATS_INTERVAL', 300))
 
     # Настройки игры
     MAX_PLAYERS_PER_GAME = 10
     GAME_TIMEOUT = 300  # 5 минут
+    # Время на ход (сек, 0 — без ограничения), период проверки дедлайнов
+    # и число таймаутов подряд, после которого игрок исключается из игры.
+    TURN_TIMEOUT = int(os.getenv('TURN_TIMEOUT', 180))
+    TURN_CHECK_INTERVAL = int(os.getenv('TURN_CHECK_INTERVAL', 5))
+    MAX_TURN_TIMEOUTS = int(os.getenv('MAX_TURN_TIMEOUTS', 3))
+    # Очерёдность ходов: round_robin, shuffled или random
+    TURN_POLICY = os.getenv('TURN_POLICY', 'round_robin')
+    # Сколько секунд ждём ответа на выбранное задание и сохранять ли
+    # ожидающие ответы в базе, чтобы они пережили перезапуск
+    PENDING_ANSWER_TTL = int(os.getenv('PENDING_ANSWER_TTL', 900))
+    PERSIST_PENDING_ANSWERS = os.getenv('PERSIST_PENDING_ANSWERS', '0') in ('1', 'true', 'True')
     # Ограничения бесплатного поиска:
     # FREE_SEARCHES_PER_DAY — сколько бесплатных попыток даётся внутри одного периода.
     # FREE_SEARCH_PERIOD_DAYS — длина периода (в днях), после которого лимит обнуляется.
@@ -70,3 +170,16 @@ class Config:
 
     # Контакты разработчика
     DEVELOPER_CONTACT = os.getenv('DEVELOPER_CONTACT', '@xauspro')
+
+    @classmethod
+    def prepare(cls):
+        # Проверка настроек и создание каталогов — при запуске бота, а не при
+        # импорте: скрипты и бенчмарки импортируют модули без побочных эффектов.
+        if not cls.BOT_TOKEN:
+            print("ОШИБКА: BOT_TOKEN не указан в .env файле!")
+            sys.exit(1)
+        if cls.WORKERS > 1 and not cls.INVITE_CODE_SECRET:
+            print("ОШИБКА: при WORKERS > 1 нужен общий INVITE_CODE_SECRET в .env файле!")
+            sys.exit(1)
+        cls.LOGS_DIR.mkdir(exist_ok=True)
+        cls.DATA_DIR.mkdir(exist_ok=True)
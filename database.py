@@ -1,25 +1,56 @@
+import logging
 import sqlite3
+import threading
 import time
 from pathlib import Path
 from contextlib import contextmanager
 from datetime import datetime, date
-from colorama import init as colorama_init, Fore
 from config import Config
+from metrics import registry, timed_methods
 
-colorama_init(autoreset=True)
+logger = logging.getLogger(__name__)
 
+DB_SECONDS = registry.histogram("tod_db_seconds", "Время метода Database", ("method",))
+DB_ERRORS = registry.counter("tod_db_errors_total", "Исключения в методах Database", ("method",))
 
+
+@timed_methods(DB_SECONDS, DB_ERRORS, exclude=("open", "get_connection"))
 class Database:
-    def __init__(self):
-        db_path = getattr(Config, "DB_PATH", None)
-        if not db_path:
-            db_path = Path(__file__).parent / "bot.db"
-        self.db_path = str(db_path)
-        print(Fore.CYAN + f"[DB] Использую файл базы данных: {self.db_path}")
-        self.init_db()
+    # Импорт модуля ничего не открывает: файл и миграции — в open(), которую
+    # бот вызывает при запуске. Если open() не вызвали, её выполнит первое
+    # обращение к базе.
+
+    def __init__(self, db_path=None):
+        self.db_path = str(db_path) if db_path else None
+        self._ready = False
+        self._open_lock = threading.Lock()
+
+    def open(self, db_path=None) -> float:
+        # Возвращает время миграций в секундах (0, если база уже открыта).
+        with self._open_lock:
+            if db_path is not None and str(db_path) != self.db_path:
+                self.db_path = str(db_path)
+                self._ready = False
+            if self._ready:
+                return 0.0
+            if not self.db_path:
+                self.db_path = str(getattr(Config, "DB_PATH", None) or Path(__file__).parent / "bot.db")
+            Path(self.db_path).parent.mkdir(parents=True, exist_ok=True)
+            logger.info("[DB] Использую файл базы данных: %s", self.db_path)
+            started = time.perf_counter()
+            self.init_db()
+            self._ready = True
+            return time.perf_counter() - started
 
     @contextmanager
     def get_connection(self):
+        if not self._ready:
+            self.open()
+        with self._connect() as conn:
+            yield conn
+
+    @contextmanager
+    def _connect(self):
         conn = sqlite3.connect(
             self.db_path,
             timeout=30,
@@ -40,14 +71,14 @@ class Database:
                 return func()
             except sqlite3.OperationalError as exc:
                 if "locked" in str(exc).lower() and attempt < retries - 1:
-                    print(Fore.YELLOW + f"[DB] База занята, повтор {attempt + 1}/{retries}")
+                    logger.warning("[DB] База занята, повтор %s/%s", attempt + 1, retries)
                     time.sleep(delay * (attempt + 1))
                     continue
                 raise
 
     def init_db(self):
-        print(Fore.CYAN + "[DB] Инициализация таблиц")
-        with self.get_connection() as conn:
+        logger.info("[DB] Инициализация таблиц")
+        with self._connect() as conn:
             cursor = conn.cursor()
             cursor.execute(
                 """
@@ -97,8 +128,43 @@ class Database:
             }
             for name, ddl in needed.items():
                 if name not in cols:
-                    print(Fore.YELLOW + f"[DB] Добавляю недостающий столбец: {name}")
+                    logger.warning("[DB] Добавляю недостающий столбец: %s", name)
                     cursor.execute(f"ALTER TABLE users ADD COLUMN {ddl}")
+            cursor.execute(
+                """
+                CREATE TABLE IF NOT EXISTS game_events (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    game_id INTEGER NOT NULL,
+                    event TEXT NOT NULL,
+                    user_id INTEGER,
+                    payload TEXT,
+                    created_at TEXT NOT NULL
+                )
+                """
+            )
+            cursor.execute(
+                "CREATE INDEX IF NOT EXISTS idx_game_events_game_id ON game_events(game_id)"
+            )
+            cursor.execute(
+                """
+                CREATE TABLE IF NOT EXISTS pending_answers (
+                    user_id INTEGER PRIMARY KEY,
+                    game_id INTEGER NOT NULL,
+                    player_name TEXT,
+                    expires_at REAL NOT NULL
+                )
+                """
+            )
+            # Снимок состояния игр при остановке, по одному на воркер
+            cursor.execute(
+                """
+                CREATE TABLE IF NOT EXISTS state_snapshots (
+                    worker_id INTEGER PRIMARY KEY,
+                    payload TEXT NOT NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+                """
+            )
 
     def user_exists(self, telegram_id: int) -> bool:
         with self.get_connection() as conn:
@@ -116,7 +182,7 @@ class Database:
         first_name: str | None,
         last_name: str | None,
     ) -> dict | None:
-        print(Fore.GREEN + f"[DB] Регистрация пользователя {telegram_id}")
+        logger.info("[DB] Регистрация пользователя %s", telegram_id)
         def op():
             with self.get_connection() as conn:
                 cursor = conn.cursor()
@@ -165,11 +231,7 @@ class Database:
                 set_clause = ", ".join(f"{k} = ?" for k in kwargs.keys())
                 values = list(kwargs.values())
                 values.append(telegram_id)
-                print(
-                    Fore.YELLOW
-                    + f"[DB] Обновление пользователя {telegram_id}: "
-                    + ", ".join(f"{k}={v}" for k, v in kwargs.items())
-                )
+                logger.debug("[DB] Обновление пользователя %s: %s", telegram_id, kwargs)
                 cursor.execute(
                     f"UPDATE users SET {set_clause} WHERE telegram_id = ?",
                     values,
@@ -203,6 +265,101 @@ class Database:
             rating=rating,
         )
 
+    def insert_game_events(self, events: list[tuple]):
+        if not events:
+            return
+        def op():
+            with self.get_connection() as conn:
+                conn.executemany(
+                    """
+                    INSERT INTO game_events (game_id, event, user_id, payload, created_at)
+                    VALUES (?, ?, ?, ?, ?)
+                    """,
+                    events,
+                )
+
+        self._safe_execute(op)
+
+    def save_pending_answer(self, user_id: int, game_id: int, player_name: str, expires_at: float):
+        def op():
+            with self.get_connection() as conn:
+                conn.execute(
+                    """
+                    INSERT OR REPLACE INTO pending_answers (user_id, game_id, player_name, expires_at)
+                    VALUES (?, ?, ?, ?)
+                    """,
+                    (user_id, game_id, player_name, expires_at),
+                )
+
+        self._safe_execute(op)
+
+    def delete_pending_answers(self, user_ids: list[int]):
+        if not user_ids:
+            return
+        def op():
+            with self.get_connection() as conn:
+                conn.executemany(
+                    "DELETE FROM pending_answers WHERE user_id = ?",
+                    [(user_id,) for user_id in user_ids],
+                )
+
+        self._safe_execute(op)
+
+    def sync_pending_answers(self, rows: dict[int, tuple | None]):
+        # Последнее состояние по каждому пользователю: кортеж
+        # (game_id, player_name, expires_at) или None — запись удалена.
+        if not rows:
+            return
+        def op():
+            with self.get_connection() as conn:
+                conn.executemany(
+                    """
+                    INSERT OR REPLACE INTO pending_answers (user_id, game_id, player_name, expires_at)
+                    VALUES (?, ?, ?, ?)
+                    """,
+                    [(user_id, *row) for user_id, row in rows.items() if row is not None],
+                )
+                conn.executemany(
+                    "DELETE FROM pending_answers WHERE user_id = ?",
+                    [(user_id,) for user_id, row in rows.items() if row is None],
+                )
+
+        self._safe_execute(op)
+
+    def load_pending_answers(self) -> list[dict]:
+        def op():
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("SELECT user_id, game_id, player_name, expires_at FROM pending_answers")
+                return [dict(row) for row in cursor.fetchall()]
+
+        return self._safe_execute(op)
+
+    def save_state_snapshot(self, worker_id: int, payload: str):
+        def op():
+            with self.get_connection() as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO state_snapshots (worker_id, payload) VALUES (?, ?)",
+                    (worker_id, payload),
+                )
+
+        self._safe_execute(op)
+
+    def take_state_snapshot(self, worker_id: int) -> str | None:
+        # Снимок удаляется при чтении: после аварийного перезапуска старое
+        # состояние не восстановится второй раз.
+        def op():
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("SELECT payload FROM state_snapshots WHERE worker_id = ?", (worker_id,))
+                row = cursor.fetchone()
+                if row is None:
+                    return None
+                conn.execute("DELETE FROM state_snapshots WHERE worker_id = ?", (worker_id,))
+                return row["payload"]
+
+        return self._safe_execute(op)
+
     def can_use_random_search(self, telegram_id: int) -> bool:
         with self.get_connection() as conn:
             cursor = conn.cursor()
@@ -237,13 +394,14 @@ class Database:
                     """,
                     (today.strftime("%Y-%m-%d"), telegram_id),
                 )
-                print(
-                    Fore.CYAN
-                    + f"[DB] Сброс лимита поиска для {telegram_id}, новая попытка 1/{Config.FREE_SEARCHES_PER_DAY}"
+                logger.debug(
+                    "[DB] Сброс лимита поиска для %s, новая попытка 1/%s",
+                    telegram_id,
+                    Config.FREE_SEARCHES_PER_DAY,
                 )
                 return True
             if count >= Config.FREE_SEARCHES_PER_DAY:
-                print(Fore.CYAN + f"[DB] Лимит поиска исчерпан для {telegram_id}")
+                logger.debug("[DB] Лимит поиска исчерпан для %s", telegram_id)
                 return False
             new_count = count + 1
             cursor.execute(
@@ -254,9 +412,8 @@ class Database:
                 """,
                 (new_count, telegram_id),
             )
-            print(
-                Fore.CYAN
-                + f"[DB] Поиск {telegram_id}: попытка {new_count}/{Config.FREE_SEARCHES_PER_DAY}"
+            logger.debug(
+                "[DB] Поиск %s: попытка %s/%s", telegram_id, new_count, Config.FREE_SEARCHES_PER_DAY
             )
             return True
 
@@ -0,0 +1,184 @@
+import asyncio
+import itertools
+import json
+import random
+import time
+from collections import Counter
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from telegram.request import BaseRequest, RequestData
+
+# Поддельный транспорт Bot API для бенчмарков и нагрузочных прогонов без
+# подключения к Telegram: Bot(token, request=FakeTelegramRequest()) работает
+# как обычно, но каждый запрос лишь считается и получает правдоподобный ответ.
+
+FAKE_BOT_USER = {
+    "id": 1,
+    "is_bot": True,
+    "first_name": "FakeBot",
+    "username": "fake_bot",
+    "can_join_groups": False,
+    "can_read_all_group_messages": False,
+    "supports_inline_queries": False,
+}
+
+_MESSAGE_ENDPOINTS = frozenset(
+    {
+        "sendMessage",
+        "sendDocument",
+        "sendInvoice",
+        "sendPhoto",
+        "copyMessage",
+        "forwardMessage",
+        "editMessageText",
+        "editMessageReplyMarkup",
+        "editMessageCaption",
+    }
+)
+
+
+class FakeTelegramRequest(BaseRequest):
+    def __init__(
+        self,
+        latency: float = 0.0,
+        failing_chats: Iterable[int] = (),
+        strict_edits: bool = False,
+        jitter: float = 0.0,
+    ):
+        # strict_edits — правка сообщения, которое этот транспорт не отправлял,
+        # завершается ошибкой 400, как у Telegram для удалённых сообщений.
+        # jitter — случайная добавка к задержке, чтобы ответы приходили не по порядку.
+        self.latency = latency
+        self.jitter = jitter
+        self.failing_chats = set(failing_chats)
+        self.strict_edits = strict_edits
+        self._issued = set()
+        self.calls: Counter = Counter()
+        self.calls_by_chat: Counter = Counter()
+        self._message_ids = itertools.count(1)
+        # Последний текст каждого сообщения: (chat_id, message_id) -> text
+        self.texts: Dict[Tuple[int, int], str] = {}
+        # Загруженные файлы: (chat_id, имя файла, содержимое)
+        self.files: List[Tuple[int, str, bytes]] = []
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    def reset(self):
+        self.calls.clear()
+        self.calls_by_chat.clear()
+
+    @property
+    def total_calls(self) -> int:
+        return sum(count for endpoint, count in self.calls.items() if endpoint != "getMe")
+
+    def _message(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        chat_id = int(params.get("chat_id") or 0)
+        message_id = params.get("message_id") or next(self._message_ids)
+        message = {
+            "message_id": int(message_id),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private" if chat_id > 0 else "group"},
+            "from": FAKE_BOT_USER,
+            "text": params.get("text") or "",
+        }
+        # В ответе Telegram у сообщения бывает только inline-клавиатура.
+        markup = params.get("reply_markup")
+        if isinstance(markup, dict) and "inline_keyboard" in markup:
+            message["reply_markup"] = markup
+        return message
+
+    async def do_request(
+        self,
+        url: str,
+        method: str,
+        request_data: Optional[RequestData] = None,
+        read_timeout=None,
+        write_timeout=None,
+        connect_timeout=None,
+        pool_timeout=None,
+    ) -> Tuple[int, bytes]:
+        endpoint = url.rsplit("/", 1)[-1]
+        params = request_data.parameters if request_data else {}
+        self.calls[endpoint] += 1
+        chat_id = params.get("chat_id")
+        if chat_id is not None:
+            self.calls_by_chat[int(chat_id)] += 1
+        if self.latency or self.jitter:
+            await asyncio.sleep(self.latency + random.uniform(0, self.jitter))
+        if chat_id is not None and int(chat_id) in self.failing_chats:
+            payload = {"ok": False, "error_code": 403, "description": "Forbidden: bot was blocked by the user"}
+            return 403, json.dumps(payload).encode()
+        if self.strict_edits and endpoint.startswith("edit"):
+            key = (int(chat_id or 0), int(params.get("message_id") or 0))
+            if key not in self._issued:
+                payload = {"ok": False, "error_code": 400, "description": "Bad Request: message to edit not found"}
+                return 400, json.dumps(payload).encode()
+        if endpoint == "getMe":
+            result: Any = FAKE_BOT_USER
+        elif endpoint == "getUpdates":
+            await asyncio.sleep(0.05)
+            result = []
+        elif endpoint in _MESSAGE_ENDPOINTS:
+            result = self._message(params)
+            if request_data and request_data.multipart_data:
+                for filename, content, _ in request_data.multipart_data.values():
+                    self.files.append((result["chat"]["id"], filename, content))
+            self.texts[(result["chat"]["id"], result["message_id"])] = result["text"]
+            if self.strict_edits:
+                self._issued.add((result["chat"]["id"], result["message_id"]))
+        else:
+            result = True
+        return 200, json.dumps({"ok": True, "result": result}).encode()
+
+
+class UpdateFactory:
+    # Собирает синтетические апдейты в формате Bot API (dict), которые можно
+    # превратить в Update через Update.de_json или отправить на вебхук.
+
+    def __init__(self, start_update_id: int = 1):
+        self._update_ids = itertools.count(start_update_id)
+        self._message_ids = itertools.count(1_000_000)
+
+    @staticmethod
+    def _user(user_id: int) -> Dict[str, Any]:
+        return {"id": user_id, "is_bot": False, "first_name": f"Игрок{user_id}", "username": f"player{user_id}"}
+
+    @staticmethod
+    def _chat(user_id: int) -> Dict[str, Any]:
+        return {"id": user_id, "type": "private", "first_name": f"Игрок{user_id}"}
+
+    def message(self, user_id: int, text: str) -> Dict[str, Any]:
+        message = {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": self._chat(user_id),
+            "from": self._user(user_id),
+            "text": text,
+        }
+        if text.startswith("/"):
+            command = text.split()[0]
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(command)}]
+        return {"update_id": next(self._update_ids), "message": message}
+
+    def callback(self, user_id: int, data: str, message_id: Optional[int] = None) -> Dict[str, Any]:
+        update_id = next(self._update_ids)
+        return {
+            "update_id": update_id,
+            "callback_query": {
+                "id": str(update_id),
+                "chat_instance": str(user_id),
+                "from": self._user(user_id),
+                "data": data,
+                "message": {
+                    "message_id": message_id or next(self._message_ids),
+                    "date": int(time.time()),
+                    "chat": self._chat(user_id),
+                    "from": FAKE_BOT_USER,
+                    "text": "…",
+                },
+            },
+        }
@@ -0,0 +1,53 @@
+import threading
+import time
+
+# Идентификатор игры в стиле Snowflake:
+# [ миллисекунды от EPOCH_MS | номер воркера | порядковый номер в миллисекунде ]
+# Значение всегда < 2**63, то есть не длиннее 19 десятичных цифр, поэтому
+# даже самый длинный callback ("friend_players_set_<id>_10") укладывается
+# в лимит Telegram в 64 байта.
+EPOCH_MS = 1735689600000  # 2025-01-01 00:00:00 UTC
+WORKER_BITS = 8
+SEQUENCE_BITS = 12
+MAX_WORKER_ID = (1 << WORKER_BITS) - 1
+SEQUENCE_MASK = (1 << SEQUENCE_BITS) - 1
+TIMESTAMP_SHIFT = WORKER_BITS + SEQUENCE_BITS
+
+
+class GameIdGenerator:
+    def __init__(self, worker_id: int = 0, clock=time.time):
+        if not 0 <= worker_id <= MAX_WORKER_ID:
+            raise ValueError(f"worker_id должен быть в диапазоне 0..{MAX_WORKER_ID}")
+        self.worker_id = worker_id
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._last_ms = -1
+        self._sequence = 0
+
+    def _now_ms(self) -> int:
+        return int(self._clock() * 1000) - EPOCH_MS
+
+    def next_id(self) -> int:
+        with self._lock:
+            now = self._now_ms()
+            # Если часы ушли назад, продолжаем от последней выданной метки,
+            # чтобы идентификаторы оставались монотонными.
+            if now <= self._last_ms:
+                now = self._last_ms
+                self._sequence = (self._sequence + 1) & SEQUENCE_MASK
+                if self._sequence == 0:
+                    # Последовательность в этой миллисекунде исчерпана —
+                    # занимаем следующую вместо ожидания.
+                    now += 1
+            else:
+                self._sequence = 0
+            self._last_ms = now
+            return (now << TIMESTAMP_SHIFT) | (self.worker_id << SEQUENCE_BITS) | self._sequence
+
+
+def worker_of(game_id: int) -> int:
+    return (game_id >> SEQUENCE_BITS) & MAX_WORKER_ID
+
+
+def created_at_ms(game_id: int) -> int:
+    return (game_id >> TIMESTAMP_SHIFT) + EPOCH_MS
@@ -1,10 +1,29 @@
+import logging
 import random
-from dataclasses import dataclass, field
-from typing import Dict, List, Optional
-from colorama import init as colorama_init, Fore
+import time
+from collections import deque
+from dataclasses import asdict, dataclass, field
+from typing import Any, Callable, Deque, Dict, List, Optional
 from questions_actions import QUESTIONS, DARES
+from game_ids import GameIdGenerator, worker_of
+from invite_codes import InviteCodeAllocator
+from turn_deadlines import TurnDeadlines
+from pending_answers import PendingAnswerStore
+import journal
 
-colorama_init(autoreset=True)
+logger = logging.getLogger(__name__)
+
+# Политики очерёдности ходов:
+# round_robin — строгий круг по вращающейся очереди;
+# shuffled — каждый раунд все ходят ровно по разу в случайном порядке;
+# random — следующий игрок выбирается случайно (кроме текущего).
+TURN_POLICY_ROUND_ROBIN = "round_robin"
+TURN_POLICY_SHUFFLED = "shuffled"
+TURN_POLICY_RANDOM = "random"
+TURN_POLICIES = (TURN_POLICY_ROUND_ROBIN, TURN_POLICY_SHUFFLED, TURN_POLICY_RANDOM)
+
+# Версия формата снимка состояния: снимок другой версии не восстанавливается.
+SNAPSHOT_VERSION = 1
 
 
 @dataclass
@@ -17,35 +36,83 @@ class GameState:
     host_id: Optional[int] = None
     invite_code: Optional[str] = None
     current_player: Optional[int] = None
+    # Лимит игры в ходах (в интерфейсе — «раунды»), как и раньше.
     max_rounds: int = 10
     max_players: int = 10
     moves_done: int = 0
+    # Полные круги (каждый игрок сделал ход) — для перетасовки очереди в
+    # shuffled и для статистики; на длину игры не влияют.
+    rounds_done: int = 0
+    round_moves: int = 0
+    turn_policy: str = TURN_POLICY_ROUND_ROBIN
+    # round_robin: очередь, в которой turn_order[0] — текущий игрок;
+    # shuffled: игроки, которые ещё не ходили в текущем раунде.
+    turn_order: Deque[int] = field(default_factory=deque)
+    turn_deadline: Optional[float] = None
+    timeouts: Dict[int, int] = field(default_factory=dict)
+    # Сообщение-панель игры у каждого игрока: user_id -> message_id
+    panels: Dict[int, int] = field(default_factory=dict)
 
 
 class GameLogic:
-    def __init__(self, db):
+    def __init__(
+        self,
+        db,
+        worker_id: int = 0,
+        invite_ttl: float = 6 * 3600,
+        invite_secret: Optional[str] = None,
+        game_journal: Optional[journal.GameJournal] = None,
+        turn_timeout: float = 0,
+        turn_policy: str = TURN_POLICY_ROUND_ROBIN,
+        pending_ttl: float = 900,
+        persist_pending: bool = False,
+        on_membership: Optional[Callable[[int, Optional[int]], None]] = None,
+    ):
+        if turn_policy not in TURN_POLICIES:
+            raise ValueError(f"Неизвестная политика очерёдности: {turn_policy}")
         self.db = db
+        self.turn_policy = turn_policy
+        self.journal = game_journal
+        self.turn_timeout = turn_timeout
+        self.deadlines = TurnDeadlines()
         self.games: Dict[int, GameState] = {}
         self.user_to_game: Dict[int, int] = {}
-        self.invite_to_game: Dict[str, int] = {}
+        # Вызывается при входе игрока в игру (user_id, game_id) и выходе из неё
+        # (user_id, None); по этим событиям приёмник обновлений в режиме
+        # нескольких процессов направляет апдейты игрока воркеру его игры.
+        self.on_membership = on_membership
+        self.invites = InviteCodeAllocator(worker_id, ttl_seconds=invite_ttl, secret=invite_secret)
         self.waiting_random: List[Dict] = []
-        self.next_game_id = 1
-        print(Fore.CYAN + "[GAME] Логика игр инициализирована")
+        self.id_generator = GameIdGenerator(worker_id)
+        self.pending = PendingAnswerStore(
+            pending_ttl,
+            db if persist_pending else None,
+            writer=game_journal if persist_pending else None,
+        )
+        if persist_pending:
+            # Игры живут в памяти своего воркера: чужие ответы не восстанавливаем.
+            restored = self.pending.restore(lambda game_id: worker_of(game_id) == worker_id)
+            logger.info("[GAME] Восстановлено ожидающих ответов: %s", restored)
+        logger.info("[GAME] Логика игр инициализирована")
 
     def _generate_game_id(self) -> int:
-        game_id = self.next_game_id
-        self.next_game_id += 1
-        return game_id
+        return self.id_generator.next_id()
+
+    def record_event(self, game_id: int, event: str, user_id: Optional[int] = None, **payload):
+        if self.journal is not None:
+            self.journal.record(game_id, event, user_id, **payload)
 
     def _default_categories(self) -> List[str]:
         return ["acquaintance", "flirt"]
 
-    def _generate_invite_code(self) -> str:
-        alphabet = "ABCDEFGHJKLMNPQRSTUVWXYZ23456789"
-        while True:
-            code = "".join(random.choices(alphabet, k=6))
-            if code not in self.invite_to_game:
-                return code
+    def _bind_user(self, telegram_id: int, game_id: int):
+        self.user_to_game[telegram_id] = game_id
+        if self.on_membership is not None:
+            self.on_membership(telegram_id, game_id)
+
+    def _unbind_user(self, telegram_id: int):
+        if self.user_to_game.pop(telegram_id, None) is not None and self.on_membership is not None:
+            self.on_membership(telegram_id, None)
 
     def get_game_by_id(self, game_id: int) -> Optional[GameState]:
         return self.games.get(game_id)
@@ -75,29 +142,40 @@ class GameLogic:
             host_id=creator_telegram_id,
             max_rounds=max_rounds,
             max_players=max(2, min(max_players, 10)),
+            turn_policy=self.turn_policy,
         )
-        invite_code = self._generate_invite_code()
+        invite_code = self.invites.allocate(game_id)
         state.invite_code = invite_code
         self.games[game_id] = state
-        self.user_to_game[creator_telegram_id] = game_id
-        self.invite_to_game[invite_code] = game_id
-        print(Fore.GREEN + f"[GAME] Создана приватная комната #{game_id} код={invite_code}")
+        self._bind_user(creator_telegram_id, game_id)
+        self.record_event(game_id, journal.GAME_CREATED, creator_telegram_id, game_type="friend", categories=categories)
+        self.record_event(game_id, journal.PLAYER_JOINED, creator_telegram_id)
+        logger.info("[GAME] Создана приватная комната #%s код=%s", game_id, invite_code)
         return state
 
+    def resolve_invite(self, invite_code: str) -> Optional[int]:
+        return self.invites.resolve(invite_code)
+
     def join_friend_game(self, invite_code: str, user_telegram_id: int) -> tuple[bool, str, Optional[GameState]]:
-        game_id = self.invite_to_game.get(invite_code)
+        game_id = self.invites.resolve(invite_code)
         if not game_id:
-            return False, "Игра по этому коду не найдена", None
+            return False, "Игра по этому коду не найдена или код истёк", None
         state = self.games.get(game_id)
         if not state:
             return False, "Игра уже завершена", None
         if user_telegram_id in state.players:
             return False, "Ты уже в этой игре", state
+        if self.user_to_game.get(user_telegram_id) is not None:
+            return False, "Ты уже в другой игре — сначала заверши её", None
         if len(state.players) >= state.max_players:
             return False, f"В этой комнате уже {state.max_players} игроков", None
         state.players.append(user_telegram_id)
-        self.user_to_game[user_telegram_id] = game_id
-        print(Fore.GREEN + f"[GAME] Игрок {user_telegram_id} присоединился к комнате #{game_id}")
+        if state.current_player is not None and state.turn_policy != TURN_POLICY_RANDOM:
+            # Игра уже идёт: новичок встаёт в конец очереди текущего раунда.
+            state.turn_order.append(user_telegram_id)
+        self._bind_user(user_telegram_id, game_id)
+        self.record_event(game_id, journal.PLAYER_JOINED, user_telegram_id)
+        logger.info("[GAME] Игрок %s присоединился к комнате #%s", user_telegram_id, game_id)
         return True, "Вы присоединились к игре", state
 
     async def find_random_game(
@@ -115,7 +193,7 @@ class GameLogic:
             categories = self._default_categories()
         existing = self.get_game_for_user(user_telegram_id)
         if existing and existing.started:
-            print(Fore.YELLOW + f"[GAME] Пользователь {user_telegram_id} уже в игре #{existing.id}")
+            logger.info("[GAME] Пользователь %s уже в игре #%s", user_telegram_id, existing.id)
             return existing
 
         def _fits_preferences(candidate):
@@ -172,12 +250,16 @@ class GameLogic:
                 players=[opponent_id, user_telegram_id],
                 started=True,
                 max_rounds=10,
+                turn_policy=self.turn_policy,
             )
             self.games[game_id] = state
-            self.user_to_game[opponent_id] = game_id
-            self.user_to_game[user_telegram_id] = game_id
+            self._bind_user(opponent_id, game_id)
+            self._bind_user(user_telegram_id, game_id)
+            self.record_event(game_id, journal.GAME_CREATED, None, game_type="random", categories=merged)
+            for uid in state.players:
+                self.record_event(game_id, journal.PLAYER_JOINED, uid)
             self.set_initial_turn(game_id)
-            print(Fore.GREEN + f"[GAME] Случайная игра #{game_id} между {opponent_id} и {user_telegram_id}")
+            logger.info("[GAME] Случайная игра #%s между %s и %s", game_id, opponent_id, user_telegram_id)
             return state
 
         waiting_payload = {
@@ -194,14 +276,14 @@ class GameLogic:
             self.waiting_random.insert(0, waiting_payload)
         else:
             self.waiting_random.append(waiting_payload)
-        print(Fore.YELLOW + f"[GAME] Игрок {user_telegram_id} в ожидании соперника (премиум={is_premium})")
+        logger.info("[GAME] Игрок %s в ожидании соперника (премиум=%s)", user_telegram_id, is_premium)
         return None
 
     def cancel_random_wait(self, user_telegram_id: int) -> bool:
         for idx, opponent in enumerate(list(self.waiting_random)):
             if opponent.get("user_id") == user_telegram_id:
                 self.waiting_random.pop(idx)
-                print(Fore.YELLOW + f"[GAME] Игрок {user_telegram_id} отменил поиск соперника")
+                logger.info("[GAME] Игрок %s отменил поиск соперника", user_telegram_id)
                 return True
         return False
 
@@ -209,37 +291,212 @@ class GameLogic:
         state = self.games.get(game_id)
         if not state or not state.players:
             return None
-        state.current_player = random.choice(state.players)
-        print(Fore.CYAN + f"[GAME] Первый ход в игре #{game_id} у {state.current_player}")
+        state.rounds_done = 0
+        state.round_moves = 0
+        if state.turn_policy == TURN_POLICY_ROUND_ROBIN:
+            state.turn_order = deque(state.players)
+            state.turn_order.rotate(-random.randrange(len(state.players)))
+            state.current_player = state.turn_order[0]
+        elif state.turn_policy == TURN_POLICY_SHUFFLED:
+            order = list(state.players)
+            random.shuffle(order)
+            state.turn_order = deque(order)
+            state.current_player = state.turn_order.popleft()
+        else:
+            state.current_player = random.choice(state.players)
+        self._start_turn_clock(state)
+        logger.debug("[GAME] Первый ход в игре #%s у %s", game_id, state.current_player)
         return state.current_player
 
-    def next_turn_random(self, game_id: int) -> Optional[int]:
+    def next_turn(self, game_id: int) -> Optional[int]:
         state = self.games.get(game_id)
         if not state or not state.players:
             return None
         state.moves_done += 1
+        state.round_moves += 1
+        round_finished = state.round_moves >= len(state.players)
+        if round_finished:
+            state.rounds_done += 1
+            state.round_moves = 0
         if state.moves_done >= state.max_rounds:
-            print(Fore.CYAN + f"[GAME] Лимит раундов в игре #{game_id} достигнут")
+            logger.info("[GAME] Лимит раундов в игре #%s достигнут", game_id)
             return None
         if len(state.players) == 1:
             state.current_player = state.players[0]
-            return state.current_player
-        candidates = [p for p in state.players if p != state.current_player]
-        if not candidates:
-            candidates = state.players
-        state.current_player = random.choice(candidates)
-        print(Fore.CYAN + f"[GAME] Следующий ход в игре #{game_id} у {state.current_player}")
+        elif state.turn_policy == TURN_POLICY_ROUND_ROBIN:
+            state.turn_order.rotate(-1)
+            state.current_player = state.turn_order[0]
+        elif state.turn_policy == TURN_POLICY_SHUFFLED:
+            if round_finished or not state.turn_order:
+                order = list(state.players)
+                random.shuffle(order)
+                # Не даём одному игроку ходить дважды подряд на стыке раундов.
+                if order[0] == state.current_player:
+                    order[0], order[-1] = order[-1], order[0]
+                state.turn_order = deque(order)
+            state.current_player = state.turn_order.popleft()
+        else:
+            # Равномерный выбор среди всех, кроме текущего. Текущего игрока
+            # в списке может уже не быть (исключён за таймауты) — тогда из всех.
+            if state.current_player in state.players:
+                candidates = [uid for uid in state.players if uid != state.current_player]
+            else:
+                candidates = state.players
+            state.current_player = random.choice(candidates)
+        self._start_turn_clock(state)
+        logger.debug(
+            "[GAME] Следующий ход в игре #%s у %s (ход %s/%s)",
+            game_id,
+            state.current_player,
+            state.moves_done + 1,
+            state.max_rounds,
+        )
         return state.current_player
 
-    def finish_game(self, game_id: int):
+    next_turn_random = next_turn
+
+    def _start_turn_clock(self, state: GameState):
+        if self.turn_timeout > 0:
+            state.turn_deadline = self.deadlines.schedule(state.id, self.turn_timeout)
+
+    def expired_turns(self) -> List[GameState]:
+        expired = []
+        for deadline, game_id in self.deadlines.pop_expired():
+            state = self.games.get(game_id)
+            # Запись устарела: игра закончилась, ход сменился или дедлайн продлён.
+            if not state or not state.started or state.turn_deadline != deadline:
+                continue
+            state.turn_deadline = None
+            expired.append(state)
+        return expired
+
+    def register_timeout(self, game_id: int, telegram_id: int) -> int:
+        state = self.games.get(game_id)
+        if not state:
+            return 0
+        strikes = state.timeouts.get(telegram_id, 0) + 1
+        state.timeouts[telegram_id] = strikes
+        self.record_event(game_id, journal.TURN_TIMEOUT, telegram_id, strikes=strikes)
+        logger.info("[GAME] Игрок %s пропустил ход по таймауту в игре #%s (%s)", telegram_id, game_id, strikes)
+        return strikes
+
+    def reset_timeouts(self, game_id: int, telegram_id: int):
+        state = self.games.get(game_id)
+        if state:
+            state.timeouts.pop(telegram_id, None)
+
+    def remove_player(self, game_id: int, telegram_id: int) -> Optional[GameState]:
+        state = self.games.get(game_id)
+        if not state or telegram_id not in state.players:
+            return state
+        state.players.remove(telegram_id)
+        state.timeouts.pop(telegram_id, None)
+        pending = self.pending.get(telegram_id)
+        if pending is not None and pending.game_id == game_id:
+            self.pending.pop(telegram_id)
+        if telegram_id in state.turn_order:
+            was_current = state.turn_order[0] == telegram_id
+            state.turn_order.remove(telegram_id)
+            if was_current and state.turn_policy == TURN_POLICY_ROUND_ROBIN and state.turn_order:
+                # Следующий по кругу уже оказался в начале очереди — откатываем
+                # на шаг, чтобы next_turn не пропустил его.
+                state.turn_order.rotate(1)
+        if self.user_to_game.get(telegram_id) == game_id:
+            self._unbind_user(telegram_id)
+        if state.host_id == telegram_id and state.players:
+            state.host_id = state.players[0]
+        self.record_event(game_id, journal.PLAYER_REMOVED, telegram_id)
+        logger.info("[GAME] Игрок %s исключён из игры #%s", telegram_id, game_id)
+        return state
+
+    def finish_game(self, game_id: int, reason: str = "finished"):
         state = self.games.pop(game_id, None)
         if not state:
             return
         for uid in state.players:
-            self.user_to_game.pop(uid, None)
-        if state.invite_code:
-            self.invite_to_game.pop(state.invite_code, None)
-        print(Fore.CYAN + f"[GAME] Игра #{game_id} завершена")
+            if self.user_to_game.get(uid) == game_id:
+                self._unbind_user(uid)
+        self.invites.release(state.invite_code)
+        self.pending.drop_game(game_id)
+        self.record_event(
+            game_id,
+            journal.GAME_FINISHED,
+            None,
+            reason=reason,
+            moves_done=state.moves_done,
+            rounds_done=state.rounds_done,
+            players=len(state.players),
+        )
+        logger.info("[GAME] Игра #%s завершена", game_id)
+
+    def sizes(self) -> Dict[str, int]:
+        # Для метрик: размеры структур в памяти воркера.
+        return {
+            "games": len(self.games),
+            "players": len(self.user_to_game),
+            "waiting_random": len(self.waiting_random),
+            "pending_answers": len(self.pending),
+            "invite_codes": len(self.invites),
+            "turn_deadlines": len(self.deadlines),
+        }
+
+    def snapshot(self) -> Dict[str, Any]:
+        # Состояние для тёплого перезапуска; всё сериализуемо в JSON.
+        # Дедлайны ходов по монотонным часам сохраняются как остаток времени.
+        now = self.deadlines.now()
+        games = []
+        for state in self.games.values():
+            data = asdict(state)
+            data["turn_order"] = list(state.turn_order)
+            data["timeouts"] = list(state.timeouts.items())
+            data["panels"] = list(state.panels.items())
+            data["turn_deadline"] = (
+                max(0.0, state.turn_deadline - now) if state.turn_deadline is not None else None
+            )
+            games.append(data)
+        return {
+            "version": SNAPSHOT_VERSION,
+            "saved_at": time.time(),
+            "games": games,
+            "invites": self.invites.snapshot(),
+            "waiting_random": list(self.waiting_random),
+            "pending": self.pending.snapshot(),
+        }
+
+    def restore(self, snapshot: Dict[str, Any], max_age: float = 0) -> int:
+        # Возвращает число восстановленных игр. max_age — снимок старше этого
+        # числа секунд отбрасывается (0 — без ограничения).
+        if snapshot.get("version") != SNAPSHOT_VERSION:
+            logger.warning("[GAME] Снимок версии %s не поддерживается", snapshot.get("version"))
+            return 0
+        age = time.time() - snapshot.get("saved_at", 0)
+        if max_age and age > max_age:
+            logger.warning("[GAME] Снимок устарел (%.0f с), начинаем с чистого состояния", age)
+            return 0
+        for data in snapshot["games"]:
+            remaining = data.pop("turn_deadline")
+            state = GameState(**data)
+            state.turn_order = deque(state.turn_order)
+            state.timeouts = {int(uid): count for uid, count in state.timeouts}
+            state.panels = {int(uid): message_id for uid, message_id in state.panels}
+            self.games[state.id] = state
+            for uid in state.players:
+                self._bind_user(uid, state.id)
+            if remaining is not None and self.turn_timeout > 0:
+                state.turn_deadline = self.deadlines.schedule(state.id, remaining)
+        self.invites.restore(snapshot["invites"])
+        waiting = {entry["user_id"] for entry in self.waiting_random}
+        self.waiting_random.extend(
+            entry for entry in snapshot["waiting_random"] if entry["user_id"] not in waiting
+        )
+        self.pending.load(snapshot["pending"])
+        logger.info(
+            "[GAME] Восстановлено из снимка: игр %s, в поиске %s, ожидающих ответов %s",
+            len(snapshot["games"]),
+            len(snapshot["waiting_random"]),
+            len(snapshot["pending"]),
+        )
+        return len(snapshot["games"])
 
     def get_task(self, game_id: int, kind: str) -> str:
         state = self.games.get(game_id)
@@ -253,4 +510,9 @@ class GameLogic:
             pool = DARES.get(category) or []
         if not pool:
             return "Заданий для этой категории пока нет"
-        return random.choice(pool)
+        task = random.choice(pool)
+        # Игрок активен: сбрасываем счётчик таймаутов и даём время на ответ.
+        self.reset_timeouts(game_id, state.current_player)
+        self._start_turn_clock(state)
+        self.record_event(game_id, journal.TASK_DRAWN, state.current_player, kind=kind, category=category, task=task)
+        return task
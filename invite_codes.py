@@ -0,0 +1,165 @@
+import hashlib
+import secrets
+import time
+from collections import OrderedDict
+from typing import Iterable, List, Optional, Tuple
+
+# 32 символа без похожих друг на друга (нет I, O, 0, 1), 6 символов = 30 бит.
+ALPHABET = "ABCDEFGHJKLMNPQRSTUVWXYZ23456789"
+CODE_LENGTH = 6
+CODE_BITS = 30
+HALF_BITS = CODE_BITS // 2
+HALF_MASK = (1 << HALF_BITS) - 1
+FEISTEL_ROUNDS = 4
+
+# Младшие биты порядкового номера кода — номер воркера, поэтому процессы
+# с общим ключом (secret) никогда не выдают одинаковые коды. Со случайным
+# ключом у каждого процесса своя перестановка и такой гарантии нет.
+WORKER_BITS = 8
+WORKER_MASK = (1 << WORKER_BITS) - 1
+SEQUENCE_SPACE = 1 << (CODE_BITS - WORKER_BITS)
+
+_CHAR_INDEX = {ch: idx for idx, ch in enumerate(ALPHABET)}
+
+
+def looks_like_code(text: str) -> bool:
+    return len(text) == CODE_LENGTH and all(ch in _CHAR_INDEX for ch in text)
+
+
+# Коды — перестановка счётчика по секретному ключу (сеть Фейстеля): подряд
+# выданные коды не похожи друг на друга, а в пределах цикла счётчика коллизий
+# нет, поэтому выделение кода — O(1) без повторных попыток.
+class InviteCodeAllocator:
+    def __init__(
+        self,
+        worker_id: int = 0,
+        ttl_seconds: float = 6 * 3600,
+        secret: Optional[str] = None,
+        clock=time.monotonic,
+    ):
+        if not 0 <= worker_id <= WORKER_MASK:
+            raise ValueError(f"worker_id должен быть в диапазоне 0..{WORKER_MASK}")
+        self.worker_id = worker_id
+        self.ttl_seconds = ttl_seconds
+        self._clock = clock
+        key_material = secret.encode() if secret else secrets.token_bytes(32)
+        digest = hashlib.blake2b(key_material, digest_size=4 * FEISTEL_ROUNDS).digest()
+        self._round_keys = [
+            int.from_bytes(digest[i * 4:(i + 1) * 4], "big") for i in range(FEISTEL_ROUNDS)
+        ]
+        # Случайная стартовая точка, чтобы после перезапуска не выдавать те же коды.
+        self._sequence = secrets.randbelow(SEQUENCE_SPACE)
+        # code -> (game_id, expires_at); при постоянном TTL порядок вставки
+        # совпадает с порядком истечения, поэтому чистка идёт с начала.
+        self._codes: "OrderedDict[str, tuple[int, float]]" = OrderedDict()
+
+    def _round(self, value: int, key: int) -> int:
+        value = ((value ^ key) * 0x9E3779B1) & 0xFFFFFFFF
+        return (value ^ (value >> 15)) & HALF_MASK
+
+    def _permute(self, index: int) -> int:
+        left, right = index >> HALF_BITS, index & HALF_MASK
+        for key in self._round_keys:
+            left, right = right, left ^ self._round(right, key)
+        return (left << HALF_BITS) | right
+
+    def _unpermute(self, value: int) -> int:
+        left, right = value >> HALF_BITS, value & HALF_MASK
+        for key in reversed(self._round_keys):
+            left, right = right ^ self._round(left, key), left
+        return (left << HALF_BITS) | right
+
+    @staticmethod
+    def _encode(value: int) -> str:
+        chars = []
+        for _ in range(CODE_LENGTH):
+            chars.append(ALPHABET[value & 31])
+            value >>= 5
+        return "".join(reversed(chars))
+
+    @staticmethod
+    def _decode(code: str) -> Optional[int]:
+        if len(code) != CODE_LENGTH:
+            return None
+        value = 0
+        for ch in code:
+            idx = _CHAR_INDEX.get(ch)
+            if idx is None:
+                return None
+            value = (value << 5) | idx
+        return value
+
+    def worker_of(self, code: str) -> Optional[int]:
+        value = self._decode(code)
+        if value is None:
+            return None
+        return self._unpermute(value) & WORKER_MASK
+
+    def allocate(self, game_id: int) -> str:
+        self.purge_expired()
+        while True:
+            index = (self._sequence << WORKER_BITS) | self.worker_id
+            self._sequence = (self._sequence + 1) % SEQUENCE_SPACE
+            code = self._encode(self._permute(index))
+            # Повтор возможен только после полного оборота счётчика
+            # (или для кодов, восстановленных после перезапуска).
+            if code not in self._codes:
+                break
+        self._codes[code] = (game_id, self._clock() + self.ttl_seconds)
+        return code
+
+    def resolve(self, code: str) -> Optional[int]:
+        entry = self._codes.get(code)
+        if not entry:
+            return None
+        game_id, expires_at = entry
+        if expires_at <= self._clock():
+            self._drop(code)
+            return None
+        return game_id
+
+    def snapshot(self) -> List[Tuple[str, int, float]]:
+        # (код, id игры, сколько секунд осталось жить) — монотонные часы между
+        # процессами не переносятся, поэтому сохраняется остаток срока.
+        now = self._clock()
+        return [
+            (code, game_id, expires_at - now)
+            for code, (game_id, expires_at) in self._codes.items()
+            if expires_at > now
+        ]
+
+    def restore(self, entries: Iterable[Tuple[str, int, float]]) -> int:
+        now = self._clock()
+        restored = 0
+        for code, game_id, remaining in sorted(entries, key=lambda entry: entry[2]):
+            if remaining > 0 and self._decode(code) is not None:
+                self._codes[code] = (game_id, now + remaining)
+                restored += 1
+        # Восстановленные записи могли встать не по сроку относительно
+        # уже выданных — упорядочиваем заново, на этом держится чистка.
+        self._codes = OrderedDict(sorted(self._codes.items(), key=lambda item: item[1][1]))
+        return restored
+
+    def release(self, code: Optional[str]):
+        if code:
+            self._drop(code)
+
+    def _drop(self, code: str):
+        self._codes.pop(code, None)
+
+    def purge_expired(self) -> int:
+        now = self._clock()
+        removed = 0
+        while self._codes:
+            code, (_, expires_at) = next(iter(self._codes.items()))
+            if expires_at > now:
+                break
+            self._drop(code)
+            removed += 1
+        return removed
+
+    def __contains__(self, code: str) -> bool:
+        return self.resolve(code) is not None
+
+    def __len__(self) -> int:
+        return len(self._codes)
@@ -0,0 +1,110 @@
+import asyncio
+import json
+import logging
+from datetime import datetime
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+# Типы событий журнала игры
+GAME_CREATED = "game_created"
+PLAYER_JOINED = "player_joined"
+TASK_DRAWN = "task_drawn"
+ANSWERED = "answered"
+SKIPPED = "skipped"
+TURN_TIMEOUT = "turn_timeout"
+PLAYER_REMOVED = "player_removed"
+GAME_FINISHED = "game_finished"
+
+
+class GameJournal:
+    def __init__(self, db, batch_size: int = 200, flush_interval: float = 2.0, max_buffer: int = 50000):
+        self.db = db
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_buffer = max_buffer
+        self.dropped = 0
+        self._buffer: list[tuple] = []
+        # Ожидающие ответы игроков пишутся той же фоновой пачкой. Хранится
+        # только последнее состояние пользователя, поэтому порядок не важен.
+        self._pending_answers: dict[int, Optional[tuple]] = {}
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def record(self, game_id: int, event: str, user_id: Optional[int] = None, **payload):
+        # Только добавление в память: запись в SQLite делает фоновая задача.
+        if len(self._buffer) >= self.max_buffer:
+            self.dropped += 1
+            return
+        self._buffer.append(
+            (
+                game_id,
+                event,
+                user_id,
+                json.dumps(payload, ensure_ascii=False) if payload else None,
+                datetime.utcnow().isoformat(),
+            )
+        )
+        if self._wakeup is not None and len(self._buffer) >= self.batch_size:
+            self._wakeup.set()
+
+    def save_pending_answer(self, user_id: int, game_id: int, player_name: str, expires_at: float):
+        self._pending_answers[user_id] = (game_id, player_name, expires_at)
+
+    def delete_pending_answers(self, user_ids: list[int]):
+        for user_id in user_ids:
+            self._pending_answers[user_id] = None
+
+    def pending(self) -> int:
+        return len(self._buffer) + len(self._pending_answers)
+
+    async def start(self):
+        if self._task is not None:
+            return
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    def _write(self, batch: list[tuple], answers: dict[int, Optional[tuple]]):
+        # Ответы первыми: их запись идемпотентна, и если упадёт она, события
+        # при повторе не задвоятся.
+        self.db.sync_pending_answers(answers)
+        self.db.insert_game_events(batch)
+
+    async def flush(self) -> int:
+        if not self._buffer and not self._pending_answers:
+            return 0
+        batch, self._buffer = self._buffer, []
+        answers, self._pending_answers = self._pending_answers, {}
+        try:
+            await asyncio.to_thread(self._write, batch, answers)
+        except Exception as e:
+            logger.error("Не удалось записать %s событий журнала: %s", len(batch), e)
+            # Более новые состояния ответов, накопленные за время записи, важнее.
+            self._pending_answers = {**answers, **self._pending_answers}
+            # Возвращаем пачку в начало буфера, чтобы повторить при следующем сбросе.
+            room = self.max_buffer - len(self._buffer)
+            if room < len(batch):
+                self.dropped += len(batch) - max(room, 0)
+                batch = batch[len(batch) - max(room, 0):]
+            self._buffer[:0] = batch
+            return 0
+        return len(batch)
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
@@ -1,31 +1,121 @@
+from functools import lru_cache
+
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup, KeyboardButton
 from config import Config
+from callback_data import (
+    encode,
+    CANCEL,
+    CANCEL_SEARCH,
+    CATEGORIES_DONE,
+    CATEGORY_TOGGLE,
+    DARE,
+    END,
+    FRIEND_BACK,
+    FRIEND_CATEGORIES,
+    FRIEND_DECLINE,
+    FRIEND_ENTER_CODE,
+    FRIEND_PLAYERS,
+    FRIEND_PLAYERS_SET,
+    FRIEND_ROUNDS,
+    FRIEND_ROUNDS_SET,
+    GAME_CATEGORIES,
+    GAME_FRIEND,
+    GAME_GENDER_SEARCH,
+    GAME_RANDOM,
+    GENDER_FEMALE,
+    GENDER_MALE,
+    GENDER_OTHER,
+    JOIN,
+    PREMIUM_BUY,
+    PREMIUM_STATUS,
+    PREMIUM_TRIAL,
+    RATE,
+    SEARCH_AGE_EDIT,
+    SEARCH_GENDER,
+    SET_AGE,
+    SKIP,
+    START_FRIEND,
+    START_GENDER_SEARCH,
+    TRUTH,
+    VERIFY,
+)
+
+# Варианты пола в поиске: в callback_data передаётся индекс варианта
+SEARCH_GENDER_OPTIONS = (
+    ("Мужской", "👨 Ищу парня"),
+    ("Женский", "👩 Ищу девушку"),
+    ("Любой", "♾ Любой"),
+)
+
+# Объекты клавиатур в PTB неизменяемы, поэтому одну и ту же разметку можно
+# отдавать в любое число сообщений. Клавиатуры без параметров строятся один
+# раз (_static), клавиатуры с параметрами кешируются по аргументам в LRU
+# ограниченного размера (_cached).
+_static = lru_cache(maxsize=None)
+_cached = lru_cache(maxsize=Config.KEYBOARD_CACHE_SIZE)
+_CACHED_KEYBOARDS = []
+
+
+def _register(cache_decorator):
+    def wrap(build):
+        cached = cache_decorator(build)
+        _CACHED_KEYBOARDS.append(cached)
+        return cached
+    return wrap
+
+
+def keyboard_cache_stats():
+    # Попадания и промахи по каждой кешируемой клавиатуре
+    stats = {}
+    for cached in _CACHED_KEYBOARDS:
+        info = cached.cache_info()
+        stats[cached.__name__] = {"hits": info.hits, "misses": info.misses, "size": info.currsize}
+    return stats
 
+
+def clear_keyboard_caches():
+    for cached in _CACHED_KEYBOARDS:
+        cached.cache_clear()
+
+
+MAIN_MENU_BUTTONS = (
+    ("🎮 Найти игру", "👥 С друзьями"),
+    ("📊 Статистика", "⭐ Премиум"),
+    ("⚙️ Настройки", "📞 Поддержка"),
+)
+# Нажатие пункта меню выводит из ожидания ввода (например, кода приглашения)
+MAIN_MENU_TEXTS = frozenset(text for row in MAIN_MENU_BUTTONS for text in row)
+
+
+@_register(_static)
 def main_menu():
-    return ReplyKeyboardMarkup([
-        [KeyboardButton("🎮 Найти игру"), KeyboardButton("👥 С друзьями")],
-        [KeyboardButton("📊 Статистика"), KeyboardButton("⭐ Премиум")],
-        [KeyboardButton("⚙️ Настройки"), KeyboardButton("📞 Поддержка")]
-    ], resize_keyboard=True)
+    return ReplyKeyboardMarkup(
+        [[KeyboardButton(text) for text in row] for row in MAIN_MENU_BUTTONS],
+        resize_keyboard=True,
+    )
 
+@_register(_static)
 def game_type_keyboard():
     keyboard = [
         [
-            InlineKeyboardButton("🎲 Случайный игрок", callback_data="game_random"),
-            InlineKeyboardButton("👥 С другом", callback_data="game_friend")
+            InlineKeyboardButton("🎲 Случайный игрок", callback_data=encode(GAME_RANDOM)),
+            InlineKeyboardButton("👥 С другом", callback_data=encode(GAME_FRIEND))
         ],
         [
-            InlineKeyboardButton("🔍 Поиск по полу", callback_data="game_gender_search"),
-            InlineKeyboardButton("🎯 Выбрать категории", callback_data="game_categories")
+            InlineKeyboardButton("🔍 Поиск по полу", callback_data=encode(GAME_GENDER_SEARCH)),
+            InlineKeyboardButton("🎯 Выбрать категории", callback_data=encode(GAME_CATEGORIES))
         ],
-        [InlineKeyboardButton("❌ Отмена", callback_data="cancel")]
+        [InlineKeyboardButton("❌ Отмена", callback_data=encode(CANCEL))]
     ]
     return InlineKeyboardMarkup(keyboard)
 
 def categories_keyboard(selected_categories=None):
-    if selected_categories is None:
-        selected_categories = []
+    # Порядок выбранных категорий на кнопки не влияет — ключ кеша не зависит от него
+    return _categories_keyboard(frozenset(selected_categories or ()))
+
 
+@_register(_cached)
+def _categories_keyboard(selected_categories):
     categories = [
         ('acquaintance', '👋 Знакомство'),
         ('flirt', '😘 Флирт'),
@@ -38,58 +128,71 @@ def categories_keyboard(selected_categories=None):
     row = []
     for i, (cat_id, cat_name) in enumerate(categories):
         emoji = "✅" if cat_id in selected_categories else "⬜"
-        row.append(InlineKeyboardButton(f"{emoji} {cat_name}", callback_data=f"cat_{cat_id}"))
+        row.append(InlineKeyboardButton(f"{emoji} {cat_name}", callback_data=encode(CATEGORY_TOGGLE, cat_id)))
         if len(row) == 2 or i == len(categories) - 1:
             keyboard.append(row)
             row = []
 
     keyboard.append([
-        InlineKeyboardButton("✅ Готово", callback_data="categories_done"),
-        InlineKeyboardButton("❌ Отмена", callback_data="cancel")
+        InlineKeyboardButton("✅ Готово", callback_data=encode(CATEGORIES_DONE)),
+        InlineKeyboardButton("❌ Отмена", callback_data=encode(CANCEL))
     ])
 
     return InlineKeyboardMarkup(keyboard)
 
+@_register(_static)
 def gender_keyboard():
     keyboard = [
         [
-            InlineKeyboardButton("👨 Мужской", callback_data="gender_male"),
-            InlineKeyboardButton("👩 Женский", callback_data="gender_female"),
-            InlineKeyboardButton("🌈 Другой", callback_data="gender_other")
+            InlineKeyboardButton("👨 Мужской", callback_data=encode(GENDER_MALE)),
+            InlineKeyboardButton("👩 Женский", callback_data=encode(GENDER_FEMALE)),
+            InlineKeyboardButton("🌈 Другой", callback_data=encode(GENDER_OTHER))
         ],
-        [InlineKeyboardButton("❌ Отмена", callback_data="cancel")]
+        [InlineKeyboardButton("❌ Отмена", callback_data=encode(CANCEL))]
     ]
     return InlineKeyboardMarkup(keyboard)
 
+@_register(_cached)
 def game_action_keyboard(game_id, can_skip=False):
     keyboard = [
-        [InlineKeyboardButton("🗣️ Правда", callback_data=f"truth_{game_id}"),
-         InlineKeyboardButton("🎭 Действие", callback_data=f"dare_{game_id}")],
+        [InlineKeyboardButton("🗣️ Правда", callback_data=encode(TRUTH, game_id)),
+         InlineKeyboardButton("🎭 Действие", callback_data=encode(DARE, game_id))],
     ]
 
     if can_skip:
-        keyboard.append([InlineKeyboardButton("⏭️ Пропустить", callback_data=f"skip_{game_id}")])
+        keyboard.append([InlineKeyboardButton("⏭️ Пропустить", callback_data=encode(SKIP, game_id))])
 
-    keyboard.append([InlineKeyboardButton("🏁 Завершить игру", callback_data=f"end_{game_id}")])
+    keyboard.append([InlineKeyboardButton("🏁 Завершить игру", callback_data=encode(END, game_id))])
 
     return InlineKeyboardMarkup(keyboard)
 
 
+@_register(_cached)
+def game_panel_keyboard(game_id):
+    keyboard = [
+        [InlineKeyboardButton("🏁 Завершить игру", callback_data=encode(END, game_id))],
+    ]
+    return InlineKeyboardMarkup(keyboard)
+
+
+@_register(_static)
 def search_wait_keyboard():
     keyboard = [
-        [InlineKeyboardButton("❌ Отменить поиск", callback_data="cancel_search")],
+        [InlineKeyboardButton("❌ Отменить поиск", callback_data=encode(CANCEL_SEARCH))],
     ]
     return InlineKeyboardMarkup(keyboard)
 
+@_register(_cached)
 def verification_keyboard(game_id, action_id):
     keyboard = [
         [
-            InlineKeyboardButton("✅ Выполнил", callback_data=f"verify_yes_{game_id}_{action_id}"),
-            InlineKeyboardButton("❌ Не выполнил", callback_data=f"verify_no_{game_id}_{action_id}")
+            InlineKeyboardButton("✅ Выполнил", callback_data=encode(VERIFY, game_id, action_id, 1)),
+            InlineKeyboardButton("❌ Не выполнил", callback_data=encode(VERIFY, game_id, action_id, 0))
         ]
     ]
     return InlineKeyboardMarkup(keyboard)
 
+@_register(_static)
 def premium_keyboard():
     keyboard = []
     labels = {
@@ -102,13 +205,13 @@ def premium_keyboard():
     if "1" in prices:
         first_row.append(
             InlineKeyboardButton(
-                f"✨ {labels['1']} — {prices['1']}⭐", callback_data="premium_1"
+                f"✨ {labels['1']} — {prices['1']}⭐", callback_data=encode(PREMIUM_BUY, 1)
             )
         )
     if "3" in prices:
         first_row.append(
             InlineKeyboardButton(
-                f"💫 {labels['3']} — {prices['3']}⭐", callback_data="premium_3"
+                f"💫 {labels['3']} — {prices['3']}⭐", callback_data=encode(PREMIUM_BUY, 3)
             )
         )
     if first_row:
@@ -118,42 +221,45 @@ def premium_keyboard():
         keyboard.append(
             [
                 InlineKeyboardButton(
-                    f"👑 {labels['12']} — {prices['12']}⭐", callback_data="premium_12"
+                    f"👑 {labels['12']} — {prices['12']}⭐", callback_data=encode(PREMIUM_BUY, 12)
                 ),
-                InlineKeyboardButton("🎁 Пробный 3 дня", callback_data="premium_trial"),
+                InlineKeyboardButton("🎁 Пробный 3 дня", callback_data=encode(PREMIUM_TRIAL)),
             ]
         )
 
     keyboard.append(
         [
-            InlineKeyboardButton("📋 Моя подписка", callback_data="premium_status"),
-            InlineKeyboardButton("❌ Отмена", callback_data="cancel"),
+            InlineKeyboardButton("📋 Моя подписка", callback_data=encode(PREMIUM_STATUS)),
+            InlineKeyboardButton("❌ Отмена", callback_data=encode(CANCEL)),
         ]
     )
     return InlineKeyboardMarkup(keyboard)
 
+@_register(_cached)
 def friend_invite_keyboard(invite_code):
     keyboard = [
-        [InlineKeyboardButton("✅ Присоединиться", callback_data=f"join_{invite_code}"),
-         InlineKeyboardButton("❌ Отклонить", callback_data="friend_decline")]
+        [InlineKeyboardButton("✅ Присоединиться", callback_data=encode(JOIN, invite_code)),
+         InlineKeyboardButton("❌ Отклонить", callback_data=encode(FRIEND_DECLINE))]
     ]
     return InlineKeyboardMarkup(keyboard)
 
 
+@_register(_cached)
 def friend_owner_keyboard(invite_code: str, game_id: int):
     keyboard = [
         [
-            InlineKeyboardButton("🎯 Категории", callback_data=f"friend_cats_{game_id}"),
-            InlineKeyboardButton("🔢 Раунды", callback_data=f"friend_rounds_{game_id}"),
+            InlineKeyboardButton("🎯 Категории", callback_data=encode(FRIEND_CATEGORIES, game_id)),
+            InlineKeyboardButton("🔢 Раунды", callback_data=encode(FRIEND_ROUNDS, game_id)),
         ],
         [
-            InlineKeyboardButton("👥 Игроки", callback_data=f"friend_players_{game_id}"),
+            InlineKeyboardButton("👥 Игроки", callback_data=encode(FRIEND_PLAYERS, game_id)),
         ],
-        [InlineKeyboardButton("🚀 Начать игру", callback_data=f"start_friend_{game_id}")],
+        [InlineKeyboardButton("🚀 Начать игру", callback_data=encode(START_FRIEND, game_id))],
     ]
     return InlineKeyboardMarkup(keyboard)
 
 
+@_register(_cached)
 def friend_rounds_keyboard(game_id: int, current: int):
     options = [5, 10, 20, 40]
     rows = []
@@ -161,15 +267,16 @@ def friend_rounds_keyboard(game_id: int, current: int):
     for idx, value in enumerate(options):
         label = f"{'✅ ' if value == current else ''}{value}"
         row.append(
-            InlineKeyboardButton(label, callback_data=f"friend_round_set_{game_id}_{value}")
+            InlineKeyboardButton(label, callback_data=encode(FRIEND_ROUNDS_SET, game_id, value))
         )
         if len(row) == 2 or idx == len(options) - 1:
             rows.append(row)
             row = []
-    rows.append([InlineKeyboardButton("⬅️ Назад", callback_data=f"friend_back_{game_id}")])
+    rows.append([InlineKeyboardButton("⬅️ Назад", callback_data=encode(FRIEND_BACK, game_id))])
     return InlineKeyboardMarkup(rows)
 
 
+@_register(_cached)
 def friend_players_keyboard(game_id: int, current: int):
     options = [2, 4, 6, 8, 10]
     rows = []
@@ -177,31 +284,46 @@ def friend_players_keyboard(game_id: int, current: int):
     for idx, value in enumerate(options):
         label = f"{'✅ ' if value == current else ''}{value}"
         row.append(
-            InlineKeyboardButton(label, callback_data=f"friend_players_set_{game_id}_{value}")
+            InlineKeyboardButton(label, callback_data=encode(FRIEND_PLAYERS_SET, game_id, value))
         )
         if len(row) == 2 or idx == len(options) - 1:
             rows.append(row)
             row = []
-    rows.append([InlineKeyboardButton("⬅️ Назад", callback_data=f"friend_back_{game_id}")])
+    rows.append([InlineKeyboardButton("⬅️ Назад", callback_data=encode(FRIEND_BACK, game_id))])
     return InlineKeyboardMarkup(rows)
 
 
+@_register(_static)
 def friend_mode_keyboard():
     keyboard = [
-        [InlineKeyboardButton("🆕 Создать комнату", callback_data="game_friend")],
-        [InlineKeyboardButton("🔑 Ввести код", callback_data="friend_enter_code")],
-        [InlineKeyboardButton("❌ Отмена", callback_data="cancel")],
+        [InlineKeyboardButton("🆕 Создать комнату", callback_data=encode(GAME_FRIEND))],
+        [InlineKeyboardButton("🔑 Ввести код", callback_data=encode(FRIEND_ENTER_CODE))],
+        [InlineKeyboardButton("❌ Отмена", callback_data=encode(CANCEL))],
     ]
     return InlineKeyboardMarkup(keyboard)
 
+
+@_register(_static)
+def settings_keyboard():
+    keyboard = [
+        [
+            InlineKeyboardButton("👨 Мужской", callback_data=encode(GENDER_MALE)),
+            InlineKeyboardButton("👩 Женский", callback_data=encode(GENDER_FEMALE)),
+        ],
+        [InlineKeyboardButton("🌈 Другой", callback_data=encode(GENDER_OTHER))],
+        [InlineKeyboardButton("🎂 Указать возраст", callback_data=encode(SET_AGE))],
+    ]
+    return InlineKeyboardMarkup(keyboard)
+
+
+@_register(_cached)
 def search_preferences_keyboard(current_gender: str = "Любой", age_label: str | None = None):
     if not age_label:
         age_label = "🎂 Возраст"
 
     options = [
-        ("pref_gender_Мужской", "👨 Ищу парня", "Мужской"),
-        ("pref_gender_Женский", "👩 Ищу девушку", "Женский"),
-        ("pref_gender_Любой", "♾ Любой", "Любой"),
+        (encode(SEARCH_GENDER, index), label, value)
+        for index, (value, label) in enumerate(SEARCH_GENDER_OPTIONS)
     ]
 
     keyboard_rows = [
@@ -218,20 +340,21 @@ def search_preferences_keyboard(current_gender: str = "Любой", age_label: s
                 callback_data=options[2][0],
             )
         ],
-        [InlineKeyboardButton(age_label, callback_data="pref_age_edit")],
-        [InlineKeyboardButton("🚀 Начать поиск", callback_data="start_gender_search")],
-        [InlineKeyboardButton("❌ Отмена", callback_data="cancel")],
+        [InlineKeyboardButton(age_label, callback_data=encode(SEARCH_AGE_EDIT))],
+        [InlineKeyboardButton("🚀 Начать поиск", callback_data=encode(START_GENDER_SEARCH))],
+        [InlineKeyboardButton("❌ Отмена", callback_data=encode(CANCEL))],
     ]
     return InlineKeyboardMarkup(keyboard_rows)
 
+@_register(_cached)
 def rating_keyboard(game_id, action_id):
     keyboard = [
         [
-            InlineKeyboardButton("⭐ 1", callback_data=f"rate_1_{game_id}_{action_id}"),
-            InlineKeyboardButton("⭐⭐ 2", callback_data=f"rate_2_{game_id}_{action_id}"),
-            InlineKeyboardButton("⭐⭐⭐ 3", callback_data=f"rate_3_{game_id}_{action_id}"),
-            InlineKeyboardButton("⭐⭐⭐⭐ 4", callback_data=f"rate_4_{game_id}_{action_id}"),
-            InlineKeyboardButton("⭐⭐⭐⭐⭐ 5", callback_data=f"rate_5_{game_id}_{action_id}")
+            InlineKeyboardButton("⭐ 1", callback_data=encode(RATE, game_id, action_id, 1)),
+            InlineKeyboardButton("⭐⭐ 2", callback_data=encode(RATE, game_id, action_id, 2)),
+            InlineKeyboardButton("⭐⭐⭐ 3", callback_data=encode(RATE, game_id, action_id, 3)),
+            InlineKeyboardButton("⭐⭐⭐⭐ 4", callback_data=encode(RATE, game_id, action_id, 4)),
+            InlineKeyboardButton("⭐⭐⭐⭐⭐ 5", callback_data=encode(RATE, game_id, action_id, 5))
         ]
     ]
     return InlineKeyboardMarkup(keyboard)
\ No newline at end of file
@@ -0,0 +1,55 @@
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Dict, Hashable
+
+
+class _Entry:
+    __slots__ = ("lock", "users")
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.users = 0  # держат замок или ждут его
+
+
+class KeyedLocks:
+    # asyncio.Lock на каждый ключ (пользователь, игра). Замок живёт, пока его
+    # кто-то держит или ждёт, поэтому словарь не растёт вместе с числом
+    # пользователей. asyncio.Lock отдаёт замок в порядке ожидания, так что
+    # апдейты с одним ключом выполняются в том порядке, в котором пришли.
+
+    def __init__(self):
+        self._entries: Dict[Hashable, _Entry] = {}
+        # Счётчики
+        self.acquired = 0
+        self.contended = 0
+
+    @asynccontextmanager
+    async def hold(self, key: Hashable):
+        entry = self._entries.get(key)
+        if entry is None:
+            entry = self._entries[key] = _Entry()
+        if entry.lock.locked():
+            self.contended += 1
+        entry.users += 1
+        try:
+            async with entry.lock:
+                self.acquired += 1
+                yield
+        finally:
+            entry.users -= 1
+            if not entry.users:
+                del self._entries[key]
+
+    def locked(self, key: Hashable) -> bool:
+        entry = self._entries.get(key)
+        return entry is not None and entry.lock.locked()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "active": len(self._entries),
+            "acquired": self.acquired,
+            "contended": self.contended,
+        }
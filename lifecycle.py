@@ -0,0 +1,92 @@
+import asyncio
+import logging
+import signal
+import time
+from contextlib import contextmanager
+
+from telegram import Update
+from telegram.ext import Application
+
+from config import Config
+from startup_profile import profile as startup_profile
+
+logger = logging.getLogger(__name__)
+
+# Запуск и остановка приложения вместо run_polling/run_webhook. Отличие —
+# в остановке: после сигнала бот перестаёт принимать апдейты, даёт
+# обработчикам и исходящей очереди не больше SHUTDOWN_DRAIN_TIMEOUT секунд,
+# затем post_stop сбрасывает журнал и снимок состояния, и только потом
+# закрываются соединения. Длительность каждой фазы пишется в лог.
+
+
+@contextmanager
+def timed_phase(stage: str, name: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        logger.info("%s: %s — %.0f мс", stage, name, elapsed * 1000)
+        if stage == "Запуск":
+            startup_profile.record(name, elapsed)
+
+
+async def stop_with_deadline(app: Application, timeout: float):
+    # Application.stop() ждёт обработчики, а они — свои сообщения в исходящей
+    # очереди. Если за timeout очередь не разошлась, оставшиеся отправки
+    # отменяются, чтобы уложиться в TimeoutStopSec.
+    stopping = asyncio.ensure_future(app.stop())
+    done, _ = await asyncio.wait({stopping}, timeout=timeout)
+    if not done:
+        limiter = app.bot.rate_limiter
+        dropped = limiter.abort_pending() if hasattr(limiter, "abort_pending") else 0
+        logger.warning(
+            "Исходящая очередь не разошлась за %.0f с: отброшено запросов %s", timeout, dropped
+        )
+    await stopping
+
+
+async def serve(app: Application):
+    stop_requested = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop_requested.set)
+
+    with timed_phase("Запуск", "инициализация"):
+        await app.initialize()
+        if app.post_init:
+            await app.post_init(app)
+        await app.start()
+    with timed_phase("Запуск", "приём апдейтов"):
+        if Config.UPDATE_MODE == "webhook":
+            await app.updater.start_webhook(
+                listen=Config.WEBHOOK_LISTEN,
+                port=Config.WEBHOOK_PORT,
+                url_path=Config.WEBHOOK_PATH,
+                webhook_url=Config.WEBHOOK_URL,
+                secret_token=Config.WEBHOOK_SECRET_TOKEN,
+                max_connections=Config.WEBHOOK_MAX_CONNECTIONS,
+                allowed_updates=Update.ALL_TYPES,
+            )
+        else:
+            await app.updater.start_polling(allowed_updates=Update.ALL_TYPES)
+    startup_profile.mark_ready()
+
+    await stop_requested.wait()
+    logger.info("Получен сигнал остановки")
+    started = time.perf_counter()
+    with timed_phase("Остановка", "приём апдейтов"):
+        await app.updater.stop()
+    with timed_phase("Остановка", "обработчики и исходящая очередь"):
+        await stop_with_deadline(app, Config.SHUTDOWN_DRAIN_TIMEOUT)
+    if app.post_stop:
+        await app.post_stop(app)
+    with timed_phase("Остановка", "закрытие соединений"):
+        await app.shutdown()
+        if app.post_shutdown:
+            await app.post_shutdown(app)
+    logger.info("Остановка завершена за %.0f мс", (time.perf_counter() - started) * 1000)
+
+
+def run_application(app: Application):
+    asyncio.run(serve(app))
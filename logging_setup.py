@@ -0,0 +1,100 @@
+import atexit
+import copy
+import json
+import logging
+import queue
+import sys
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Optional
+
+from config import Config
+
+# Логи пишутся в фоновом потоке: обработчик апдейта только кладёт запись
+# в очередь, а форматирование и запись в stdout (в bot.service это syslog)
+# делает QueueListener. Сообщения передаются с %-аргументами, поэтому
+# выключенный уровень (DEBUG по умолчанию) стоит одной проверки уровня.
+
+TEXT_FORMAT = "%(asctime)s - %(levelname)s - %(message)s"
+NOISY_LOGGERS = ("httpx", "httpcore", "telegram", "apscheduler")
+
+_EXC_FORMATTER = logging.Formatter()
+_listener: Optional[QueueListener] = None
+
+
+class JsonFormatter(logging.Formatter):
+    # Одна запись — одна строка JSON, для сборщиков логов.
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "worker": Config.WORKER_ID,
+            "msg": record.getMessage(),
+        }
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class _QueueHandler(QueueHandler):
+    # Как QueueHandler, но трассировка не вклеивается в текст сообщения,
+    # а едет отдельно в exc_text — JSON-формат пишет её в поле "exc".
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = _EXC_FORMATTER.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def setup_logging(
+    level: Optional[str] = None,
+    fmt: Optional[str] = None,
+    background: Optional[bool] = None,
+    stream=None,
+) -> logging.Handler:
+    # Повторный вызов заменяет обработчики: так воркер после fork заводит
+    # свой поток записи вместо унаследованного.
+    global _listener
+    level = level or Config.LOG_LEVEL
+    fmt = fmt or Config.LOG_FORMAT
+    background = Config.LOG_ASYNC if background is None else background
+
+    output = logging.StreamHandler(stream or sys.stdout)
+    output.setFormatter(JsonFormatter() if fmt == "json" else logging.Formatter(TEXT_FORMAT))
+
+    stop_logging()
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    if background:
+        records: queue.Queue = queue.Queue()
+        _listener = QueueListener(records, output, respect_handler_level=True)
+        _listener.start()
+        handler: logging.Handler = _QueueHandler(records)
+    else:
+        handler = output
+    root.addHandler(handler)
+    root.setLevel(level)
+    for name in NOISY_LOGGERS:
+        logging.getLogger(name).setLevel(logging.WARNING)
+    return handler
+
+
+def stop_logging():
+    # Дописывает очередь до конца. Вызывается и при выходе из процесса.
+    global _listener
+    if _listener is not None:
+        listener, _listener = _listener, None
+        if listener._thread is not None:
+            listener.stop()
+
+
+atexit.register(stop_logging)
@@ -0,0 +1,127 @@
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from typing import Deque, List, Optional, Tuple
+
+from metrics import registry
+
+logger = logging.getLogger(__name__)
+
+# Сторож цикла событий. Задача в цикле раз в interval секунд засыпает и
+# меряет, насколько позже запланированного проснулась, — это задержка
+# планирования (lag): столько ждёт любой готовый к работе обработчик.
+# Отдельный поток следит за «пульсом» этой задачи: если цикл не отвечает
+# дольше threshold, значит его прямо сейчас держит синхронный вызов
+# (sqlite3, time.sleep), и поток снимает стек потока цикла — виновник
+# виден в логе, пока он ещё выполняется.
+
+LAG_SECONDS = registry.histogram(
+    "tod_event_loop_lag_seconds",
+    "Задержка планирования цикла событий",
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0),
+)
+LAG_RECENT = registry.gauge(
+    "tod_event_loop_lag_recent_seconds", "Задержка цикла событий по последним замерам", ("quantile",)
+)
+STALLS = registry.counter("tod_event_loop_stalls_total", "Блокировки цикла событий дольше порога")
+
+
+class Stall:
+    __slots__ = ("at", "duration", "stack")
+
+    def __init__(self, at: float, stack: str):
+        self.at = at
+        self.duration: Optional[float] = None  # None — цикл ещё заблокирован
+        self.stack = stack
+
+
+class LoopWatchdog:
+    def __init__(self, interval: float = 0.1, threshold: float = 0.25, window: int = 600, clock=time.perf_counter):
+        self.interval = interval
+        self.threshold = threshold
+        self._clock = clock
+        self._recent: Deque[float] = deque(maxlen=window)
+        # Последние блокировки
+        self.stalls: Deque[Stall] = deque(maxlen=20)
+        self.stall_count = 0
+        self._heartbeat = 0.0
+        self._loop_thread: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+        self._stall: Optional[Stall] = None
+
+    async def start(self):
+        if self._task is not None:
+            return
+        self._loop_thread = threading.get_ident()
+        self._heartbeat = self._clock()
+        self._stopped.clear()
+        self._task = asyncio.create_task(self._measure(), name="loop_watchdog")
+        self._thread = threading.Thread(target=self._watch, name="tod-loop-watchdog", daemon=True)
+        self._thread.start()
+        registry.on_collect("loop_watchdog", self._collect_metrics)
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._stopped.set()
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        await asyncio.to_thread(self._thread.join)
+        self._thread = None
+
+    async def _measure(self):
+        while True:
+            started = self._clock()
+            await asyncio.sleep(self.interval)
+            now = self._clock()
+            lag = max(0.0, now - started - self.interval)
+            self._heartbeat = now
+            LAG_SECONDS.observe(lag)
+            self._recent.append(lag)
+            stall = self._stall
+            if stall is not None:
+                # Поток сторожа уже записал стек; цикл ожил — пишем длительность.
+                self._stall = None
+                stall.duration = lag
+                logger.warning("Цикл событий был заблокирован %.0f мс", lag * 1000)
+
+    def _watch(self):
+        while not self._stopped.wait(self.threshold / 2):
+            if self._stall is not None:
+                continue
+            blocked = self._clock() - self._heartbeat - self.interval
+            if blocked < self.threshold:
+                continue
+            frame = sys._current_frames().get(self._loop_thread)
+            stack = "".join(traceback.format_stack(frame)) if frame is not None else ""
+            stall = Stall(time.time(), stack)
+            self._stall = stall
+            self.stalls.append(stall)
+            self.stall_count += 1
+            STALLS.inc()
+            logger.warning(
+                "Цикл событий не отвечает уже %.0f мс, сейчас выполняется:\n%s", blocked * 1000, stack
+            )
+
+    def percentiles(self) -> List[Tuple[str, float]]:
+        values = sorted(self._recent)
+        if not values:
+            return []
+        return [
+            (quantile, values[min(len(values) - 1, int(len(values) * float(quantile)))])
+            for quantile in ("0.5", "0.9", "0.99", "1")
+        ]
+
+    def _collect_metrics(self):
+        for quantile, value in self.percentiles():
+            LAG_RECENT.set(value, quantile)
@@ -0,0 +1,355 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import random
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, Callable, Coroutine, Deque, Dict, List, Optional, Tuple, Union
+
+from telegram.error import NetworkError, RetryAfter
+from telegram.ext import BaseRateLimiter
+from telegram.request import BaseRequest
+
+from metrics import registry
+
+logger = logging.getLogger(__name__)
+
+API_SECONDS = registry.histogram(
+    "tod_telegram_api_seconds", "Время вызова Bot API по методам", ("endpoint",)
+)
+API_ERRORS = registry.counter(
+    "tod_telegram_api_errors_total", "Ответы Bot API с ошибкой: HTTP-код или тип исключения", ("endpoint", "code")
+)
+OUTBOUND_WAIT_SECONDS = registry.histogram(
+    "tod_outbound_wait_seconds", "Ожидание запроса в исходящей очереди до отправки"
+)
+OUTBOUND_QUEUE = registry.gauge("tod_outbound_queue", "Исходящая очередь: запросов в очереди и ждущих", ("state",))
+
+# Классы приоритета исходящих запросов (меньше — важнее). Передаются через
+# rate_limit_args, например bot.send_message(..., rate_limit_args=PRIORITY_TURN).
+PRIORITY_URGENT = 0   # ответы на действия пользователя
+PRIORITY_TURN = 1     # приглашение сделать ход, задания
+PRIORITY_NORMAL = 2
+PRIORITY_LOW = 3      # фоновые уведомления «ожидай своей очереди»
+
+# Методы, которые Telegram ограничивает по частоте; остальные (answerCallbackQuery,
+# getMe и т.п.) выполняются без очереди.
+LIMITED_ENDPOINTS = frozenset(
+    {
+        "sendMessage",
+        "sendPhoto",
+        "sendDocument",
+        "sendInvoice",
+        "sendAnimation",
+        "sendSticker",
+        "copyMessage",
+        "forwardMessage",
+        "editMessageText",
+        "editMessageReplyMarkup",
+        "editMessageCaption",
+    }
+)
+
+
+class SendAborted(NetworkError):
+    # Запрос отброшен при остановке бота, не дождавшись очереди.
+    pass
+
+
+class TokenBucket:
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate: float, capacity: float, now: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+
+    def take(self, now: float) -> float:
+        # Возвращает 0, если токен взят, иначе сколько секунд ждать.
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def is_full(self, now: float) -> bool:
+        return self.tokens + (now - self.updated) * self.rate >= self.capacity
+
+
+class OutboundRateLimiter(BaseRateLimiter[int]):
+    # Все исходящие запросы бота проходят здесь: сначала по очереди своего чата
+    # (порядок сообщений в чате сохраняется), затем в общую очередь с приоритетами,
+    # откуда их выпускает один диспетчер с глобальным ведром токенов.
+
+    def __init__(
+        self,
+        global_rate: float = 30.0,
+        chat_rate: float = 1.0,
+        chat_burst: float = 3.0,
+        group_rate: float = 20 / 60,
+        max_retries: int = 3,
+        clock=time.monotonic,
+    ):
+        for name, rate in (("global_rate", global_rate), ("chat_rate", chat_rate), ("group_rate", group_rate)):
+            if rate <= 0:
+                raise ValueError(f"{name} должен быть больше нуля, получено {rate}")
+        self.global_rate = global_rate
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_rate
+        self.max_retries = max_retries
+        self._clock = clock
+        # Ёмкость не меньше одного токена: take() выпускает запрос только при
+        # tokens >= 1, и при лимите меньше 1 в секунду иначе не выпустит никогда.
+        self._global = TokenBucket(global_rate, max(1.0, global_rate), clock())
+        self._chat_buckets: Dict[Any, TokenBucket] = {}
+        self._chat_locks: Dict[Any, Tuple[asyncio.Lock, int]] = {}
+        self._heap: List[Tuple[int, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._dispatcher: Optional[asyncio.Task] = None
+        self._paused_until = 0.0
+        self._last_compaction = clock()
+        self._closing = False
+        # Метрики
+        self.waiting = 0
+        self.max_queue_depth = 0
+        self.sent = 0
+        self.retries = 0
+        self.retry_after_events = 0
+        self._waits: Deque[float] = deque(maxlen=2000)
+
+    async def initialize(self) -> None:
+        registry.on_collect("outbound", self._collect_metrics)
+        if self._dispatcher is None:
+            self._wakeup = asyncio.Event()
+            self._dispatcher = asyncio.create_task(self._dispatch())
+
+    async def shutdown(self) -> None:
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
+            try:
+                await self._dispatcher
+            except asyncio.CancelledError:
+                pass
+            self._dispatcher = None
+        while self._heap:
+            _, _, future = heapq.heappop(self._heap)
+            if not future.done():
+                future.cancel()
+
+    def _collect_metrics(self):
+        OUTBOUND_QUEUE.set(self.queue_depth(), "queued")
+        OUTBOUND_QUEUE.set(self.waiting, "waiting")
+
+    def abort_pending(self) -> int:
+        # Остановка по дедлайну: всё, что ещё не отправлено, завершается
+        # ошибкой сети, как если бы Telegram был недоступен. Возвращает число
+        # отброшенных запросов.
+        self._closing = True
+        dropped = self.waiting
+        while self._heap:
+            _, _, future = heapq.heappop(self._heap)
+            if not future.done():
+                future.set_exception(SendAborted("Отправка прервана: бот останавливается"))
+        return dropped
+
+    def queue_depth(self) -> int:
+        return len(self._heap)
+
+    def stats(self) -> Dict[str, float]:
+        waits = sorted(self._waits)
+        count = len(waits)
+        return {
+            "queue_depth": len(self._heap),
+            "waiting": self.waiting,
+            "max_queue_depth": self.max_queue_depth,
+            "sent": self.sent,
+            "retries": self.retries,
+            "retry_after_events": self.retry_after_events,
+            "wait_avg_ms": (sum(waits) / count * 1000) if count else 0.0,
+            "wait_p95_ms": (waits[min(count - 1, int(count * 0.95))] * 1000) if count else 0.0,
+            "wait_max_ms": (waits[-1] * 1000) if count else 0.0,
+        }
+
+    async def _dispatch(self):
+        while True:
+            if not self._heap:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            now = self._clock()
+            if self._paused_until > now:
+                await asyncio.sleep(self._paused_until - now)
+                continue
+            wait = self._global.take(now)
+            if wait > 0:
+                await asyncio.sleep(wait)
+                continue
+            _, _, future = heapq.heappop(self._heap)
+            if not future.done():
+                future.set_result(None)
+
+    async def _acquire_global(self, priority: int):
+        if self._dispatcher is None:
+            await self.initialize()
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._heap, (priority, next(self._seq), future))
+        self.max_queue_depth = max(self.max_queue_depth, len(self._heap))
+        self._wakeup.set()
+        await future
+
+    def _chat_bucket(self, chat_id, now: float) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            is_group = isinstance(chat_id, str) or chat_id < 0
+            rate = self.group_rate if is_group else self.chat_rate
+            bucket = TokenBucket(rate, 1.0 if is_group else self.chat_burst, now)
+            self._chat_buckets[chat_id] = bucket
+        return bucket
+
+    async def _acquire_chat(self, chat_id):
+        while True:
+            now = self._clock()
+            wait = self._chat_bucket(chat_id, now).take(now)
+            if wait <= 0:
+                return
+            await asyncio.sleep(wait)
+
+    def _compact(self, now: float):
+        # Убираем вёдра чатов, которые давно заполнены до краёв и не нужны.
+        if now - self._last_compaction < 60:
+            return
+        self._last_compaction = now
+        idle = [
+            chat_id
+            for chat_id, bucket in self._chat_buckets.items()
+            if chat_id not in self._chat_locks and bucket.is_full(now)
+        ]
+        for chat_id in idle:
+            del self._chat_buckets[chat_id]
+
+    @asynccontextmanager
+    async def _chat_slot(self, chat_id):
+        # Запросы в один чат выполняются строго по очереди, чтобы сообщения
+        # приходили в том порядке, в котором их отправили.
+        if chat_id is None:
+            yield
+            return
+        lock, users = self._chat_locks.get(chat_id, (None, 0))
+        if lock is None:
+            lock = asyncio.Lock()
+        self._chat_locks[chat_id] = (lock, users + 1)
+        try:
+            async with lock:
+                yield
+        finally:
+            lock, users = self._chat_locks[chat_id]
+            if users <= 1:
+                del self._chat_locks[chat_id]
+            else:
+                self._chat_locks[chat_id] = (lock, users - 1)
+
+    async def process_request(
+        self,
+        callback: Callable[..., Coroutine[Any, Any, Union[bool, Dict[str, Any], List[Dict[str, Any]]]]],
+        args: Any,
+        kwargs: Dict[str, Any],
+        endpoint: str,
+        data: Dict[str, Any],
+        rate_limit_args: Optional[int],
+    ) -> Union[bool, Dict[str, Any], List[Dict[str, Any]]]:
+        if endpoint not in LIMITED_ENDPOINTS:
+            return await callback(*args, **kwargs)
+        priority = rate_limit_args
+        if priority is None:
+            # Правка сообщения — всегда реакция на нажатие кнопки.
+            priority = PRIORITY_URGENT if endpoint.startswith("edit") else PRIORITY_NORMAL
+        chat_id = data.get("chat_id")
+        attempt = 0
+        granted = False
+        self.waiting += 1
+        started = self._clock()
+        try:
+            async with self._chat_slot(chat_id):
+                while True:
+                    if self._closing:
+                        raise SendAborted("Отправка прервана: бот останавливается")
+                    if chat_id is not None:
+                        await self._acquire_chat(chat_id)
+                    await self._acquire_global(priority)
+                    if not granted:
+                        granted = True
+                        self.waiting -= 1
+                        now = self._clock()
+                        self._waits.append(now - started)
+                        OUTBOUND_WAIT_SECONDS.observe(now - started)
+                        self._compact(now)
+                    try:
+                        result = await callback(*args, **kwargs)
+                    except RetryAfter as exc:
+                        self.retry_after_events += 1
+                        if attempt >= self.max_retries:
+                            raise
+                        attempt += 1
+                        self.retries += 1
+                        delay = exc.retry_after
+                        if not isinstance(delay, (int, float)):
+                            delay = delay.total_seconds()
+                        # Флуд-лимит действует на бота целиком — останавливаем всю
+                        # отправку; небольшой разброс, чтобы повторы не ушли пачкой.
+                        self._paused_until = max(
+                            self._paused_until,
+                            self._clock() + delay + random.uniform(0, 0.5 * attempt),
+                        )
+                        logger.warning(
+                            "Флуд-лимит Telegram (%s): пауза %.1f с, повтор %s/%s",
+                            endpoint,
+                            delay,
+                            attempt,
+                            self.max_retries,
+                        )
+                        # Повтор обгоняет обычные сообщения в общей очереди.
+                        priority = min(priority, PRIORITY_TURN)
+                        continue
+                    self.sent += 1
+                    return result
+        finally:
+            if not granted:
+                self.waiting -= 1
+
+
+class MeteredRequest(BaseRequest):
+    # Обёртка транспорта Bot API: время каждого вызова и коды ошибок по методам.
+    # Стоит под ограничителем, поэтому время ожидания в очереди сюда не входит.
+
+    def __init__(self, inner: BaseRequest):
+        self.inner = inner
+
+    @property
+    def read_timeout(self):
+        return self.inner.read_timeout
+
+    async def initialize(self) -> None:
+        await self.inner.initialize()
+
+    async def shutdown(self) -> None:
+        await self.inner.shutdown()
+
+    async def do_request(self, url: str, method: str, request_data=None, **timeouts) -> Tuple[int, bytes]:
+        endpoint = url.rsplit("/", 1)[-1]
+        started = time.perf_counter()
+        try:
+            code, payload = await self.inner.do_request(url, method, request_data=request_data, **timeouts)
+        except Exception as e:
+            API_ERRORS.inc(endpoint, type(e).__name__)
+            raise
+        finally:
+            API_SECONDS.observe(time.perf_counter() - started, endpoint)
+        if code >= 400:
+            API_ERRORS.inc(endpoint, str(code))
+        return code, payload
@@ -0,0 +1,80 @@
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+# Telegram гарантирует, что message_id помещается в 32 бита, поэтому пара
+# (chat_id, message_id) упаковывается в одно целое число.
+MESSAGE_ID_BITS = 32
+MESSAGE_ID_MASK = (1 << MESSAGE_ID_BITS) - 1
+
+
+def pack_message_key(chat_id: int, message_id: int) -> int:
+    return (chat_id << MESSAGE_ID_BITS) | (message_id & MESSAGE_ID_MASK)
+
+
+class MessageOwners:
+    # Кому принадлежит панель с кнопками: LRU ограниченного размера с временем
+    # жизни записи. Каждое обращение продлевает запись и переносит её в конец,
+    # поэтому в начале словаря всегда самые старые — и по LRU, и по сроку.
+
+    def __init__(self, max_size: int = 50000, ttl_seconds: float = 24 * 3600, clock=time.monotonic):
+        self.max_size = max_size
+        self.ttl = ttl_seconds
+        self._clock = clock
+        self._owners: "OrderedDict[int, Tuple[int, float]]" = OrderedDict()
+        # Счётчики
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+        self.expired = 0
+
+    def register(self, chat_id: int, message_id: int, owner_id: int):
+        now = self._clock()
+        key = pack_message_key(chat_id, message_id)
+        self._owners[key] = (owner_id, now + self.ttl)
+        self._owners.move_to_end(key)
+        self._purge_expired(now)
+        while len(self._owners) > self.max_size:
+            self._owners.popitem(last=False)
+            self.evicted += 1
+
+    def owner(self, chat_id: int, message_id: int) -> Optional[int]:
+        key = pack_message_key(chat_id, message_id)
+        entry = self._owners.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        owner_id, expires_at = entry
+        now = self._clock()
+        if expires_at <= now:
+            del self._owners[key]
+            self.expired += 1
+            self.misses += 1
+            return None
+        self._owners[key] = (owner_id, now + self.ttl)
+        self._owners.move_to_end(key)
+        self.hits += 1
+        return owner_id
+
+    def forget(self, chat_id: int, message_id: int):
+        self._owners.pop(pack_message_key(chat_id, message_id), None)
+
+    def _purge_expired(self, now: float):
+        while self._owners:
+            key, (_, expires_at) = next(iter(self._owners.items()))
+            if expires_at > now:
+                break
+            del self._owners[key]
+            self.expired += 1
+
+    def __len__(self) -> int:
+        return len(self._owners)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "size": len(self._owners),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evicted": self.evicted,
+            "expired": self.expired,
+        }
@@ -0,0 +1,132 @@
+import time
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+
+@dataclass
+class PendingAnswer:
+    game_id: int
+    player_id: int
+    player_name: str
+    expires_at: float
+
+
+class PendingAnswerStore:
+    # Игроки, которые выбрали задание и должны ответить сообщением.
+    # Одна запись на пользователя; запись истекает через ttl_seconds, удаляется
+    # при завершении игры и, если передан db, дублируется в SQLite, чтобы
+    # переживать перезапуск бота. Время — по настенным часам, раз записи
+    # сохраняются между процессами. С writer (журнал игр) запись в базу идёт
+    # его фоновыми пачками, а не синхронно в цикле событий; db тогда нужен
+    # только для restore().
+
+    def __init__(self, ttl_seconds: float = 900, db=None, clock=time.time, writer=None):
+        self.ttl = ttl_seconds
+        self.db = db
+        self.writer = writer if writer is not None else db
+        self._clock = clock
+        # Порядок вставки совпадает с порядком истечения: set() переносит запись в конец.
+        self._answers: Dict[int, PendingAnswer] = {}
+        self._by_game: Dict[int, Set[int]] = {}
+
+    def set(self, user_id: int, game_id: int, player_name: str) -> PendingAnswer:
+        now = self._clock()
+        self.purge_expired(now)
+        self._remove(user_id)
+        answer = PendingAnswer(game_id, user_id, player_name, now + self.ttl)
+        self._put(answer)
+        if self.writer is not None:
+            self.writer.save_pending_answer(user_id, game_id, player_name, answer.expires_at)
+        return answer
+
+    def get(self, user_id: int) -> Optional[PendingAnswer]:
+        answer = self._answers.get(user_id)
+        if answer is None:
+            return None
+        if answer.expires_at <= self._clock():
+            self.pop(user_id)
+            return None
+        return answer
+
+    def pop(self, user_id: int) -> Optional[PendingAnswer]:
+        answer = self._remove(user_id)
+        if answer is not None and self.writer is not None:
+            self.writer.delete_pending_answers([user_id])
+        return answer
+
+    def drop_game(self, game_id: int):
+        user_ids = list(self._by_game.get(game_id, ()))
+        for user_id in user_ids:
+            self._remove(user_id)
+        if user_ids and self.writer is not None:
+            self.writer.delete_pending_answers(user_ids)
+
+    def purge_expired(self, now: Optional[float] = None):
+        now = self._clock() if now is None else now
+        expired = []
+        for user_id, answer in self._answers.items():
+            if answer.expires_at > now:
+                break
+            expired.append(user_id)
+        for user_id in expired:
+            self._remove(user_id)
+        if expired and self.writer is not None:
+            self.writer.delete_pending_answers(expired)
+
+    def restore(self, game_filter: Optional[Callable[[int], bool]] = None) -> int:
+        # Загружает сохранённые ответы после перезапуска; истёкшие отбрасываются.
+        # game_filter оставляет только ответы игр, которые ведёт этот процесс.
+        if self.db is None:
+            return 0
+        now = self._clock()
+        rows = sorted(self.db.load_pending_answers(), key=lambda row: row["expires_at"])
+        for row in rows:
+            if row["expires_at"] > now and (game_filter is None or game_filter(row["game_id"])):
+                self._put(PendingAnswer(row["game_id"], row["user_id"], row["player_name"], row["expires_at"]))
+        self.writer.delete_pending_answers(
+            [row["user_id"] for row in rows if row["expires_at"] <= now]
+        )
+        return len(self._answers)
+
+    def snapshot(self) -> List[Tuple[int, int, str, float]]:
+        now = self._clock()
+        return [
+            (answer.player_id, answer.game_id, answer.player_name, answer.expires_at)
+            for answer in self._answers.values()
+            if answer.expires_at > now
+        ]
+
+    def load(self, entries: Iterable[Tuple[int, int, str, float]]) -> int:
+        # Ответы из снимка состояния; в базу не пишутся — если хранение
+        # включено, они там уже есть.
+        now = self._clock()
+        loaded = 0
+        for user_id, game_id, player_name, expires_at in entries:
+            if expires_at > now:
+                self._remove(user_id)
+                self._put(PendingAnswer(game_id, user_id, player_name, expires_at))
+                loaded += 1
+        # purge_expired() полагается на порядок истечения во всём словаре,
+        # включая записи, которые были в нём до загрузки.
+        self._answers = dict(sorted(self._answers.items(), key=lambda item: item[1].expires_at))
+        return loaded
+
+    def _put(self, answer: PendingAnswer):
+        self._answers[answer.player_id] = answer
+        self._by_game.setdefault(answer.game_id, set()).add(answer.player_id)
+
+    def _remove(self, user_id: int) -> Optional[PendingAnswer]:
+        answer = self._answers.pop(user_id, None)
+        if answer is not None:
+            users = self._by_game.get(answer.game_id)
+            if users is not None:
+                users.discard(user_id)
+                if not users:
+                    del self._by_game[answer.game_id]
+        return answer
+
+    def __contains__(self, user_id: int) -> bool:
+        return self.get(user_id) is not None
+
+    def __len__(self) -> int:
+        return len(self._answers)
@@ -0,0 +1,162 @@
+import cProfile
+import io
+import pstats
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from typing import Dict, List, Optional, Set
+
+# Профилирование живых обработчиков по команде администратора (/profile).
+# Пока сессия не запущена, обработчик апдейта платит одной проверкой
+# profiler.active.
+#
+# sample — отдельный поток раз в interval секунд снимает стек потока цикла
+#   событий. Действие (route) берётся из кадра обёртки обработчика
+#   (код из route_codes, локальная переменная route), поэтому горячие функции
+#   считаются отдельно для каждого действия. Накладные расходы — только поток
+#   семплирования.
+# trace — cProfile на весь поток цикла событий: точные счётчики вызовов, но
+#   обработчики в asyncio чередуются, так что горячие функции общие для всех
+#   действий; по действиям — только время обработки.
+
+MODES = ("sample", "trace")
+IDLE_ROUTE = "(простой)"
+
+
+def _describe(code) -> str:
+    filename = code.co_filename.rsplit("/", 1)[-1]
+    return f"{code.co_name} ({filename}:{code.co_firstlineno})"
+
+
+class HandlerProfiler:
+    def __init__(self, sample_interval: float = 0.005, top: int = 25):
+        self.sample_interval = sample_interval
+        self.top = top
+        self.active = False
+        self.mode: Optional[str] = None
+        self.session = 0
+        # Коды кадров, в которых лежит локальная переменная route
+        self.route_codes: Set = set()
+        self._limit_updates: Optional[int] = None
+        self._deadline: Optional[float] = None
+        self._started = 0.0
+        self._timings: Dict[str, List[float]] = defaultdict(list)
+        self._profile: Optional[cProfile.Profile] = None
+        self._sampler: Optional[threading.Thread] = None
+        self._stop_sampling = threading.Event()
+        self._samples: Dict[str, Counter] = defaultdict(Counter)
+        self._inclusive: Dict[str, Counter] = defaultdict(Counter)
+        self._route_samples: Counter = Counter()
+
+    def start(self, mode: str, updates: Optional[int] = None, seconds: Optional[float] = None) -> int:
+        # Вызывается из потока цикла событий: cProfile включается для него.
+        if mode not in MODES:
+            raise ValueError(f"Неизвестный режим профилирования: {mode}")
+        if self.active:
+            raise RuntimeError("Профилирование уже идёт")
+        self.session += 1
+        self.mode = mode
+        self._limit_updates = updates
+        self._started = time.perf_counter()
+        self._deadline = self._started + seconds if seconds else None
+        self._timings.clear()
+        self._samples.clear()
+        self._inclusive.clear()
+        self._route_samples.clear()
+        if mode == "trace":
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+        else:
+            self._stop_sampling.clear()
+            self._sampler = threading.Thread(
+                target=self._sample_loop,
+                args=(threading.get_ident(),),
+                name="tod-profiler",
+                daemon=True,
+            )
+            self._sampler.start()
+        self.active = True
+        return self.session
+
+    def record(self, route: str, elapsed: float) -> bool:
+        # Возвращает True, когда сессия набрала заданное число апдейтов
+        # или истекло её время.
+        self._timings[route].append(elapsed)
+        if self._limit_updates is not None and self.updates >= self._limit_updates:
+            return True
+        return self._deadline is not None and time.perf_counter() >= self._deadline
+
+    @property
+    def updates(self) -> int:
+        return sum(len(values) for values in self._timings.values())
+
+    def stop(self) -> str:
+        # Завершает сессию и возвращает отчёт.
+        if not self.active:
+            return ""
+        self.active = False
+        elapsed = time.perf_counter() - self._started
+        if self._profile is not None:
+            self._profile.disable()
+        if self._sampler is not None:
+            self._stop_sampling.set()
+            self._sampler.join()
+            self._sampler = None
+        report = self._report(elapsed)
+        self._profile = None
+        return report
+
+    def _sample_loop(self, thread_id: int):
+        while not self._stop_sampling.wait(self.sample_interval):
+            frame = sys._current_frames().get(thread_id)
+            if frame is None:
+                continue
+            route = None
+            seen = set()
+            leaf = _describe(frame.f_code)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                if route is None and code in self.route_codes:
+                    route = frame.f_locals.get("route")
+                if code not in seen:
+                    seen.add(code)
+                    stack.append(code)
+                frame = frame.f_back
+            route = route or IDLE_ROUTE
+            self._route_samples[route] += 1
+            self._samples[route][leaf] += 1
+            inclusive = self._inclusive[route]
+            for code in stack:
+                inclusive[_describe(code)] += 1
+
+    def _report(self, elapsed: float) -> str:
+        out = io.StringIO()
+        out.write(
+            f"Профилирование #{self.session}: режим {self.mode}, {elapsed:.1f} с, апдейтов {self.updates}\n\n"
+        )
+        out.write("Время обработки по действиям (мс):\n")
+        out.write(f"{'действие':<36}{'апдейтов':>9}{'всего':>10}{'среднее':>10}{'макс':>10}\n")
+        for route, values in sorted(self._timings.items(), key=lambda item: -sum(item[1])):
+            out.write(
+                f"{route:<36}{len(values):>9}{sum(values) * 1000:>10.1f}"
+                f"{sum(values) / len(values) * 1000:>10.2f}{max(values) * 1000:>10.2f}\n"
+            )
+        if self.mode == "trace" and self._profile is not None:
+            for sort_key, title in (("tottime", "собственное время"), ("cumulative", "с вложенными вызовами")):
+                out.write(f"\nГорячие функции — {title}:\n")
+                stats = pstats.Stats(self._profile, stream=out)
+                stats.strip_dirs().sort_stats(sort_key).print_stats(self.top)
+        else:
+            total = sum(self._route_samples.values()) or 1
+            out.write(f"\nСемплов: {total}, интервал {self.sample_interval * 1000:.0f} мс\n")
+            for route, count in self._route_samples.most_common():
+                out.write(f"\n== {route}: {count} семплов ({count / total:.0%})\n")
+                out.write("  собственное время:\n")
+                for name, hits in self._samples[route].most_common(self.top):
+                    out.write(f"    {hits:>6}  {name}\n")
+                out.write("  с вложенными вызовами:\n")
+                for name, hits in self._inclusive[route].most_common(self.top):
+                    out.write(f"    {hits:>6}  {name}\n")
+        return out.getvalue()
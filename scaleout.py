@@ -0,0 +1,341 @@
+import asyncio
+import logging
+import multiprocessing
+import signal
+import threading
+import zlib
+from collections import Counter
+from typing import Any, Dict, Optional, Set
+
+from telegram import Update
+from telegram.ext import Application, ApplicationHandlerStop, TypeHandler
+
+import callback_data as cb
+from callback_data import CallbackDataError, decode
+from config import Config
+from game_ids import MAX_WORKER_ID, worker_of
+from invite_codes import InviteCodeAllocator, looks_like_code
+from keyboards import MAIN_MENU_TEXTS
+from lifecycle import stop_with_deadline
+from logging_setup import setup_logging
+
+# Режим нескольких процессов: процесс-приёмник получает апдейты (polling
+# или webhook) и раздаёт их WORKERS процессам-воркерам. Каждый воркер — обычный
+# бот из start_bot.py со своим WORKER_ID: игры, коды приглашений и ожидающие
+# ответы живут в памяти того воркера, который создал игру, а id игры и код
+# приглашения несут номер воркера, поэтому приёмник знает, куда их отправить.
+#
+# Куда идёт апдейт:
+# 1. кнопки хода и настроек комнаты — воркеру, создавшему игру (по id игры);
+# 2. вход по коду (кнопка, /join КОД или код после «Ввести код») —
+#    воркеру комнаты;
+# 3. случайный поиск соперника — одному воркеру, у которого общая очередь;
+# 4. апдейты игрока, который сейчас в игре, — воркеру этой игры
+#    (воркеры сообщают приёмнику о входе и выходе игроков);
+# 5. остальное — «домашнему» воркеру игрока по стабильному хешу user_id.
+
+logger = logging.getLogger(__name__)
+
+MATCHMAKING_WORKER = 0
+
+# Действия, первый аргумент которых — id игры
+GAME_ACTIONS = frozenset(
+    action.code
+    for action in (
+        cb.TRUTH,
+        cb.DARE,
+        cb.CONTINUE,
+        cb.SKIP,
+        cb.END,
+        cb.VERIFY,
+        cb.RATE,
+        cb.FRIEND_CATEGORIES,
+        cb.FRIEND_ROUNDS,
+        cb.FRIEND_ROUNDS_SET,
+        cb.FRIEND_PLAYERS,
+        cb.FRIEND_PLAYERS_SET,
+        cb.FRIEND_BACK,
+        cb.START_FRIEND,
+    )
+)
+# Действия с общей очередью случайного поиска
+MATCHMAKING_ACTIONS = frozenset(
+    action.code for action in (cb.GAME_RANDOM, cb.START_GENDER_SEARCH, cb.CANCEL_SEARCH)
+)
+
+
+def home_worker(user_id: int, workers: int) -> int:
+    # crc32, а не hash(): результат не зависит от процесса и перезапуска.
+    return zlib.crc32(user_id.to_bytes(8, "big", signed=True)) % workers
+
+
+def _sender_id(payload: Dict[str, Any]) -> Optional[int]:
+    for value in payload.values():
+        if isinstance(value, dict) and isinstance(value.get("from"), dict):
+            return value["from"].get("id")
+    return None
+
+
+def _as_join_command(message: Dict[str, Any], text: str):
+    # Ввод после «Ввести код» воркер получает явной командой /join: сам он
+    # нажатия кнопки не видел (и на неверный код ответит ошибкой).
+    message["text"] = f"/join {text}"
+    message["entities"] = [{"type": "bot_command", "offset": 0, "length": len("/join")}]
+
+
+class UpdateRouter:
+    def __init__(self, workers: int, invite_secret: str):
+        self.workers = workers
+        # Нужен только для worker_of(): номер воркера зашит в код приглашения.
+        self.invites = InviteCodeAllocator(secret=invite_secret)
+        # user_id -> воркер игры, в которой игрок сейчас участвует
+        self.memberships: Dict[int, int] = {}
+        # Нажавшие «Ввести код». В режиме нескольких процессов ожидание кода
+        # ведёт только приёмник: ввод уходит воркеру комнаты, и отметка на
+        # домашнем воркере там бы так и осталась. Ожидание длится до входа
+        # в игру (bind) или пункта меню, как и в одном процессе.
+        self.awaiting_code: Set[int] = set()
+        self.routed: Counter = Counter()
+
+    def bind(self, user_id: int, worker_id: int):
+        self.memberships[user_id] = worker_id
+        self.awaiting_code.discard(user_id)
+
+    def unbind(self, user_id: int, worker_id: int):
+        # Сообщение о выходе из старой игры может прийти после входа в новую.
+        if self.memberships.get(user_id) == worker_id:
+            del self.memberships[user_id]
+
+    def route(self, payload: Dict[str, Any]) -> int:
+        worker = self._route(payload)
+        self.routed[worker] += 1
+        return worker
+
+    def _own(self, worker: Optional[int]) -> Optional[int]:
+        if worker is not None and 0 <= worker < self.workers:
+            return worker
+        return None
+
+    def _route(self, payload: Dict[str, Any]) -> int:
+        user_id = _sender_id(payload)
+        matchmaking = False
+        callback = payload.get("callback_query")
+        if callback is not None:
+            try:
+                action, args = decode(callback.get("data") or "")
+            except CallbackDataError:
+                action, args = None, ()
+            if action is not None:
+                if action.code in GAME_ACTIONS:
+                    worker = self._own(worker_of(args[0]))
+                    if worker is not None:
+                        return worker
+                elif action is cb.JOIN:
+                    worker = self._own(self.invites.worker_of(args[0]))
+                    if worker is not None:
+                        return worker
+                elif action is cb.FRIEND_ENTER_CODE and user_id is not None:
+                    self.awaiting_code.add(user_id)
+                matchmaking = action.code in MATCHMAKING_ACTIONS
+        if user_id is None:
+            return 0
+        message = payload.get("message")
+        if message is not None:
+            code = self._join_code(user_id, message)
+            if code is not None:
+                worker = self._own(self.invites.worker_of(code))
+                if worker is not None:
+                    return worker
+        # Очередь случайного поиска одна на всех — раньше, чем игра игрока:
+        # иначе игрок из неначатой комнаты встал бы в очередь её воркера.
+        if matchmaking:
+            return MATCHMAKING_WORKER
+        worker = self.memberships.get(user_id)
+        if worker is not None:
+            return worker
+        return home_worker(user_id, self.workers)
+
+    def _join_code(self, user_id: int, message: Dict[str, Any]) -> Optional[str]:
+        # Код из «/join КОД» или ввод после «Ввести код».
+        text = (message.get("text") or "").strip()
+        parts = text.split()
+        if len(parts) == 2 and parts[0].split("@")[0] == "/join":
+            code = parts[1].upper()
+            return code if looks_like_code(code) else None
+        if user_id not in self.awaiting_code or not text or text.startswith("/"):
+            return None
+        if text in MAIN_MENU_TEXTS:
+            self.awaiting_code.discard(user_id)
+            return None
+        _as_join_command(message, text)
+        code = text.upper()
+        return code if looks_like_code(code) else None
+
+
+def run_worker(worker_id: int, outbound_rate: float, inbox, control, invite_secret: str, request_factory=None):
+    # Точка входа процесса-воркера. outbound_rate — его доля глобального
+    # исходящего лимита (см. WorkerPool).
+    # Сигналы остановки получает приёмник и передаёт воркерам через очередь;
+    # SIGTERM от systemd всей группе процессов не должен обрывать воркер
+    # до сохранения снимка.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    Config.WORKER_ID = worker_id
+    if logging.getLogger().handlers:
+        # Поток записи логов после fork не наследуется — заводим свой.
+        setup_logging()
+    Config.INVITE_CODE_SECRET = invite_secret
+    Config.OUTBOUND_GLOBAL_RATE = outbound_rate
+    asyncio.run(_serve_worker(worker_id, inbox, control, request_factory))
+
+
+async def _serve_worker(worker_id: int, inbox, control, request_factory):
+    from start_bot import TruthOrDareBot, build_application
+
+    bot_logic = TruthOrDareBot()
+    bot_logic.game_logic.on_membership = lambda user_id, game_id: control.put(
+        ("bind" if game_id is not None else "unbind", user_id, worker_id)
+    )
+    app = build_application(bot_logic, request=request_factory() if request_factory else None)
+    await app.initialize()
+    if app.post_init:
+        await app.post_init(app)
+    await app.start()
+    logger.info("Воркер %s запущен", worker_id)
+    control.put(("ready", worker_id, 0))
+    loop = asyncio.get_running_loop()
+    processed = 0
+    while True:
+        payload = await loop.run_in_executor(None, inbox.get)
+        if payload is None:
+            break
+        await app.update_queue.put(Update.de_json(payload, app.bot))
+        processed += 1
+    # Дожидаемся обработки всех принятых апдейтов, как и в одиночном режиме.
+    await stop_with_deadline(app, Config.SHUTDOWN_DRAIN_TIMEOUT)
+    if app.post_stop:
+        await app.post_stop(app)
+    if app.post_shutdown:
+        await app.post_shutdown(app)
+    await app.shutdown()
+    logger.info("Воркер %s остановлен, обработано апдейтов: %s", worker_id, processed)
+    control.put(("stopped", worker_id, processed))
+
+
+class WorkerPool:
+    # Процессы-воркеры, их входящие очереди и обратный канал событий.
+
+    def __init__(self, workers: int, invite_secret: str, request_factory=None):
+        if not 1 <= workers <= MAX_WORKER_ID + 1:
+            raise ValueError(f"Число воркеров должно быть в диапазоне 1..{MAX_WORKER_ID + 1}")
+        # Ключ кодов приглашений должен быть общим и постоянным: приёмник
+        # декодирует по нему номер воркера из кода, в том числе из кодов,
+        # выданных до перезапуска.
+        if not invite_secret:
+            raise ValueError("Для нескольких воркеров нужен общий INVITE_CODE_SECRET")
+        self.invite_secret = invite_secret
+        # Глобальный исходящий лимит делится между воркерами поровну, чтобы
+        # вместе они не превышали лимит Telegram. Меньше одного сообщения
+        # в секунду на воркер — это уже ошибка настройки, а не лимит.
+        self.outbound_rate = Config.OUTBOUND_GLOBAL_RATE / workers
+        if self.outbound_rate < 1:
+            raise ValueError(
+                f"OUTBOUND_GLOBAL_RATE={Config.OUTBOUND_GLOBAL_RATE} на {workers} воркеров даёт "
+                f"{self.outbound_rate:.2f} сообщ./с на воркер; нужно не меньше 1"
+            )
+        self.router = UpdateRouter(workers, self.invite_secret)
+        self.request_factory = request_factory
+        self.inboxes = [multiprocessing.Queue() for _ in range(workers)]
+        self.control = multiprocessing.Queue()
+        self.processes = []
+        self.ready = set()
+        self.processed: Dict[int, int] = {}
+        self._ready = threading.Event()
+        self._stopped = threading.Event()
+        self._listener: Optional[threading.Thread] = None
+
+    def start(self):
+        for worker_id, inbox in enumerate(self.inboxes):
+            process = multiprocessing.Process(
+                target=run_worker,
+                args=(
+                    worker_id,
+                    self.outbound_rate,
+                    inbox,
+                    self.control,
+                    self.invite_secret,
+                    self.request_factory,
+                ),
+                name=f"tod-worker-{worker_id}",
+                daemon=True,
+            )
+            process.start()
+            self.processes.append(process)
+        self._listener = threading.Thread(target=self._listen, name="tod-worker-events", daemon=True)
+        self._listener.start()
+
+    def _listen(self):
+        while len(self.processed) < len(self.processes):
+            kind, user_or_worker, value = self.control.get()
+            if kind == "bind":
+                self.router.bind(user_or_worker, value)
+            elif kind == "unbind":
+                self.router.unbind(user_or_worker, value)
+            elif kind == "ready":
+                self.ready.add(user_or_worker)
+                if len(self.ready) == len(self.processes):
+                    self._ready.set()
+            elif kind == "stopped":
+                self.processed[user_or_worker] = value
+        self._stopped.set()
+
+    def wait_ready(self, timeout: Optional[float] = None) -> bool:
+        # Апдейты можно раздавать и раньше: они подождут в очередях воркеров.
+        return self._ready.wait(timeout)
+
+    def dispatch(self, payload: Dict[str, Any]) -> int:
+        worker = self.router.route(payload)
+        self.inboxes[worker].put(payload)
+        return worker
+
+    def stop(self, timeout: float = 30) -> bool:
+        for inbox in self.inboxes:
+            inbox.put(None)
+        stopped = self._stopped.wait(timeout)
+        for process in self.processes:
+            process.join(timeout=1 if stopped else 0)
+            if process.is_alive():
+                process.terminate()
+        return stopped
+
+
+def build_intake_application(workers: int, request=None, worker_request_factory=None) -> Application:
+    # Приложение процесса-приёмника: один обработчик, который пересылает
+    # каждый апдейт воркеру. Запуск — как обычно, run_polling/run_webhook.
+    # request и worker_request_factory — подменный транспорт для прогонов без Telegram.
+    pool = WorkerPool(workers, Config.INVITE_CODE_SECRET, request_factory=worker_request_factory)
+
+    async def forward(update: Update, context):
+        pool.dispatch(update.to_dict())
+        raise ApplicationHandlerStop
+
+    async def start_workers(app: Application):
+        pool.start()
+        logger.info("Запущено воркеров: %s", workers)
+
+    async def stop_workers(app: Application):
+        # Воркеры сами проходят остановку с дедлайном и сохраняют снимок.
+        if not pool.stop(timeout=Config.SHUTDOWN_DRAIN_TIMEOUT + 5):
+            logger.warning("Не все воркеры остановились вовремя")
+        logger.info(
+            "Распределение апдейтов по воркерам: %s",
+            ", ".join(f"{worker}: {count}" for worker, count in sorted(pool.router.routed.items())),
+        )
+
+    builder = Application.builder().token(Config.BOT_TOKEN)
+    if request is not None:
+        builder = builder.request(request).get_updates_request(request)
+    app = builder.post_init(start_workers).post_shutdown(stop_workers).build()
+    app.add_handler(TypeHandler(Update, forward))
+    app.bot_data["worker_pool"] = pool
+    return app
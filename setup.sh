@@ -70,7 +70,7 @@ User=botuser
 Group=botuser
 WorkingDirectory=/home/botuser/truth_or_dare_bot
 Environment="PATH=/home/botuser/truth_or_dare_bot/venv/bin"
-ExecStart=/home/botuser/truth_or_dare_bot/venv/bin/python /home/botuser/truth_or_dare_bot/bot.py
+ExecStart=/home/botuser/truth_or_dare_bot/venv/bin/python /home/botuser/truth_or_dare_bot/start_bot.py
 Restart=always
 RestartSec=10
 StandardOutput=syslog
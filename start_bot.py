@@ -1,26 +1,57 @@
 #!/usr/bin/env python3
+from startup_profile import profile as startup_profile
+
+if __name__ == "__main__":
+    # До остальных импортов: профиль запуска замеряет время импорта модулей.
+    startup_profile.install()
+
+import asyncio
+import functools
+import json
 import logging
 import re
+import time
 from datetime import datetime, timedelta
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, LabeledPrice
+from telegram.request import HTTPXRequest
 from telegram.ext import (
     Application,
     CommandHandler,
     MessageHandler,
     CallbackQueryHandler,
     PreCheckoutQueryHandler,
+    TypeHandler,
+    ApplicationHandlerStop,
     ContextTypes,
     filters,
 )
 from config import Config
 from database import db
 from game_logic import GameLogic
+from journal import GameJournal, ANSWERED, SKIPPED
+from broadcast import broadcast
+from coalescing import MessageCoalescer
+from outbound import MeteredRequest, OutboundRateLimiter, SendAborted, PRIORITY_LOW, PRIORITY_TURN
+from metrics import MetricsServer, registry
+from profiling import HandlerProfiler, MODES as PROFILE_MODES
+from loop_watchdog import LoopWatchdog
+from ownership import MessageOwners
+from keyed_locks import KeyedLocks
+from throttle import IntakeThrottle, update_route
+from invite_codes import looks_like_code
+from lifecycle import run_application, timed_phase
+from logging_setup import setup_logging
+from startup_profile import note_update_started, note_update_finished
+from callback_router import CallbackRouter
+import callback_data as cb
+from callback_data import CallbackDataError, StaleCallbackData
 from keyboards import (
     main_menu,
     game_type_keyboard,
     categories_keyboard,
     premium_keyboard,
     game_action_keyboard,
+    game_panel_keyboard,
     friend_invite_keyboard,
     friend_owner_keyboard,
     friend_players_keyboard,
@@ -28,27 +59,72 @@ from keyboards import (
     friend_mode_keyboard,
     search_preferences_keyboard,
     search_wait_keyboard,
+    settings_keyboard,
+    keyboard_cache_stats,
+    SEARCH_GENDER_OPTIONS,
+    MAIN_MENU_TEXTS,
 )
 
-logging.basicConfig(
-    format="%(asctime)s - %(levelname)s - %(message)s",
-    level=logging.INFO,
-)
-for noisy_logger in ["httpx", "httpcore", "telegram", "apscheduler"]:
-    logging.getLogger(noisy_logger).setLevel(logging.WARNING)
 logger = logging.getLogger(__name__)
 
+HANDLER_SECONDS = registry.histogram(
+    "tod_handler_seconds", "Время обработки апдейта по действиям, без ожидания замков", ("route",)
+)
+HANDLER_ERRORS = registry.counter("tod_handler_errors_total", "Исключения в обработчиках по действиям", ("route",))
+LOCK_WAIT_SECONDS = registry.histogram(
+    "tod_lock_wait_seconds", "Ожидание замков пользователя и игры перед обработкой апдейта"
+)
+UPDATES_DROPPED = registry.counter(
+    "tod_updates_dropped_total", "Апдейты, отброшенные ограничением входящих", ("route", "reason")
+)
+GAME_LOGIC_SIZE = registry.gauge("tod_game_logic_size", "Размеры структур GameLogic в памяти", ("kind",))
 
-def log_action(message: str):
-    logger.info("[GAME] %s", message)
+INVALID_CODE_TEXT = (
+    "❌ Игра по этому коду не найдена. Код — 6 букв и цифр: проверь его и отправь ещё раз "
+    "или выбери пункт меню."
+)
+
+
+def log_action(message: str, *args):
+    logger.info("[GAME] " + message, *args)
 
 
 class TruthOrDareBot:
     def __init__(self):
         log_action("Инициализация бота 'Правда или Действие'")
-        self.game_logic = GameLogic(db)
-        self.message_owners = {}
-        self.pending_answers = {}
+        self.journal = GameJournal(
+            db,
+            batch_size=Config.JOURNAL_BATCH_SIZE,
+            flush_interval=Config.JOURNAL_FLUSH_INTERVAL,
+        )
+        self.game_logic = GameLogic(
+            db,
+            worker_id=Config.WORKER_ID,
+            invite_ttl=Config.INVITE_CODE_TTL,
+            invite_secret=Config.INVITE_CODE_SECRET,
+            game_journal=self.journal,
+            turn_timeout=Config.TURN_TIMEOUT,
+            turn_policy=Config.TURN_POLICY,
+            pending_ttl=Config.PENDING_ANSWER_TTL,
+            persist_pending=Config.PERSIST_PENDING_ANSWERS,
+        )
+        self.message_owners = MessageOwners(
+            max_size=Config.MESSAGE_OWNERS_MAX,
+            ttl_seconds=Config.MESSAGE_OWNERS_TTL,
+        )
+        self.callbacks = self._build_callback_router()
+        self.user_locks = KeyedLocks()
+        self.game_locks = KeyedLocks()
+        self.throttle = IntakeThrottle(
+            rate=Config.THROTTLE_RATE,
+            burst=Config.THROTTLE_BURST,
+            repeat_window=Config.THROTTLE_REPEAT_WINDOW,
+        )
+        self.metrics_server: MetricsServer | None = None
+        self.profiler = HandlerProfiler(sample_interval=Config.PROFILE_SAMPLE_INTERVAL / 1000)
+        self._profile_chat: int | None = None
+        self.watchdog = LoopWatchdog(interval=Config.LOOP_LAG_INTERVAL, threshold=Config.LOOP_LAG_THRESHOLD)
+        registry.on_collect("game_logic", self._collect_metrics)
 
         self._category_labels = {
             "acquaintance": "👋 Знакомство",
@@ -58,12 +134,185 @@ class TruthOrDareBot:
             "funny": "😂 Смешное",
         }
 
+    def _build_callback_router(self) -> CallbackRouter:
+        # Обработчик вызывается как handler(query, context, *bound, *аргументы из data).
+        router = CallbackRouter()
+        router.on(cb.GAME_RANDOM, self.start_random_game)
+        router.on(cb.GAME_FRIEND, self.create_friend_game_callback)
+        router.on(cb.FRIEND_ENTER_CODE, self.prompt_join_code)
+        router.on(cb.GAME_CATEGORIES, self.show_category_selection)
+        router.on(cb.GAME_GENDER_SEARCH, self.gender_search_callback)
+        router.on(cb.START_GENDER_SEARCH, self.start_premium_search)
+        router.on(cb.CATEGORIES_DONE, self.save_categories)
+        router.on(cb.CATEGORY_TOGGLE, self.toggle_category)
+        router.on(cb.GENDER_MALE, self.set_gender, "male")
+        router.on(cb.GENDER_FEMALE, self.set_gender, "female")
+        router.on(cb.GENDER_OTHER, self.set_gender, "other")
+        router.on(cb.SEARCH_GENDER, self.update_search_gender_preference)
+        router.on(cb.SEARCH_AGE_EDIT, self.prompt_search_age_input)
+        router.on(cb.SET_AGE, self.prompt_age_input)
+        router.on(cb.CANCEL_SEARCH, self.cancel_random_search)
+        router.on(cb.CANCEL, self.cancel_action)
+        router.on(cb.BACK_TO_MENU, self.back_to_menu)
+        router.on(cb.PREMIUM_STATUS, self.show_premium_status)
+        router.on(cb.PREMIUM_BUY, self.handle_premium_callback)
+        router.on(cb.PREMIUM_TRIAL, self.handle_premium_callback, "trial")
+        router.on(cb.JOIN, self.join_friend_game, shared=True)
+        router.on(cb.FRIEND_DECLINE, self.decline_friend_room)
+        router.on(cb.FRIEND_CATEGORIES, self.edit_friend_categories)
+        router.on(cb.FRIEND_ROUNDS, self.prompt_friend_rounds)
+        router.on(cb.FRIEND_ROUNDS_SET, self.set_friend_rounds)
+        router.on(cb.FRIEND_PLAYERS, self.prompt_friend_players)
+        router.on(cb.FRIEND_PLAYERS_SET, self.set_friend_players)
+        router.on(cb.FRIEND_BACK, self.show_friend_room_panel)
+        router.on(cb.START_FRIEND, self.start_friend_game)
+        router.on(cb.TRUTH, self.send_task, "truth")
+        router.on(cb.DARE, self.send_task, "dare")
+        router.on(cb.CONTINUE, self.continue_turn, shared=True)
+        router.on(cb.SKIP, self.skip_turn)
+        router.on(cb.END, self.end_game)
+        return router
+
+    def serialized(self, handler):
+        # Апдейты обрабатываются параллельно (CONCURRENT_UPDATES), но апдейты
+        # одного пользователя и всё, что меняет одну игру, идут строго по
+        # очереди. Порядок захвата всегда «пользователь, затем игра».
+        # Здесь же замеряется время обработки по действиям (HANDLER_SECONDS)
+        # и, если идёт сессия /profile, апдейт засчитывается в профиль.
+        async def timed(update: Update, context: ContextTypes.DEFAULT_TYPE, route: str):
+            started = time.perf_counter()
+            try:
+                return await handler(update, context)
+            except Exception:
+                HANDLER_ERRORS.inc(route)
+                raise
+            finally:
+                elapsed = time.perf_counter() - started
+                HANDLER_SECONDS.observe(elapsed, route)
+                if self.profiler.active and self.profiler.record(route, elapsed):
+                    context.application.create_task(
+                        self._finish_profile(context.bot, self.profiler.session)
+                    )
+
+        # По этому кадру семплирующий профилировщик узнаёт действие.
+        self.profiler.route_codes.add(timed.__code__)
+
+        @functools.wraps(handler)
+        async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE):
+            route = update_route(update)
+            user = update.effective_user
+            if user is None:
+                return await timed(update, context, route)
+            waiting = time.perf_counter()
+            async with self.user_locks.hold(user.id):
+                game_id = self._current_game_id(user.id)
+                if game_id is None:
+                    LOCK_WAIT_SECONDS.observe(time.perf_counter() - waiting)
+                    return await timed(update, context, route)
+                async with self.game_locks.hold(game_id):
+                    LOCK_WAIT_SECONDS.observe(time.perf_counter() - waiting)
+                    return await timed(update, context, route)
+
+        return wrapper
+
+    async def throttle_updates(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        # Группа -1: выполняется до замков и обработчиков. Платежи не ограничиваем.
+        user = update.effective_user
+        if user is None or update.pre_checkout_query or (
+            update.message and update.message.successful_payment
+        ):
+            return
+        query = update.callback_query
+        repeat_key = (query.message.message_id, query.data) if query and query.message else None
+        route = update_route(update)
+        if route == "message" and user.id in self.game_logic.pending:
+            # Ответ на задание не теряем: его ждёт вся комната.
+            return
+        verdict = self.throttle.check(user.id, route, repeat_key)
+        if verdict == "allowed":
+            return
+        UPDATES_DROPPED.inc(route, verdict)
+        if query is not None:
+            # Иначе у пользователя будут крутиться часики на кнопке.
+            if verdict == "throttled":
+                await query.answer("Слишком часто. Подожди секунду.")
+            else:
+                await query.answer()
+        elif update.message and self.throttle.should_notice(user.id):
+            await update.message.reply_text("⏳ Слишком часто — сообщение не обработано. Подожди пару секунд и отправь ещё раз.")
+        raise ApplicationHandlerStop
+
+    def _collect_metrics(self):
+        for kind, size in self.game_logic.sizes().items():
+            GAME_LOGIC_SIZE.set(size, kind)
+        GAME_LOGIC_SIZE.set(len(self.message_owners), "message_owners")
+        GAME_LOGIC_SIZE.set(len(self.throttle), "throttled_users")
+
+    def _current_game_id(self, user_id: int) -> int | None:
+        pending = self.game_logic.pending.get(user_id)
+        if pending is not None:
+            return pending.game_id
+        return self.game_logic.user_to_game.get(user_id)
+
     def register_owned_message(self, message, owner_id: int):
         if not message:
             return
-        key = (message.chat.id, message.message_id)
-        self.message_owners[key] = owner_id
-        log_action(f"Привязка сообщения {key} к пользователю {owner_id}")
+        self.message_owners.register(message.chat.id, message.message_id, owner_id)
+        logger.debug("[GAME] Привязка сообщения %s:%s к пользователю %s", message.chat.id, message.message_id, owner_id)
+
+    async def _broadcast(self, context: ContextTypes.DEFAULT_TYPE, messages, what: str):
+        result = await broadcast(
+            context.bot,
+            messages,
+            concurrency=Config.BROADCAST_CONCURRENCY,
+            what=what,
+        )
+        if result.failed:
+            logger.debug("[GAME] Рассылка (%s): %s", what, result)
+        return result
+
+    def _outbox(self) -> MessageCoalescer:
+        return MessageCoalescer(enabled=Config.COALESCE_MESSAGES)
+
+    async def _flush(
+        self,
+        context: ContextTypes.DEFAULT_TYPE,
+        out: MessageCoalescer,
+        what: str,
+        game_state=None,
+    ):
+        # Сообщения с кнопками привязываем к получателю, как и при прямой отправке.
+        # Для игры запоминаем панели: новое сообщение (если правка не удалась)
+        # становится панелью игрока.
+        result = await out.flush(context.bot, Config.BROADCAST_CONCURRENCY, what)
+        if result.failed:
+            logger.debug("[GAME] Рассылка (%s): %s", what, result)
+        for uid, message in result.sent.items():
+            message_id = getattr(message, "message_id", None)
+            if game_state is not None and message_id is not None and uid in game_state.players:
+                game_state.panels[uid] = message_id
+            if getattr(message, "reply_markup", None):
+                self.register_owned_message(message, uid)
+        return result
+
+    def _panel(self, out: MessageCoalescer, game_state, uid: int, text: str, keyboard=True, priority=None):
+        # Одна панель игры на игрока: каждое изменение состояния правит её.
+        reply_markup = None
+        if keyboard and game_state.id in self.game_logic.games:
+            if uid == game_state.current_player and not self._awaiting_answer(uid):
+                reply_markup = game_action_keyboard(game_state.id, True)
+            else:
+                reply_markup = game_panel_keyboard(game_state.id)
+        out.panel(
+            uid,
+            game_state.panels.get(uid),
+            text,
+            reply_markup=reply_markup,
+            rate_limit_args=priority,
+        )
+
+    def _awaiting_answer(self, uid: int) -> bool:
+        return uid in self.game_logic.pending
 
     def _load_user(self, telegram_id: int, user) -> tuple[dict, list]:
         user_data = db.get_user(telegram_id)
@@ -142,7 +391,7 @@ class TruthOrDareBot:
                 user.first_name,
                 user.last_name,
             )
-            logger.info(f"Новый пользователь: {telegram_id} - {user.username}")
+            logger.info("Новый пользователь: %s - %s", telegram_id, user.username)
             msg = await update.message.reply_text(
                 f"👋 Привет, {user.first_name}!\n"
                 f"Добро пожаловать в игру «Правда или Действие»!\n\n"
@@ -165,88 +414,53 @@ class TruthOrDareBot:
         chat = update.effective_chat
         text = (update.message.text or "").strip()
         user = update.effective_user
-        logger.info(f"Сообщение от {user.id} в чате {chat.id} ({chat.type}): {text}")
-        log_action(f"Обработка сообщения от {user.id}: {text}")
+        # Тексты сообщений — только на уровне DEBUG: их много и это данные игроков.
+        logger.debug("Сообщение от %s в чате %s (%s): %s", user.id, chat.id, chat.type, text)
 
-        pending = context.user_data.get("pending_answer") or self.pending_answers.get(user.id)
+        pending = self.game_logic.pending.get(user.id)
+        if pending and not self.game_logic.get_game_by_id(pending.game_id):
+            # Игра уже закончилась — текст обрабатывается как обычное сообщение.
+            self.game_logic.pending.pop(user.id)
+            pending = None
 
         if pending:
-            game_id = pending["game_id"]
-            player_id = pending["player_id"]
-            player_name = pending["player_name"]
+            game_id = pending.game_id
+            player_id = pending.player_id
+            player_name = pending.player_name
             answer_text = update.message.text
-            log_action(f"Ответ игрока {player_name} ({player_id}) в игре {game_id}: {answer_text}")
+            logger.debug("[GAME] Ответ игрока %s (%s) в игре %s: %s", player_name, player_id, game_id, answer_text)
 
             game = self.game_logic.get_game_by_id(game_id)
-            if not game:
-                context.user_data["pending_answer"] = None
-                self.pending_answers.pop(user.id, None)
-                return
 
-            broadcast = (
+            broadcast_text = (
                 f"💬 {player_name} ответил(а):\n"
                 f"{answer_text}"
             )
 
-            for uid in game.players:
-                if uid == player_id:
-                    try:
-                        await context.bot.send_message(
-                            chat_id=uid,
-                            text="✅ Ответ получен.",
-                        )
-                    except Exception as e:
-                        logger.error(
-                            f"Не удалось отправить подтверждение игроку {uid}: {e}"
-                        )
-                    continue
-                try:
-                    await context.bot.send_message(
-                        chat_id=uid,
-                        text=broadcast,
-                    )
-                except Exception as e:
-                    logger.error(f"Не удалось отправить ответ игроку {uid}: {e}")
-
-            context.user_data["pending_answer"] = None
-            self.pending_answers.pop(user.id, None)
-
-            next_player = self.game_logic.next_turn_random(game_id)
-            log_action(f"Передача хода в игре {game_id}. Следующий игрок: {next_player}")
+            self.game_logic.pending.pop(user.id)
+            self.game_logic.record_event(game_id, ANSWERED, player_id, length=len(answer_text or ""))
 
+            # Ответ и смена хода уходят каждому игроку одной правкой панели.
+            out = self._outbox()
             for uid in game.players:
-                if uid == next_player:
-                    await context.bot.send_message(
-                        chat_id=uid,
-                        text="Теперь *твой ход*.\nВыбирай:\n🗣 Правда или 🎭 Действие",
-                        parse_mode="Markdown",
-                        reply_markup=game_action_keyboard(game_id, True),
-                    )
-                else:
-                        await context.bot.send_message(
-                            chat_id=uid,
-                            text="Ход другого игрока.",
-                        )
+                self._panel(out, game, uid, "✅ Ответ получен." if uid == player_id else broadcast_text)
+            await self._advance_turn(game, context, out)
+            await self._flush(context, out, "ответ", game)
             return
 
+        # Текст принимается как код приглашения только после кнопки
+        # «Ввести код»: иначе возраст или обычная фраза из шести символов
+        # могла бы совпасть с кодом чужой комнаты. В любой момент — /join КОД.
+        # Ожидание кода длится до успешного входа или пункта меню.
         if context.user_data.get("awaiting_join_code"):
-            code = (text or "").strip().upper()
-            context.user_data.pop("awaiting_join_code", None)
-            success, msg_text, game_state = self.game_logic.join_friend_game(code, user.id)
-            if not success:
-                await update.message.reply_text(f"❌ {msg_text}")
+            if text not in MAIN_MENU_TEXTS:
+                code = text.upper()
+                if not looks_like_code(code):
+                    await update.message.reply_text(INVALID_CODE_TEXT)
+                elif await self._join_by_code(update, context, code):
+                    context.user_data.pop("awaiting_join_code", None)
                 return
-            log_action(
-                f"Игрок {user.id} присоединился к комнате {game_state.invite_code}. "
-                f"Онлайн: {len(game_state.players)}/{game_state.max_players}"
-            )
-            await update.message.reply_text(
-                self._join_success_text(game_state),
-                reply_markup=main_menu(),
-                parse_mode="HTML",
-            )
-            await self._broadcast_room_join(game_state, context, update.effective_user)
-            return
+            context.user_data.pop("awaiting_join_code", None)
 
         if text.lower() == "/cancel":
             context.user_data.pop("awaiting_age_input", None)
@@ -369,9 +583,17 @@ class TruthOrDareBot:
                 show_alert=True,
             )
             return
-        key = (query.message.chat.id, query.message.message_id)
-        owner = self.message_owners.get(key)
-        if not data.startswith("join_") and not data.startswith("continue_"):
+        try:
+            resolved = self.callbacks.resolve(data)
+        except StaleCallbackData:
+            await query.answer("Эта кнопка устарела. Вызови меню заново через /start.", show_alert=True)
+            return
+        except CallbackDataError as e:
+            logger.warning("Некорректные данные кнопки от %s: %s", telegram_id, e)
+            await query.answer("Неизвестное действие.", show_alert=True)
+            return
+        if resolved is None or not resolved[0].shared:
+            owner = self.message_owners.owner(query.message.chat.id, query.message.message_id)
             if owner is not None and owner != telegram_id:
                 await query.answer(
                     "Эта панель принадлежит другому игроку.\n"
@@ -380,107 +602,90 @@ class TruthOrDareBot:
                 )
                 return
         await query.answer()
-        logger.info(f"Callback от {telegram_id}: {data}")
-        if data == "game_random":
-            await self.start_random_game(query, context)
-            return
-        if data == "game_friend":
-            await self.create_friend_game_callback(query, context)
-            return
-        if data == "friend_enter_code":
-            context.user_data["awaiting_join_code"] = True
-            await query.edit_message_text("Введи код приглашения, который дал создатель комнаты.")
+        logger.debug("Callback от %s: %s", telegram_id, data)
+        if resolved is None:
+            await query.edit_message_text("Неизвестное действие.")
             return
-        if data == "game_categories":
-            await self.show_category_selection(query, context)
-            return
-        if data in {"game_search_gender", "game_gender_search"}:
-            await self.gender_search_callback(query, context)
-            return
-        if data == "start_gender_search":
-            await self.start_premium_search(query, context)
-            return
-        if data.startswith("pref_gender_"):
-            await self.update_search_gender_preference(query, context, data)
-            return
-        if data.startswith("cat_"):
-            await self.toggle_category(query, context, data)
-            return
-        if data == "categories_done":
-            await self.save_categories(query, context)
-            return
-        if data in {"gender_male", "gender_female", "gender_other"}:
-            await self.set_gender(query, context, data)
-            return
-        if data.startswith("join_"):
-            await self.join_friend_game(query, context, data)
-            return
-        if data == "cancel_search":
-            await self.cancel_random_search(query)
-            return
-        if data.startswith("friend_cats_"):
-            await self.edit_friend_categories(query, context, data)
-            return
-        if data.startswith("friend_rounds_"):
-            await self.prompt_friend_rounds(query, context, data)
-            return
-        if data.startswith("friend_round_set_"):
-            await self.set_friend_rounds(query, data)
-            return
-        if data.startswith("friend_players_") and not data.startswith("friend_players_set_"):
-            await self.prompt_friend_players(query, data)
-            return
-        if data.startswith("friend_players_set_"):
-            await self.set_friend_players(query, data)
-            return
-        if data.startswith("friend_back_"):
-            await self.show_friend_room_panel(query, data)
-            return
-        if data.startswith("start_friend_"):
-            await self.start_friend_game(query, context, data)
-            return
-        if data.startswith("truth_"):
-            await self.send_task(query, context, data, "truth")
-            return
-        if data.startswith("dare_"):
-            await self.send_task(query, context, data, "dare")
-            return
-        if data == "set_age":
-            await self.prompt_age_input(query, context)
-            return
-        if data == "pref_age_edit":
-            await self.prompt_search_age_input(query, context)
-            return
-        if data.startswith("continue_"):
-            await self.continue_turn(query, context, data)
-            return
-        if data.startswith("skip_"):
-            await self.skip_turn(query, context, data)
-            return
-        if data.startswith("end_"):
-            await self.end_game(query, context, data)
-            return
-        if data.startswith("premium_") or data == "premium_status":
-            await self.handle_premium_callback(query, context, data)
-            return
-        if data == "friend_decline":
-            await query.edit_message_text("Комната отклонена.")
+        route, args = resolved
+        await route.handler(query, context, *route.bound, *args)
+
+    async def join_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        # /join КОД — вход в комнату по коду без кнопки «Ввести код».
+        if not context.args:
+            await update.message.reply_text("Укажи код приглашения: /join КОД")
             return
-        if data == "cancel":
-            await query.edit_message_text("❌ Действие отменено")
+        code = context.args[0].upper()
+        if not looks_like_code(code):
+            await update.message.reply_text(INVALID_CODE_TEXT)
             return
-        if data == "back_to_menu":
-            msg = await query.message.reply_text(
-                "Главное меню:",
+        await self._join_by_code(update, context, code)
+
+    async def _join_by_code(self, update: Update, context: ContextTypes.DEFAULT_TYPE, code: str) -> bool:
+        user = update.effective_user
+        game_id, error = self._join_target(user.id, code)
+        if error:
+            await update.message.reply_text(f"❌ {error}")
+            return False
+        async with self.game_locks.hold(game_id):
+            success, msg_text, game_state = self.game_logic.join_friend_game(code, user.id)
+            if not success:
+                await update.message.reply_text(f"❌ {msg_text}")
+                return False
+            log_action(
+                "Игрок %s присоединился к комнате %s. Онлайн: %s/%s",
+                user.id,
+                game_state.invite_code,
+                len(game_state.players),
+                game_state.max_players,
+            )
+            await update.message.reply_text(
+                self._join_success_text(game_state),
                 reply_markup=main_menu(),
+                parse_mode="HTML",
             )
-            self.register_owned_message(msg, telegram_id)
-            try:
-                await query.message.delete()
-            except Exception:
-                pass
-            return
-        await query.edit_message_text("Неизвестное действие.")
+            await self._broadcast_room_join(game_state, context, user)
+        return True
+
+    def _join_target(self, user_id: int, code: str) -> tuple[int | None, str | None]:
+        # Комната по коду — (game_id, None) или (None, текст ошибки).
+        # Замок комнаты берёт вызывающий код. Игроку, который уже в игре,
+        # отказываем до этого: serialized() держит замок его игры, а второй
+        # замок игры под первым — взаимная блокировка, если два хозяина
+        # одновременно входят в комнаты друг друга.
+        game_id = self.game_logic.resolve_invite(code)
+        if game_id is None:
+            return None, "Игра по этому коду не найдена или код истёк"
+        current = self._current_game_id(user_id)
+        if current == game_id:
+            return None, "Ты уже в этой игре"
+        if current is not None:
+            return None, "Ты уже в другой игре — сначала заверши её"
+        return game_id, None
+
+    async def prompt_join_code(self, query, context: ContextTypes.DEFAULT_TYPE):
+        # В режиме нескольких процессов код уйдёт воркеру комнаты, а не сюда:
+        # ожидание кода ведёт приёмник (scaleout.UpdateRouter), иначе отметка
+        # осталась бы здесь и после входа в комнату.
+        if Config.WORKERS <= 1:
+            context.user_data["awaiting_join_code"] = True
+        await query.edit_message_text("Введи код приглашения, который дал создатель комнаты.")
+
+    async def decline_friend_room(self, query, context: ContextTypes.DEFAULT_TYPE):
+        await query.edit_message_text("Комната отклонена.")
+
+    async def cancel_action(self, query, context: ContextTypes.DEFAULT_TYPE):
+        await query.edit_message_text("❌ Действие отменено")
+
+    async def back_to_menu(self, query, context: ContextTypes.DEFAULT_TYPE):
+        msg = await query.message.reply_text(
+            "Главное меню:",
+            reply_markup=main_menu(),
+        )
+        self.register_owned_message(msg, query.from_user.id)
+        try:
+            await query.message.delete()
+        except Exception:
+            pass
 
     async def start_random_game(self, query, context):
         chat = query.message.chat
@@ -545,16 +750,16 @@ class TruthOrDareBot:
                 reply_markup=search_wait_keyboard(),
             )
             self.register_owned_message(msg, telegram_id)
-            log_action(f"Игрок {telegram_id} встал в очередь случайной игры")
+            log_action("Игрок %s встал в очередь случайной игры", telegram_id)
             return
         msg = await query.edit_message_text(
             "🎮 Найден соперник!\nИгра начинается.",
         )
         self.register_owned_message(msg, telegram_id)
-        log_action(f"Сформирована случайная игра {game_state.id} для игроков {game_state.players}")
+        log_action("Сформирована случайная игра %s для игроков %s", game_state.id, game_state.players)
         await self.notify_game_start(game_state, context)
 
-    async def cancel_random_search(self, query):
+    async def cancel_random_search(self, query, context: ContextTypes.DEFAULT_TYPE):
         telegram_id = query.from_user.id
         cancelled = self.game_logic.cancel_random_wait(telegram_id)
         if cancelled:
@@ -566,24 +771,16 @@ class TruthOrDareBot:
         if not game_state.current_player:
             self.game_logic.set_initial_turn(game_state.id)
         current = game_state.current_player
-        log_action(
-            f"Старт игры {game_state.id}. Ход игрока {current}. Участники: {game_state.players}"
-        )
+        log_action("Старт игры %s. Ход игрока %s. Участники: %s", game_state.id, current, game_state.players)
+        out = self._outbox()
         for uid in game_state.players:
-            try:
-                text = "🎮 Игра началась!\n"
-                if uid == current:
-                    text += "Сейчас твой ход. Выбирай «Правда» или «Действие»."
-                else:
-                    text += "Сейчас ход другого игрока. Ожидай своей очереди."
-                msg = await context.bot.send_message(
-                    chat_id=uid,
-                    text=text,
-                    reply_markup=game_action_keyboard(game_state.id, True),
-                )
-                self.register_owned_message(msg, uid)
-            except Exception as e:
-                logger.error(f"Не удалось отправить старт игроку {uid}: {e}")
+            text = "🎮 Игра началась!\n"
+            if uid == current:
+                text += "Сейчас твой ход. Выбирай «Правда» или «Действие»."
+            else:
+                text += "Сейчас ход другого игрока. Ожидай своей очереди."
+            self._panel(out, game_state, uid, text, priority=PRIORITY_TURN)
+        await self._flush(context, out, "старт игры", game_state)
         for uid in game_state.players:
             db.increment_counters(uid, games_delta=1)
 
@@ -657,7 +854,7 @@ class TruthOrDareBot:
         )
         self.register_owned_message(msg, user.id)
 
-    async def join_friend_game(self, query, context: ContextTypes.DEFAULT_TYPE, data: str):
+    async def join_friend_game(self, query, context: ContextTypes.DEFAULT_TYPE, invite_code: str):
         chat = query.message.chat
         if chat.type != "private":
             await query.answer(
@@ -665,19 +862,25 @@ class TruthOrDareBot:
                 show_alert=True,
             )
             return
-        invite_code = data.replace("join_", "", 1)
         user = query.from_user
         telegram_id = user.id
-        success, msg_text, game_state = self.game_logic.join_friend_game(invite_code, telegram_id)
-        if not success:
-            await query.edit_message_text(f"❌ {msg_text}")
-            return
-        await query.edit_message_text(
-            self._join_success_text(game_state), parse_mode="HTML"
-        )
-        await self._broadcast_room_join(game_state, context, query.from_user)
+        # Игрок ещё не в игре, поэтому serialized() не взял замок комнаты —
+        # берём его здесь, чтобы вход не пересёкся со стартом игры.
+        game_id, error = self._join_target(telegram_id, invite_code)
+        if error:
+            await query.edit_message_text(f"❌ {error}")
+            return
+        async with self.game_locks.hold(game_id):
+            success, msg_text, game_state = self.game_logic.join_friend_game(invite_code, telegram_id)
+            if not success:
+                await query.edit_message_text(f"❌ {msg_text}")
+                return
+            await query.edit_message_text(
+                self._join_success_text(game_state), parse_mode="HTML"
+            )
+            await self._broadcast_room_join(game_state, context, query.from_user)
 
-    async def start_friend_game(self, query, context: ContextTypes.DEFAULT_TYPE, data: str):
+    async def start_friend_game(self, query, context: ContextTypes.DEFAULT_TYPE, game_id: int):
         chat = query.message.chat
         if chat.type != "private":
             await query.answer(
@@ -685,7 +888,6 @@ class TruthOrDareBot:
                 show_alert=True,
             )
             return
-        game_id = int(data.replace("start_friend_", "", 1))
         state = self.game_logic.get_game_by_id(game_id)
         if not state:
             await query.edit_message_text("Комната не найдена или уже закрыта.")
@@ -727,7 +929,6 @@ class TruthOrDareBot:
         await update.message.reply_text(text, parse_mode="HTML")
 
     async def show_settings(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        from telegram import InlineKeyboardButton, InlineKeyboardMarkup
         user_data = db.get_user(update.effective_user.id)
         gender = (user_data or {}).get("gender", "Не указан")
         age = (user_data or {}).get("age", "Не указан")
@@ -749,22 +950,10 @@ class TruthOrDareBot:
             "Пол можно сменить ниже, категории — через «🎮 Найти игру → Выбрать категории».\n"
             "Нажми «🎂 Указать возраст» или отправь число сообщением, чтобы обновить возраст."
         )
-        keyboard = [
-            [
-                InlineKeyboardButton(text="👨 Мужской", callback_data="gender_male"),
-                InlineKeyboardButton(text="👩 Женский", callback_data="gender_female"),
-            ],
-            [
-                InlineKeyboardButton(text="🌈 Другой", callback_data="gender_other"),
-            ],
-            [
-                InlineKeyboardButton(text="🎂 Указать возраст", callback_data="set_age"),
-            ],
-        ]
         msg = await update.message.reply_text(
             text,
             parse_mode="HTML",
-            reply_markup=InlineKeyboardMarkup(keyboard),
+            reply_markup=settings_keyboard(),
         )
         self.register_owned_message(msg, update.effective_user.id)
 
@@ -785,9 +974,8 @@ class TruthOrDareBot:
         )
 
     async def edit_friend_categories(
-        self, query, context: ContextTypes.DEFAULT_TYPE, data: str
+        self, query, context: ContextTypes.DEFAULT_TYPE, game_id: int
     ):
-        game_id = int(data.replace("friend_cats_", "", 1))
         state = self.game_logic.get_game_by_id(game_id)
         if not state or state.host_id != query.from_user.id:
             await query.answer("Только создатель комнаты может менять категории", show_alert=True)
@@ -799,8 +987,7 @@ class TruthOrDareBot:
             reply_markup=categories_keyboard(state.categories),
         )
 
-    async def prompt_friend_rounds(self, query, context: ContextTypes.DEFAULT_TYPE, data: str):
-        game_id = int(data.replace("friend_rounds_", "", 1))
+    async def prompt_friend_rounds(self, query, context: ContextTypes.DEFAULT_TYPE, game_id: int):
         state = self.game_logic.get_game_by_id(game_id)
         if not state or state.host_id != query.from_user.id:
             await query.answer("Только создатель комнаты может менять раунды", show_alert=True)
@@ -810,14 +997,7 @@ class TruthOrDareBot:
             reply_markup=friend_rounds_keyboard(state.id, state.max_rounds),
         )
 
-    async def set_friend_rounds(self, query, data: str):
-        try:
-            _, _, game_id_str, value_str = data.split("_", 3)
-            game_id = int(game_id_str)
-            value = int(value_str)
-        except Exception:
-            await query.answer("Некорректные данные раундов", show_alert=True)
-            return
+    async def set_friend_rounds(self, query, context: ContextTypes.DEFAULT_TYPE, game_id: int, value: int):
         state = self.game_logic.get_game_by_id(game_id)
         if not state or state.host_id != query.from_user.id:
             await query.answer("Только создатель комнаты может менять раунды", show_alert=True)
@@ -828,8 +1008,7 @@ class TruthOrDareBot:
             reply_markup=friend_rounds_keyboard(state.id, state.max_rounds),
         )
 
-    async def toggle_category(self, query, context: ContextTypes.DEFAULT_TYPE, data: str):
-        cat_id = data.replace("cat_", "", 1)
+    async def toggle_category(self, query, context: ContextTypes.DEFAULT_TYPE, cat_id: str):
         selected = context.user_data.get("categories", [])
         if cat_id in selected:
             selected.remove(cat_id)
@@ -840,8 +1019,7 @@ class TruthOrDareBot:
             reply_markup=categories_keyboard(selected),
         )
 
-    async def prompt_friend_players(self, query, data: str):
-        game_id = int(data.replace("friend_players_", "", 1))
+    async def prompt_friend_players(self, query, context: ContextTypes.DEFAULT_TYPE, game_id: int):
         state = self.game_logic.get_game_by_id(game_id)
         if not state or state.host_id != query.from_user.id:
             await query.answer("Только создатель комнаты может менять игроков", show_alert=True)
@@ -851,14 +1029,7 @@ class TruthOrDareBot:
             reply_markup=friend_players_keyboard(state.id, state.max_players),
         )
 
-    async def set_friend_players(self, query, data: str):
-        try:
-            _, _, _, game_id_str, value_str = data.split("_", 4)
-            game_id = int(game_id_str)
-            value = int(value_str)
-        except Exception:
-            await query.answer("Некорректные данные игроков", show_alert=True)
-            return
+    async def set_friend_players(self, query, context: ContextTypes.DEFAULT_TYPE, game_id: int, value: int):
         state = self.game_logic.get_game_by_id(game_id)
         if not state or state.host_id != query.from_user.id:
             await query.answer("Только создатель комнаты может менять игроков", show_alert=True)
@@ -869,8 +1040,7 @@ class TruthOrDareBot:
             reply_markup=friend_players_keyboard(state.id, state.max_players),
         )
 
-    async def show_friend_room_panel(self, query, data: str):
-        game_id = int(data.replace("friend_back_", "", 1))
+    async def show_friend_room_panel(self, query, context: ContextTypes.DEFAULT_TYPE, game_id: int):
         state = self.game_logic.get_game_by_id(game_id)
         if not state or state.host_id != query.from_user.id:
             await query.answer("Комната недоступна", show_alert=True)
@@ -903,25 +1073,20 @@ class TruthOrDareBot:
             "Теперь поиск игр будет учитывать твои предпочтения.",
         )
 
-    async def set_gender(self, query, context: ContextTypes.DEFAULT_TYPE, data: str):
+    async def set_gender(self, query, context: ContextTypes.DEFAULT_TYPE, gender_key: str):
         user = query.from_user
         mapping = {
-            "gender_male": "Мужской",
-            "gender_female": "Женский",
-            "gender_other": "Другой",
+            "male": "Мужской",
+            "female": "Женский",
+            "other": "Другой",
         }
-        gender = mapping.get(data, "Не указан")
+        gender = mapping.get(gender_key, "Не указан")
         db.update_user(user.id, gender=gender)
         await query.edit_message_text(
             f"Пол обновлён: {gender}",
         )
 
-    async def send_task(self, query, context: ContextTypes.DEFAULT_TYPE, data: str, kind: str):
-        parts = data.split("_")
-        if len(parts) < 2:
-            await query.edit_message_text("Ошибка формата данных игры.")
-            return
-        game_id = int(parts[1])
+    async def send_task(self, query, context: ContextTypes.DEFAULT_TYPE, kind: str, game_id: int):
         game_state = self.game_logic.get_game_by_id(game_id)
         if not game_state:
             await query.edit_message_text("Игра не найдена или уже завершена.")
@@ -940,54 +1105,33 @@ class TruthOrDareBot:
             choice_text = "действие"
         player_name = query.from_user.first_name or query.from_user.username or str(user_id)
 
-        pending = {
-            "game_id": game_id,
-            "player_id": user_id,
-            "player_name": player_name,
-        }
-        context.user_data["pending_answer"] = pending
-        self.pending_answers[user_id] = pending
-
-        await query.edit_message_text(
-            f"{prefix}. Ответь сообщением.",
-        )
-
-        try:
-            personal = await context.bot.send_message(
-                chat_id=user_id,
-                text=f"{prefix}:\n\n{task_text}",
-            )
-            self.register_owned_message(personal, user_id)
-        except Exception as e:
-            logger.error(f"Не удалось отправить задание игроку {user_id}: {e}")
+        self.game_logic.pending.set(user_id, game_id, player_name)
 
         broadcast_text = (
             f"🎲 {player_name} выбрал(а) {choice_text}.\n\n"
             f"{prefix}:\n\n{task_text}"
         )
-
+        game_state.panels[user_id] = query.message.message_id
+        out = self._outbox()
         for uid in game_state.players:
             if uid == user_id:
-                continue
-            try:
-                await context.bot.send_message(
-                    chat_id=uid,
-                    text=broadcast_text,
+                self._panel(
+                    out,
+                    game_state,
+                    uid,
+                    f"{prefix}:\n\n{task_text}\n\nОтветь сообщением.",
+                    priority=PRIORITY_TURN,
                 )
-            except Exception as e:
-                logger.error(f"Не удалось отправить вопрос игроку {uid}: {e}")
+            else:
+                self._panel(out, game_state, uid, broadcast_text)
+        await self._flush(context, out, "задание", game_state)
 
         if kind == "truth":
             db.increment_counters(user_id, truth_delta=1)
         else:
             db.increment_counters(user_id, dares_delta=1)
 
-    async def continue_turn(self, query, context: ContextTypes.DEFAULT_TYPE, data: str):
-        parts = data.split("_")
-        if len(parts) < 2:
-            await query.edit_message_text("Ошибка формата данных игры.")
-            return
-        game_id = int(parts[1])
+    async def continue_turn(self, query, context: ContextTypes.DEFAULT_TYPE, game_id: int):
         game_state = self.game_logic.get_game_by_id(game_id)
         if not game_state:
             await query.edit_message_text("Игра не найдена или уже завершена.")
@@ -998,45 +1142,13 @@ class TruthOrDareBot:
             await query.answer("Передать ход может только текущий игрок", show_alert=True)
             return
 
-        await query.edit_message_text("Ход передан следующему игроку.")
-
-        next_player = self.game_logic.next_turn_random(game_id)
-        if next_player is None:
-            self.game_logic.finish_game(game_id)
-            for uid in game_state.players:
-                try:
-                    await context.bot.send_message(
-                        chat_id=uid,
-                        text="🏁 Игра завершена. Лимит раундов исчерпан.",
-                    )
-                except Exception as e:
-                    logger.error(f"Не удалось уведомить игрока {uid} о завершении: {e}")
-            return
-
-        for uid in game_state.players:
-            try:
-                if uid == next_player:
-                    text = "Теперь твой ход. Выбирай «Правда» или «Действие»."
-                    msg = await context.bot.send_message(
-                        chat_id=uid,
-                        text=text,
-                        reply_markup=game_action_keyboard(game_id, True),
-                    )
-                    self.register_owned_message(msg, uid)
-                else:
-                    await context.bot.send_message(
-                        chat_id=uid,
-                        text="Ход переходит другому игроку. Ожидай своей очереди.",
-                    )
-            except Exception as e:
-                logger.error(f"Не удалось уведомить игрока {uid} о ходе: {e}")
+        game_state.panels[user_id] = query.message.message_id
+        out = self._outbox()
+        self._panel(out, game_state, user_id, "Ход передан следующему игроку.")
+        await self._advance_turn(game_state, context, out)
+        await self._flush(context, out, "смену хода", game_state)
 
-    async def skip_turn(self, query, context: ContextTypes.DEFAULT_TYPE, data: str):
-        parts = data.split("_")
-        if len(parts) < 2:
-            await query.edit_message_text("Ошибка формата данных игры.")
-            return
-        game_id = int(parts[1])
+    async def skip_turn(self, query, context: ContextTypes.DEFAULT_TYPE, game_id: int):
         game_state = self.game_logic.get_game_by_id(game_id)
         if not game_state:
             await query.edit_message_text("Игра не найдена или уже завершена.")
@@ -1046,45 +1158,92 @@ class TruthOrDareBot:
         if current_player is not None and user_id != current_player:
             await query.answer("Сейчас ход другого игрока", show_alert=True)
             return
-        await query.edit_message_text(
-            "⏭️ Задание пропущено. Ход переходит другому игроку."
-        )
-        next_player = self.game_logic.next_turn_random(game_id)
+        self.game_logic.record_event(game_id, SKIPPED, user_id)
+        self.game_logic.reset_timeouts(game_id, user_id)
+        game_state.panels[user_id] = query.message.message_id
+        out = self._outbox()
+        self._panel(out, game_state, user_id, "⏭️ Задание пропущено.")
+        await self._advance_turn(game_state, context, out)
+        await self._flush(context, out, "смену хода", game_state)
+
+    async def _advance_turn(
+        self,
+        game_state,
+        context: ContextTypes.DEFAULT_TYPE,
+        out: MessageCoalescer | None = None,
+    ):
+        # Если out передан, сообщения только добавляются в него, а отправляет
+        # их вызывающий код вместе с остальными сообщениями апдейта.
+        own_outbox = out is None
+        if own_outbox:
+            out = self._outbox()
+        game_id = game_state.id
+        next_player = self.game_logic.next_turn(game_id)
+        logger.debug("[GAME] Передача хода в игре %s. Следующий игрок: %s", game_id, next_player)
         if next_player is None:
-            self.game_logic.finish_game(game_id)
+            self.game_logic.finish_game(game_id, reason="rounds_limit")
+            for uid in game_state.players:
+                self._panel(out, game_state, uid, "🏁 Игра завершена. Лимит раундов исчерпан.")
+        else:
             for uid in game_state.players:
-                try:
-                    await context.bot.send_message(
-                        chat_id=uid,
-                        text="🏁 Игра завершена. Лимит раундов исчерпан.",
-                    )
-                except Exception as e:
-                    logger.error(f"Не удалось уведомить игрока {uid} о завершении: {e}")
-            return
-        for uid in game_state.players:
-            try:
                 if uid == next_player:
-                    text = "Теперь твой ход. Выбирай «Правда» или «Действие»."
-                    msg = await context.bot.send_message(
-                        chat_id=uid,
-                        text=text,
-                        reply_markup=game_action_keyboard(game_id, True),
+                    self._panel(
+                        out,
+                        game_state,
+                        uid,
+                        "Теперь твой ход. Выбирай «Правда» или «Действие».",
+                        priority=PRIORITY_TURN,
                     )
-                    self.register_owned_message(msg, uid)
                 else:
-                    await context.bot.send_message(
-                        chat_id=uid,
-                        text="Ход переходит другому игроку. Ожидай своей очереди.",
+                    self._panel(
+                        out,
+                        game_state,
+                        uid,
+                        "Ход переходит другому игроку. Ожидай своей очереди.",
+                        priority=PRIORITY_LOW,
                     )
-            except Exception as e:
-                logger.error(f"Не удалось уведомить игрока {uid} о ходе: {e}")
+        if own_outbox:
+            await self._flush(context, out, "смену хода", game_state)
+
+    async def check_turn_deadlines(self, context: ContextTypes.DEFAULT_TYPE):
+        for game_state in self.game_logic.expired_turns():
+            async with self.game_locks.hold(game_state.id):
+                # Пока ждали замок, игрок мог успеть сходить (дедлайн
+                # перезапущен) или игра закончилась.
+                if (
+                    self.game_logic.get_game_by_id(game_state.id) is not game_state
+                    or game_state.turn_deadline is not None
+                ):
+                    continue
+                await self._expire_turn(game_state, context)
+
+    async def _expire_turn(self, game_state, context: ContextTypes.DEFAULT_TYPE):
+        game_id = game_state.id
+        afk_id = game_state.current_player
+        strikes = self.game_logic.register_timeout(game_id, afk_id)
+        self.game_logic.pending.pop(afk_id)
+        if strikes >= Config.MAX_TURN_TIMEOUTS:
+            self.game_logic.remove_player(game_id, afk_id)
+            afk_text = "⛔ Ты исключён из игры: слишком много пропущенных ходов."
+            others_text = "⛔ Игрок исключён из игры за бездействие."
+        else:
+            afk_text = "⏰ Время на ход вышло, ход пропущен."
+            others_text = "⏰ Игрок не сделал ход вовремя, ход пропущен."
+        log_action("Таймаут хода в игре %s: игрок %s, пропусков подряд %s", game_id, afk_id, strikes)
+        out = self._outbox()
+        self._panel(out, game_state, afk_id, afk_text, keyboard=afk_id in game_state.players)
+        for uid in game_state.players:
+            if uid != afk_id:
+                self._panel(out, game_state, uid, others_text, priority=PRIORITY_LOW)
+        if len(game_state.players) < 2:
+            self.game_logic.finish_game(game_id, reason="abandoned")
+            for uid in game_state.players:
+                self._panel(out, game_state, uid, "🏁 Игра завершена: не осталось соперников.")
+        else:
+            await self._advance_turn(game_state, context, out)
+        await self._flush(context, out, "таймаут хода", game_state)
 
-    async def end_game(self, query, context: ContextTypes.DEFAULT_TYPE, data: str):
-        parts = data.split("_")
-        if len(parts) < 2:
-            await query.edit_message_text("Ошибка формата данных игры.")
-            return
-        game_id = int(parts[1])
+    async def end_game(self, query, context: ContextTypes.DEFAULT_TYPE, game_id: int):
         game_state = self.game_logic.get_game_by_id(game_id)
         if not game_state:
             await query.edit_message_text("Игра уже завершена.")
@@ -1093,18 +1252,15 @@ class TruthOrDareBot:
         if user_id not in game_state.players:
             await query.answer("Ты не участвуешь в этой игре", show_alert=True)
             return
-        self.game_logic.finish_game(game_id)
-        await query.edit_message_text("🏁 Игра завершена. Спасибо за игру!")
+        self.game_logic.finish_game(game_id, reason="ended_by_player")
+        game_state.panels[user_id] = query.message.message_id
+        out = self._outbox()
         for uid in game_state.players:
             if uid == user_id:
-                continue
-            try:
-                await context.bot.send_message(
-                    chat_id=uid,
-                    text="🏁 Игра была завершена одним из игроков.",
-                )
-            except Exception as e:
-                logger.error(f"Не удалось уведомить игрока {uid} о завершении: {e}")
+                self._panel(out, game_state, uid, "🏁 Игра завершена. Спасибо за игру!")
+            else:
+                self._panel(out, game_state, uid, "🏁 Игра была завершена одним из игроков.")
+        await self._flush(context, out, "завершение игры", game_state)
 
     async def start_gender_search_menu(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         user_data = db.get_user(update.effective_user.id)
@@ -1199,9 +1355,12 @@ class TruthOrDareBot:
         await self.notify_game_start(game_state, context)
 
     async def update_search_gender_preference(
-        self, query, context: ContextTypes.DEFAULT_TYPE, data: str
+        self, query, context: ContextTypes.DEFAULT_TYPE, option: int
     ):
-        gender_value = data.replace("pref_gender_", "", 1)
+        if option >= len(SEARCH_GENDER_OPTIONS):
+            await query.answer("Неизвестный вариант", show_alert=True)
+            return
+        gender_value = SEARCH_GENDER_OPTIONS[option][0]
         db.update_user(query.from_user.id, search_gender=gender_value)
         user_data = db.get_user(query.from_user.id) or {}
         await query.edit_message_text(
@@ -1262,11 +1421,11 @@ class TruthOrDareBot:
             f"👥 {joiner_name} вошёл в комнату.\n"
             f"Игроков сейчас: {len(game_state.players)}/{game_state.max_players}."
         )
-        for uid in game_state.players:
-            try:
-                await context.bot.send_message(chat_id=uid, text=note)
-            except Exception as e:
-                logger.error(f"Не удалось уведомить игрока {uid} о входе в комнату: {e}")
+        await self._broadcast(
+            context,
+            [(uid, {"text": note, "rate_limit_args": PRIORITY_LOW}) for uid in game_state.players],
+            "вход в комнату",
+        )
 
     def _format_premium_until(self, until_value) -> str:
         if not until_value:
@@ -1311,21 +1470,20 @@ class TruthOrDareBot:
             start_parameter="premium",
         )
 
-    async def handle_premium_callback(self, query, context: ContextTypes.DEFAULT_TYPE, data: str):
-        if data == "premium_status":
-            user = db.get_user(query.from_user.id)
-            if user and user.get("is_premium"):
-                until = self._format_premium_until(user.get("premium_until"))
-                await query.edit_message_text(
-                    f"👑 У тебя уже есть премиум.\nДействует до: {until}",
-                )
-            else:
-                await query.edit_message_text(
-                    "У тебя пока нет премиума.\nВыбери подходящий вариант покупки.",
-                    reply_markup=premium_keyboard(),
-                )
-            return
-        plan = data.replace("premium_", "", 1)
+    async def show_premium_status(self, query, context: ContextTypes.DEFAULT_TYPE):
+        user = db.get_user(query.from_user.id)
+        if user and user.get("is_premium"):
+            until = self._format_premium_until(user.get("premium_until"))
+            await query.edit_message_text(
+                f"👑 У тебя уже есть премиум.\nДействует до: {until}",
+            )
+        else:
+            await query.edit_message_text(
+                "У тебя пока нет премиума.\nВыбери подходящий вариант покупки.",
+                reply_markup=premium_keyboard(),
+            )
+
+    async def handle_premium_callback(self, query, context: ContextTypes.DEFAULT_TYPE, plan: int | str):
         if plan == "trial":
             until = self._grant_premium(query.from_user.id, days=3)
             await query.edit_message_text(
@@ -1337,7 +1495,7 @@ class TruthOrDareBot:
                 reply_markup=main_menu(),
             )
             return
-        await self._send_premium_invoice(query, context, plan)
+        await self._send_premium_invoice(query, context, str(plan))
 
     async def precheckout_check(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         query = update.pre_checkout_query
@@ -1359,7 +1517,192 @@ class TruthOrDareBot:
             )
             return
 
+    async def log_outbound_stats(self, context: ContextTypes.DEFAULT_TYPE):
+        limiter = context.bot.rate_limiter
+        if limiter is None:
+            return
+        stats = limiter.stats()
+        logger.info(
+            "Исходящая очередь: в очереди %s (макс %s), ждут %s, отправлено %s, "
+            "повторов %s, флуд-лимитов %s, ожидание ср %.0f мс / p95 %.0f мс / макс %.0f мс",
+            stats["queue_depth"],
+            stats["max_queue_depth"],
+            stats["waiting"],
+            stats["sent"],
+            stats["retries"],
+            stats["retry_after_events"],
+            stats["wait_avg_ms"],
+            stats["wait_p95_ms"],
+            stats["wait_max_ms"],
+        )
+        owners = self.message_owners.stats()
+        logger.info(
+            "Владельцы панелей: записей %s, попаданий %s, промахов %s, вытеснено %s, истекло %s",
+            owners["size"],
+            owners["hits"],
+            owners["misses"],
+            owners["evicted"],
+            owners["expired"],
+        )
+        users, games = self.user_locks.stats(), self.game_locks.stats()
+        logger.info(
+            "Очерёдность апдейтов: замков пользователей %s (ожиданий %s), замков игр %s (ожиданий %s)",
+            users["active"],
+            users["contended"],
+            games["active"],
+            games["contended"],
+        )
+        keyboards = keyboard_cache_stats().values()
+        logger.info(
+            "Кеш клавиатур: разметок %s, попаданий %s, промахов %s",
+            sum(entry["size"] for entry in keyboards),
+            sum(entry["hits"] for entry in keyboards),
+            sum(entry["misses"] for entry in keyboards),
+        )
+        throttle = self.throttle.stats()
+        logger.info(
+            "Входящие апдейты: пропущено %s, отброшено %s, склеено повторов %s, пользователей %s; "
+            "отброшено по действиям: %s",
+            throttle["allowed"],
+            throttle["throttled"],
+            throttle["coalesced"],
+            throttle["users"],
+            ", ".join(
+                f"{route} {count}"
+                for route, count in sorted(throttle["by_route"].items(), key=lambda item: -item[1])
+            ) or "—",
+        )
+        lag = self.watchdog.percentiles()
+        if lag:
+            logger.info(
+                "Задержка цикла событий: %s; блокировок %s",
+                ", ".join(f"p{float(quantile) * 100:g} {value * 1000:.1f} мс" for quantile, value in lag),
+                self.watchdog.stall_count,
+            )
+
+    async def profile_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        # /profile sample 200 — семплирование следующих 200 апдейтов;
+        # /profile trace 30s — cProfile на 30 секунд; /profile stop — досрочно.
+        # Отчёт приходит файлом. Остальным пользователям команда не отвечает.
+        user = update.effective_user
+        if user is None or user.id not in Config.ADMIN_IDS:
+            return
+        args = context.args or []
+        if args[:1] == ["stop"]:
+            if not self.profiler.active:
+                await update.message.reply_text("Профилирование не запущено.")
+                return
+            await self._finish_profile(context.bot, self.profiler.session)
+            return
+        if not args or args[0] not in PROFILE_MODES:
+            status = (
+                f"идёт сессия #{self.profiler.session} ({self.profiler.mode}), апдейтов {self.profiler.updates}"
+                if self.profiler.active
+                else "не запущено"
+            )
+            await update.message.reply_text(
+                f"Профилирование: {status}.\n"
+                "/profile sample 200 — семплирование следующих 200 апдейтов\n"
+                "/profile trace 30s — cProfile на 30 секунд\n"
+                "/profile stop — остановить и получить отчёт"
+            )
+            return
+        limit = args[1] if len(args) > 1 else "100"
+        try:
+            if limit.endswith("s"):
+                updates, seconds = None, min(float(limit[:-1]), Config.PROFILE_MAX_SECONDS)
+            else:
+                updates, seconds = min(int(limit), Config.PROFILE_MAX_UPDATES), Config.PROFILE_MAX_SECONDS
+        except ValueError:
+            await update.message.reply_text("Лимит — число апдейтов (200) или секунд (30s).")
+            return
+        if seconds <= 0 or (updates is not None and updates <= 0):
+            await update.message.reply_text("Лимит должен быть больше нуля.")
+            return
+        try:
+            session = self.profiler.start(args[0], updates=updates, seconds=seconds)
+        except RuntimeError:
+            await update.message.reply_text("Профилирование уже идёт: /profile stop, чтобы остановить.")
+            return
+        self._profile_chat = update.effective_chat.id
+        # Сессия по числу апдейтов тоже ограничена по времени: при слабой
+        # нагрузке отчёт придёт не позже PROFILE_MAX_SECONDS.
+        context.job_queue.run_once(self._profile_timeout, when=seconds, data=session, name="profile_timeout")
+        logger.warning("Профилирование #%s (%s) запущено администратором %s", session, args[0], user.id)
+        await update.message.reply_text(
+            f"Профилирование #{session} ({args[0]}) запущено на воркере {Config.WORKER_ID}: "
+            + (f"{updates} апдейтов" if updates is not None else f"{seconds:.0f} с")
+            + ". Отчёт придёт файлом."
+        )
+
+    async def _profile_timeout(self, context: ContextTypes.DEFAULT_TYPE):
+        await self._finish_profile(context.bot, context.job.data)
+
+    async def _finish_profile(self, bot, session: int):
+        # Может вызываться несколько раз (лимит, таймер, /profile stop):
+        # отчёт отправляет только первый вызов для своей сессии.
+        if not self.profiler.active or self.profiler.session != session:
+            return
+        report = self.profiler.stop()
+        logger.warning("Профилирование #%s завершено", session)
+        if self._profile_chat is None:
+            return
+        await bot.send_document(
+            chat_id=self._profile_chat,
+            document=report.encode(),
+            filename=f"profile-{session}-worker{Config.WORKER_ID}.txt",
+            caption=f"Профилирование #{session}: апдейтов {self.profiler.updates}",
+        )
+
+    async def post_init(self, app: Application):
+        await self.journal.start()
+        if Config.LOOP_LAG_THRESHOLD > 0:
+            await self.watchdog.start()
+        if Config.METRICS_PORT:
+            self.metrics_server = MetricsServer(
+                registry, Config.METRICS_HOST, Config.METRICS_PORT + Config.WORKER_ID
+            )
+            try:
+                await self.metrics_server.start()
+            except OSError as e:
+                logger.warning("Сервер метрик не запущен: %s", e)
+                self.metrics_server = None
+        if Config.WARM_START:
+            with timed_phase("Запуск", "восстановление игр"):
+                payload = await asyncio.to_thread(db.take_state_snapshot, Config.WORKER_ID)
+                if payload:
+                    self.game_logic.restore(json.loads(payload), max_age=Config.SNAPSHOT_MAX_AGE)
+
+    async def post_stop(self, app: Application):
+        # Обработчики уже завершены: состояние больше не меняется.
+        with timed_phase("Остановка", "журнал событий"):
+            await self.journal.stop()
+        if Config.WARM_START:
+            with timed_phase("Остановка", "снимок игр"):
+                snapshot = self.game_logic.snapshot()
+                await asyncio.to_thread(
+                    db.save_state_snapshot,
+                    Config.WORKER_ID,
+                    json.dumps(snapshot, ensure_ascii=False),
+                )
+            logger.info(
+                "Сохранено игр: %s, в поиске: %s, ожидающих ответов: %s",
+                len(snapshot["games"]),
+                len(snapshot["waiting_random"]),
+                len(snapshot["pending"]),
+            )
+
+    async def post_shutdown(self, app: Application):
+        # Журнал останавливается и сбрасывается только в post_stop: там
+        # обработчики уже завершены, и до снимка состояния.
+        if self.metrics_server is not None:
+            await self.metrics_server.stop()
+        await self.watchdog.stop()
+
     async def error_handler(self, update: object, context: ContextTypes.DEFAULT_TYPE):
+        if isinstance(context.error, SendAborted):
+            # Остановка по дедлайну: отброшенные сообщения уже посчитаны в логе.
+            return
         logger.error("Исключение в обработчике:", exc_info=context.error)
         try:
             if update and isinstance(update, Update) and update.effective_chat:
@@ -1371,18 +1714,88 @@ class TruthOrDareBot:
             pass
 
 
+def build_application(bot_logic: TruthOrDareBot, request=None) -> Application:
+    # request — подменный транспорт Bot API (бенчмарки, нагрузочные прогоны).
+    builder = Application.builder().token(Config.BOT_TOKEN)
+    # Вызовы Bot API, кроме долгого getUpdates, идут через MeteredRequest.
+    builder = builder.request(MeteredRequest(request or HTTPXRequest(connection_pool_size=256)))
+    if request is not None:
+        builder = builder.get_updates_request(request)
+    app = (
+        builder
+        .rate_limiter(
+            OutboundRateLimiter(
+                global_rate=Config.OUTBOUND_GLOBAL_RATE,
+                chat_rate=Config.OUTBOUND_CHAT_RATE,
+                chat_burst=Config.OUTBOUND_CHAT_BURST,
+                max_retries=Config.OUTBOUND_MAX_RETRIES,
+            )
+        )
+        .concurrent_updates(Config.CONCURRENT_UPDATES if Config.CONCURRENT_UPDATES > 1 else False)
+        .post_init(bot_logic.post_init)
+        .post_stop(bot_logic.post_stop)
+        .post_shutdown(bot_logic.post_shutdown)
+        .build()
+    )
+    # Первый апдейт после запуска попадает в профиль запуска.
+    app.add_handler(TypeHandler(Update, note_update_started), group=-2)
+    app.add_handler(TypeHandler(Update, note_update_finished), group=1)
+    if Config.THROTTLE_RATE > 0:
+        app.add_handler(TypeHandler(Update, bot_logic.throttle_updates), group=-1)
+    serialized = bot_logic.serialized
+    app.add_handler(CommandHandler("start", serialized(bot_logic.start)))
+    app.add_handler(CommandHandler("join", serialized(bot_logic.join_command)))
+    app.add_handler(CommandHandler("profile", bot_logic.profile_command))
+    app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, serialized(bot_logic.handle_message)))
+    app.add_handler(CallbackQueryHandler(serialized(bot_logic.handle_callback)))
+    app.add_handler(PreCheckoutQueryHandler(serialized(bot_logic.precheckout_check)))
+    app.add_handler(MessageHandler(filters.SUCCESSFUL_PAYMENT, serialized(bot_logic.successful_payment)))
+    app.add_error_handler(bot_logic.error_handler)
+    if Config.TURN_TIMEOUT > 0:
+        app.job_queue.run_repeating(
+            bot_logic.check_turn_deadlines,
+            interval=Config.TURN_CHECK_INTERVAL,
+            first=Config.TURN_CHECK_INTERVAL,
+            name="turn_deadlines",
+        )
+    if Config.OUTBOUND_STATS_INTERVAL > 0:
+        app.job_queue.run_repeating(
+            bot_logic.log_outbound_stats,
+            interval=Config.OUTBOUND_STATS_INTERVAL,
+            first=Config.OUTBOUND_STATS_INTERVAL,
+            name="outbound_stats",
+        )
+    return app
+
+
 def main():
+    Config.prepare()
+    setup_logging()
     log_action("Запуск приложения")
-    app = Application.builder().token(Config.BOT_TOKEN).build()
-    bot_logic = TruthOrDareBot()
-    app.add_handler(CommandHandler("start", bot_logic.start))
-    app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, bot_logic.handle_message))
-    app.add_handler(CallbackQueryHandler(bot_logic.handle_callback))
-    app.add_handler(PreCheckoutQueryHandler(bot_logic.precheckout_check))
-    app.add_handler(MessageHandler(filters.SUCCESSFUL_PAYMENT, bot_logic.successful_payment))
-    app.add_error_handler(bot_logic.error_handler)
-    logger.info("Бот запущен. Ожидание обновлений...")
-    app.run_polling(allowed_updates=Update.ALL_TYPES)
+    with timed_phase("Запуск", "миграции базы"):
+        db.open()
+    if Config.WORKERS > 1:
+        from scaleout import build_intake_application
+
+        app = build_intake_application(Config.WORKERS)
+    else:
+        bot_logic = TruthOrDareBot()
+        app = build_application(bot_logic)
+    if Config.UPDATE_MODE == "webhook":
+        if not Config.WEBHOOK_URL:
+            logger.error("Режим вебхука требует WEBHOOK_URL — публичный адрес, доступный Telegram")
+            return
+        if not Config.WEBHOOK_SECRET_TOKEN:
+            logger.warning("WEBHOOK_SECRET_TOKEN не задан: вебхук примет запросы от кого угодно")
+        logger.info(
+            "Бот запущен в режиме вебхука: %s:%s/%s",
+            Config.WEBHOOK_LISTEN,
+            Config.WEBHOOK_PORT,
+            Config.WEBHOOK_PATH,
+        )
+    else:
+        logger.info("Бот запущен. Ожидание обновлений...")
+    run_application(app)
 
 
 if __name__ == "__main__":
@@ -1391,4 +1804,4 @@ if __name__ == "__main__":
     except KeyboardInterrupt:
         logger.info("Бот остановлен пользователем")
     except Exception as e:
-        logger.error(f"Критическая ошибка: {e}")
+        logger.error("Критическая ошибка: %s", e)
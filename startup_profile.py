@@ -0,0 +1,140 @@
+import logging
+import sys
+import time
+from importlib.abc import MetaPathFinder
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Профиль запуска: время импорта по пакетам и модулям (telegram, database,
+# game_logic…), фазы запуска из lifecycle.timed_phase и задержка первого
+# апдейта. Отчёт пишется в лог дважды: когда бот готов принимать апдейты
+# и когда обработан первый апдейт.
+#
+# Время импорта собственное: вложенные импорты других пакетов вычитаются
+# (импорт telegram не включает время импорта httpx).
+
+
+class _TimedLoader:
+    def __init__(self, loader, name: str, profile: "StartupProfile"):
+        self._loader = loader
+        self._name = name
+        self._profile = profile
+
+    def create_module(self, spec):
+        return self._loader.create_module(spec)
+
+    def exec_module(self, module):
+        self._profile._enter_import()
+        started = time.perf_counter()
+        try:
+            self._loader.exec_module(module)
+        finally:
+            self._profile._leave_import(self._name, time.perf_counter() - started)
+
+    def __getattr__(self, name):
+        return getattr(self._loader, name)
+
+
+class _ImportTimer(MetaPathFinder):
+    def __init__(self, profile: "StartupProfile"):
+        self._profile = profile
+
+    def find_spec(self, fullname, path, target=None):
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, "find_spec"):
+                continue
+            spec = finder.find_spec(fullname, path, target)
+            if spec is None:
+                continue
+            if spec.loader is not None and hasattr(spec.loader, "exec_module"):
+                # Подмодули считаются в свой пакет: telegram.ext — в telegram.
+                spec.loader = _TimedLoader(spec.loader, fullname.partition(".")[0], self._profile)
+            return spec
+        return None
+
+
+class StartupProfile:
+    def __init__(self, clock=time.perf_counter):
+        self._clock = clock
+        self.started = clock()
+        self.imports: Dict[str, float] = {}
+        self.phases: List[Tuple[str, float]] = []
+        self.ready_at: Optional[float] = None
+        self.first_update: Optional[Tuple[int, float]] = None  # (update_id, когда пришёл)
+        self.first_update_done = False
+        self._finder: Optional[_ImportTimer] = None
+        self._nested: List[float] = []
+
+    # Импорты
+
+    def install(self):
+        # Вызывается до остальных импортов точки входа.
+        if self._finder is None:
+            self._finder = _ImportTimer(self)
+            sys.meta_path.insert(0, self._finder)
+
+    def uninstall(self):
+        if self._finder is not None:
+            sys.meta_path.remove(self._finder)
+            self._finder = None
+
+    def _enter_import(self):
+        self._nested.append(0.0)
+
+    def _leave_import(self, name: str, elapsed: float):
+        nested = self._nested.pop()
+        self.imports[name] = self.imports.get(name, 0.0) + elapsed - nested
+        if self._nested:
+            self._nested[-1] += elapsed
+
+    # Фазы
+
+    def record(self, name: str, elapsed: float):
+        self.phases.append((name, elapsed))
+
+    def mark_ready(self):
+        self.ready_at = self._clock()
+        self.uninstall()
+        logger.info("Профиль запуска: %s", self.format_startup())
+
+    def update_started(self, update_id: int):
+        if self.first_update is None:
+            self.first_update = (update_id, self._clock())
+
+    def update_finished(self, update_id: int):
+        if self.first_update_done or self.first_update is None or self.first_update[0] != update_id:
+            return
+        self.first_update_done = True
+        arrived = self.first_update[1]
+        logger.info(
+            "Первый апдейт: пришёл через %.0f мс после запуска (%.0f мс после готовности), "
+            "обработан за %.0f мс",
+            (arrived - self.started) * 1000,
+            (arrived - (self.ready_at or arrived)) * 1000,
+            (self._clock() - arrived) * 1000,
+        )
+
+    def format_startup(self, top: int = 8) -> str:
+        total_imports = sum(self.imports.values())
+        slowest = sorted(self.imports.items(), key=lambda item: -item[1])[:top]
+        parts = [
+            f"импорт {total_imports * 1000:.0f} мс ("
+            + ", ".join(f"{name} {elapsed * 1000:.0f}" for name, elapsed in slowest)
+            + ")"
+        ]
+        parts.extend(f"{name} {elapsed * 1000:.0f} мс" for name, elapsed in self.phases)
+        if self.ready_at is not None:
+            parts.append(f"готов через {(self.ready_at - self.started) * 1000:.0f} мс")
+        return "; ".join(parts)
+
+
+profile = StartupProfile()
+
+
+async def note_update_started(update, context):
+    profile.update_started(update.update_id)
+
+
+async def note_update_finished(update, context):
+    profile.update_finished(update.update_id)
@@ -0,0 +1,134 @@
+import time
+from collections import Counter
+from typing import Dict, Hashable, Optional
+
+from telegram import Update
+
+from callback_data import CallbackDataError, decode
+from outbound import TokenBucket
+
+# Ограничение входящих апдейтов от одного пользователя: ведро токенов на
+# пользователя. Апдейт без токена отбрасывается до обработчиков и базы.
+# Повторное нажатие той же кнопки в том же сообщении в течение repeat_window
+# секунд склеивается с первым (двойной тап) и токен не тратит.
+# О сброшенном текстовом сообщении пользователь узнаёт не чаще раза в
+# notice_interval секунд — иначе само предупреждение стало бы флудом.
+
+KNOWN_COMMANDS = frozenset({"/start", "/join", "/profile"})
+
+
+def update_route(update: Update) -> str:
+    # Метка апдейта для счётчиков: действие кнопки, команда или сообщение.
+    query = update.callback_query
+    if query is not None:
+        try:
+            action, _ = decode(query.data or "")
+        except CallbackDataError:
+            return "callback:?"
+        return f"callback:{action.name}"
+    if update.pre_checkout_query is not None:
+        return "pre_checkout"
+    message = update.message
+    if message is not None and message.successful_payment is not None:
+        return "payment"
+    if message is not None and message.text and message.text.startswith("/"):
+        # Метка — из конечного набора: произвольные команды от пользователей
+        # не должны плодить счётчики.
+        command = message.text.split()[0].split("@")[0]
+        return f"command:{command if command in KNOWN_COMMANDS else 'other'}"
+    return "message"
+
+
+class _UserState:
+    __slots__ = ("bucket", "last_key", "last_at", "noticed_at")
+
+    def __init__(self, bucket: TokenBucket):
+        self.bucket = bucket
+        self.last_key: Optional[Hashable] = None
+        self.last_at = 0.0
+        self.noticed_at: Optional[float] = None
+
+
+class IntakeThrottle:
+    def __init__(
+        self,
+        rate: float = 1.0,
+        burst: float = 5.0,
+        repeat_window: float = 1.0,
+        compact_interval: float = 60.0,
+        notice_interval: float = 10.0,
+        clock=time.monotonic,
+    ):
+        self.rate = rate
+        self.burst = burst
+        self.repeat_window = repeat_window
+        self.compact_interval = compact_interval
+        self.notice_interval = notice_interval
+        self._clock = clock
+        self._users: Dict[int, _UserState] = {}
+        self._last_compaction = clock()
+        # Счётчики по меткам апдейтов
+        self.allowed: Counter = Counter()
+        self.throttled: Counter = Counter()
+        self.coalesced: Counter = Counter()
+
+    def check(self, user_id: int, route: str, repeat_key: Optional[Hashable] = None) -> str:
+        # Возвращает "allowed", "coalesced" или "throttled".
+        now = self._clock()
+        self._compact(now)
+        state = self._users.get(user_id)
+        if state is None:
+            state = self._users[user_id] = _UserState(TokenBucket(self.rate, self.burst, now))
+        if (
+            repeat_key is not None
+            and repeat_key == state.last_key
+            and now - state.last_at < self.repeat_window
+        ):
+            self.coalesced[route] += 1
+            return "coalesced"
+        if state.bucket.take(now) > 0:
+            self.throttled[route] += 1
+            return "throttled"
+        state.last_key = repeat_key
+        state.last_at = now
+        self.allowed[route] += 1
+        return "allowed"
+
+    def should_notice(self, user_id: int) -> bool:
+        # Вызывается после "throttled": сообщить ли пользователю о сбросе.
+        state = self._users.get(user_id)
+        if state is None:
+            return False
+        now = self._clock()
+        if state.noticed_at is not None and now - state.noticed_at < self.notice_interval:
+            return False
+        state.noticed_at = now
+        return True
+
+    def _compact(self, now: float):
+        # Полное ведро ничем не отличается от нового — такие записи удаляем.
+        if now - self._last_compaction < self.compact_interval:
+            return
+        self._last_compaction = now
+        idle = [
+            user_id
+            for user_id, state in self._users.items()
+            if state.bucket.is_full(now) and now - state.last_at >= self.repeat_window
+        ]
+        for user_id in idle:
+            del self._users[user_id]
+
+    def __len__(self) -> int:
+        return len(self._users)
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "users": len(self._users),
+            "allowed": sum(self.allowed.values()),
+            "throttled": sum(self.throttled.values()),
+            "coalesced": sum(self.coalesced.values()),
+            "by_route": {
+                route: self.throttled[route] + self.coalesced[route]
+                for route in self.throttled.keys() | self.coalesced.keys()
+            },
+        }
@@ -0,0 +1,30 @@
+import heapq
+import time
+from typing import List, Tuple
+
+
+# Одна очередь с приоритетом на все игры вместо отдельного таймера на каждую.
+# Устаревшие записи (ход уже сменился или дедлайн продлён) не удаляются сразу,
+# а отбрасываются при извлечении — вызывающий сверяет дедлайн с состоянием игры.
+class TurnDeadlines:
+    def __init__(self, clock=time.monotonic):
+        self._clock = clock
+        self._heap: List[Tuple[float, int]] = []
+
+    def now(self) -> float:
+        return self._clock()
+
+    def schedule(self, game_id: int, timeout: float) -> float:
+        deadline = self._clock() + timeout
+        heapq.heappush(self._heap, (deadline, game_id))
+        return deadline
+
+    def pop_expired(self) -> List[Tuple[float, int]]:
+        now = self._clock()
+        expired = []
+        while self._heap and self._heap[0][0] <= now:
+            expired.append(heapq.heappop(self._heap))
+        return expired
+
+    def __len__(self) -> int:
+        return len(self._heap)